@@ -82,7 +82,7 @@ async def overview():
         "queries_7d": queries_7d,
         "total_cost_usd": round(_safe_float(summary.get("total_cost_usd", 0)), 4),
         "avg_cost_per_query": round(_safe_float(summary.get("avg_cost_per_query", 0)), 4),
-        "success_rate": round(_safe_float(summary.get("success_rate", 0)), 2),
+        "success_rate": round(_safe_float(summary.get("success_rate", 0)) * 100, 2),
         "tier_distribution": {r["tier"]: r["cnt"] for r in tier_dist},
         "funnel": user_analytics.get_funnel(),
     }
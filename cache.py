@@ -9,8 +9,16 @@ import os
 import json
 import hashlib
 import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from typing import Optional, Any
 
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+
 logger = logging.getLogger("cache")
 
 _redis = None
@@ -65,6 +73,17 @@ def is_cache_available() -> bool:
     return _redis is not None
 
 
+def _dumps(value: Any):
+    """Serialise a cached value (orjson when installed, else stdlib json)."""
+    if orjson:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=str)
+
+
+def _loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
 def _make_key(tool_name: str, params: dict) -> str:
     """Create a deterministic cache key from tool name and params."""
     param_str = json.dumps(params, sort_keys=True, default=str)
@@ -85,7 +104,7 @@ async def get_cached(tool_name: str, params: dict) -> Optional[Any]:
         data = await _redis.get(key)
         if data:
             logger.debug("Cache HIT: %s", key)
-            return json.loads(data)
+            return _loads(data)
         logger.debug("Cache MISS: %s", key)
         return None
     except Exception as exc:
@@ -105,7 +124,7 @@ async def set_cached(tool_name: str, params: dict, result: Any, ttl: Optional[in
 
     try:
         key = _make_key(tool_name, params)
-        await _redis.setex(key, effective_ttl, json.dumps(result, default=str))
+        await _redis.setex(key, effective_ttl, _dumps(result))
         logger.debug("Cache SET: %s (TTL=%ds)", key, effective_ttl)
     except Exception as exc:
         logger.debug("Cache set error: %s", exc)
@@ -137,3 +156,354 @@ async def flush_all() -> None:
             logger.info("Flushed %d cache entries", len(keys))
     except Exception as exc:
         logger.warning("Cache flush error: %s", exc)
+
+
+# =====================================================
+# QUERY RESPONSE CACHE
+# =====================================================
+# Final answers keyed on the normalised query text so a repeated question
+# ("Analyze Marina Gate Tower 1") skips the Claude loop. Follow-ups are keyed
+# on their conversation context too, so the same words after a different
+# exchange don't share an answer. Same TTL as the market-data tools the
+# answers are built from.
+#
+# Recent answers are also kept in process memory: hits skip the Redis
+# round-trip, and repeats are still served when Redis is down.
+
+QUERY_CACHE_TTL = 3600
+QUERY_MEMO_MAX = 2048
+_query_memo: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, response)
+
+
+def _query_key(query: str, conversation_context: Optional[str] = None) -> str:
+    normalized = " ".join(query.lower().split())
+    if conversation_context:
+        normalized = f"{conversation_context}\x00{normalized}"
+    return f"tv:q:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+def _memo_response(key: str, response: dict, expires_at: float) -> None:
+    _query_memo[key] = (expires_at, response)
+    _query_memo.move_to_end(key)
+    if len(_query_memo) > QUERY_MEMO_MAX:
+        _query_memo.popitem(last=False)
+
+
+async def get_cached_response(query: str, conversation_context: Optional[str] = None) -> Optional[dict]:
+    """Get a cached final response for a query, or None."""
+    key = _query_key(query, conversation_context)
+    memo = _query_memo.get(key)
+    if memo is not None:
+        if memo[0] > time.time():
+            _query_memo.move_to_end(key)
+            return memo[1]
+        del _query_memo[key]
+
+    if not _redis:
+        return None
+
+    try:
+        data = await _redis.get(key)
+        if not data:
+            return None
+        response = _loads(data)
+        # The Redis entry may be older; a short memo lifetime keeps the two
+        # from outliving each other by much
+        _memo_response(key, response, time.time() + QUERY_CACHE_TTL / 4)
+        return response
+    except Exception as exc:
+        logger.debug("Query cache get error: %s", exc)
+        return None
+
+
+async def set_cached_response(query: str, response: dict, conversation_context: Optional[str] = None) -> None:
+    """Cache a final response for a query (in memory, and in Redis if connected)."""
+    key = _query_key(query, conversation_context)
+    _memo_response(key, response, time.time() + QUERY_CACHE_TTL)
+
+    if not _redis:
+        return
+
+    try:
+        await _redis.setex(key, QUERY_CACHE_TTL, _dumps(response))
+    except Exception as exc:
+        logger.debug("Query cache set error: %s", exc)
+
+
+# =====================================================
+# DURABLE PENDING QUEUES
+# =====================================================
+# Redis lists holding work that was acknowledged but not yet processed, so
+# it can be replayed after a crash. Kept outside the tv:* namespace so
+# flush_all() never drops them.
+
+def _pending_key(queue: str) -> str:
+    return f"tvq:{queue}"
+
+
+async def push_pending(queue: str, item: str) -> bool:
+    """Persist an item on a pending queue. Returns False if Redis is unavailable."""
+    if not _redis:
+        return False
+
+    try:
+        await _redis.rpush(_pending_key(queue), item)
+        return True
+    except Exception as exc:
+        logger.warning("Pending queue push error (%s): %s", queue, exc)
+        return False
+
+
+async def remove_pending(queue: str, item: str) -> None:
+    """Remove a processed item from a pending queue."""
+    if not _redis:
+        return
+
+    try:
+        await _redis.lrem(_pending_key(queue), 1, item)
+    except Exception as exc:
+        logger.warning("Pending queue remove error (%s): %s", queue, exc)
+
+
+async def get_pending(queue: str) -> list:
+    """Return all items still on a pending queue, oldest first."""
+    if not _redis:
+        return []
+
+    try:
+        return await _redis.lrange(_pending_key(queue), 0, -1)
+    except Exception as exc:
+        logger.warning("Pending queue read error (%s): %s", queue, exc)
+        return []
+
+
+# =====================================================
+# DAILY QUERY QUOTAS
+# =====================================================
+# Per-user counters for the bot's no-database fallback, so quota state
+# survives restarts and is shared between workers. One key per user per day;
+# the date in the key does the daily reset and the TTL cleans up.
+
+QUOTA_KEY_TTL_SECONDS = 2 * 86400
+
+# Today's key suffix, reformatted only when the local date rolls over
+_quota_day = ""
+_quota_day_ends = 0.0
+
+
+def _quota_key(user_id: int) -> str:
+    global _quota_day, _quota_day_ends
+    now = time.time()
+    if now >= _quota_day_ends:
+        today = date.today()
+        _quota_day = today.isoformat()
+        _quota_day_ends = datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+    return f"tvu:quota:{user_id}:{_quota_day}"
+
+
+async def get_daily_quota(user_id: int) -> Optional[int]:
+    """Return today's query count for a user, or None if Redis is unavailable."""
+    if not _redis:
+        return None
+
+    try:
+        used = await _redis.get(_quota_key(user_id))
+        return int(used) if used else 0
+    except Exception as exc:
+        logger.debug("Quota read error: %s", exc)
+        return None
+
+
+async def incr_daily_quota(user_id: int) -> Optional[int]:
+    """Count one query against today's quota. Returns the new count, or None."""
+    if not _redis:
+        return None
+
+    try:
+        key = _quota_key(user_id)
+        # MULTI/EXEC: the count and its TTL land together, in one round-trip
+        async with _redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, QUOTA_KEY_TTL_SECONDS)
+            used, _ = await pipe.execute()
+        return used
+    except Exception as exc:
+        logger.debug("Quota increment error: %s", exc)
+        return None
+
+
+async def reset_daily_quota(user_id: int) -> bool:
+    """Clear today's count for a user. Returns False if Redis is unavailable."""
+    if not _redis:
+        return False
+
+    try:
+        await _redis.delete(_quota_key(user_id))
+        return True
+    except Exception as exc:
+        logger.debug("Quota reset error: %s", exc)
+        return False
+
+
+# =====================================================
+# FALLBACK USER RECORDS
+# =====================================================
+# Profiles of users the bot registered while the database was unavailable,
+# so a restart doesn't treat all of them as new signups. Postgres remains
+# the real user store; these only cover the no-DB mode.
+
+def _user_key(user_id: int) -> str:
+    return f"tvu:user:{user_id}"
+
+
+async def create_fallback_user(user_id: int, record: dict) -> Optional[bool]:
+    """
+    Store a user's record unless one exists. Returns True if it was created,
+    False if the user was already known, None if Redis is unavailable.
+    """
+    if not _redis:
+        return None
+
+    try:
+        return bool(await _redis.set(_user_key(user_id), _dumps(record), nx=True))
+    except Exception as exc:
+        logger.debug("Fallback user create error: %s", exc)
+        return None
+
+
+async def get_fallback_user(user_id: int) -> Optional[dict]:
+    """Return a stored fallback user record, or None."""
+    if not _redis:
+        return None
+
+    try:
+        data = await _redis.get(_user_key(user_id))
+        return _loads(data) if data else None
+    except Exception as exc:
+        logger.debug("Fallback user read error: %s", exc)
+        return None
+
+# =====================================================
+# INLINE BUTTON PAYLOADS
+# =====================================================
+# Telegram caps callback_data at 64 bytes, so the bot's result buttons carry
+# a short id and the query text they act on is stored here. Outside tv:* so
+# flush_all() doesn't break buttons on messages already sent.
+
+CALLBACK_PAYLOAD_TTL = 86400
+
+
+def _callback_key(ref: str) -> str:
+    return f"tvcb:{ref}"
+
+
+async def set_callback_payload(ref: str, payload: str) -> bool:
+    """Store a button payload. Returns False if Redis is unavailable."""
+    if not _redis:
+        return False
+
+    try:
+        await _redis.setex(_callback_key(ref), CALLBACK_PAYLOAD_TTL, payload)
+        return True
+    except Exception as exc:
+        logger.debug("Callback payload set error: %s", exc)
+        return False
+
+
+async def get_callback_payload(ref: str) -> Optional[str]:
+    """Return a stored button payload, or None if unknown or expired."""
+    if not _redis:
+        return None
+
+    try:
+        return await _redis.get(_callback_key(ref))
+    except Exception as exc:
+        logger.debug("Callback payload get error: %s", exc)
+        return None
+
+
+# =====================================================
+# TELEGRAM UPDATE STREAMS
+# =====================================================
+# Multi-process bot mode: one poller appends raw updates, worker processes
+# read them through a consumer group and ack once handled. Updates are
+# partitioned by chat so each chat is served by one worker, in order.
+# Outside tv:* so flush_all() never drops them.
+
+UPDATE_STREAM_MAXLEN = 100_000
+UPDATE_STREAM_GROUP = "workers"
+
+
+def _update_stream_key(partition: int) -> str:
+    return f"tvs:updates:{partition}"
+
+
+async def publish_updates(items: list) -> bool:
+    """
+    Append (partition, payload) pairs to the update streams in one round-trip.
+    Returns False if Redis is unavailable or the write failed.
+    """
+    if not _redis:
+        return False
+
+    try:
+        async with _redis.pipeline(transaction=False) as pipe:
+            for partition, payload in items:
+                pipe.xadd(
+                    _update_stream_key(partition), {"u": payload},
+                    maxlen=UPDATE_STREAM_MAXLEN, approximate=True,
+                )
+            await pipe.execute()
+        return True
+    except Exception as exc:
+        logger.warning("Update stream publish error: %s", exc)
+        return False
+
+
+async def ensure_update_group(partition: int) -> bool:
+    """Create the workers' consumer group (and stream) if missing."""
+    if not _redis:
+        return False
+
+    try:
+        await _redis.xgroup_create(_update_stream_key(partition), UPDATE_STREAM_GROUP, id="0", mkstream=True)
+    except Exception as exc:
+        if "BUSYGROUP" not in str(exc):
+            logger.warning("Update stream group error: %s", exc)
+            return False
+    return True
+
+
+async def read_updates(partition: int, consumer: str, count: int, after: str = ">",
+                       block_ms: int = 1000) -> Optional[list]:
+    """
+    Read up to count (entry_id, payload) pairs for a consumer. after=">"
+    waits for new entries; any other id re-reads this consumer's delivered
+    but unacked entries past it (recovery after a crash). None on error.
+    """
+    if not _redis:
+        return None
+
+    try:
+        response = await _redis.xreadgroup(
+            UPDATE_STREAM_GROUP, consumer, {_update_stream_key(partition): after},
+            count=count, block=block_ms if after == ">" else None,
+        )
+    except Exception as exc:
+        logger.warning("Update stream read error: %s", exc)
+        return None
+    if not response:
+        return []
+    # An entry trimmed by MAXLEN before it was acked comes back without fields
+    return [(entry_id, fields.get("u") if fields else None) for entry_id, fields in response[0][1]]
+
+
+async def ack_update(partition: int, entry_id: str) -> None:
+    """Mark a stream entry as handled."""
+    if not _redis:
+        return
+
+    try:
+        await _redis.xack(_update_stream_key(partition), UPDATE_STREAM_GROUP, entry_id)
+    except Exception as exc:
+        logger.warning("Update stream ack error: %s", exc)
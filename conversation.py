@@ -176,6 +176,8 @@ class ConversationSession:
 
 SESSION_TIMEOUT_SECONDS = 30 * 60  # 30 minutes
 CLEANUP_INTERVAL_SECONDS = 5 * 60  # 5 minutes
+COMPACT_AFTER_TURNS = 8  # long sessions are collapsed to their recent turns
+COMPACT_KEEP_TURNS = 3
 
 
 class ConversationStore:
@@ -211,6 +213,21 @@ class ConversationStore:
                 return None
             return session.summary or None
 
+    def get_if_session(self, user_id: str) -> str | None:
+        """
+        Return the conversation summary if the user has an active session
+        ("" for a session with no summary yet), else None. One lookup in
+        place of has_session() followed by get_context().
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            if time.time() - session.last_activity > SESSION_TIMEOUT_SECONDS:
+                del self._sessions[user_id]
+                return None
+            return session.summary
+
     def update(self, user_id: str, query: str, response: str) -> None:
         """Update (or create) a session after a completed turn."""
         key_facts = _extract_key_facts(response)
@@ -241,6 +258,27 @@ class ConversationStore:
             session.turn_count += 1
             session.last_activity = time.time()
 
+    def turn_count(self, user_id: str) -> int:
+        """Return the number of turns in a user's session (0 if none)."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            return session.turn_count if session else 0
+
+    def compact(self, user_id: str, keep_turns: int = COMPACT_KEEP_TURNS) -> None:
+        """
+        Collapse a long session's summary to its most recent turns, so the
+        context sent with each follow-up stops changing shape every turn.
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or not session.summary:
+                return
+            parts = session.summary.split(" | ")[-keep_turns:]
+            if parts[0].startswith("Then: "):
+                parts[0] = "Prior: " + parts[0][len("Then: "):]
+            session.summary = " | ".join(parts)
+            session.turn_count = len(parts)
+
     def reset(self, user_id: str) -> None:
         """Clear a user's conversation session."""
         with self._lock:
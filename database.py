@@ -8,6 +8,7 @@ Tables:
   - conversations: Full query/response log for analytics
   - query_logs: Structured property query analytics
   - subscription_events: Tier change audit trail
+  - processed_stripe_events: Stripe webhook deliveries already applied
 
 Usage:
     from database import init_db, close_db, get_or_create_user, ...
@@ -21,7 +22,7 @@ import os
 import json
 import logging
 from datetime import datetime, date
-from typing import Optional
+from typing import Optional, Tuple
 
 import asyncpg
 
@@ -83,6 +84,11 @@ CREATE TABLE IF NOT EXISTS subscription_events (
     created_at     TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
+CREATE TABLE IF NOT EXISTS processed_stripe_events (
+    event_id       TEXT PRIMARY KEY,
+    processed_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 CREATE TABLE IF NOT EXISTS saved_properties (
     id             BIGSERIAL PRIMARY KEY,
     user_id        BIGINT NOT NULL REFERENCES users(user_id),
@@ -181,7 +187,11 @@ async def close_db() -> None:
 
 
 def is_db_available() -> bool:
-    """Check if the database pool is available."""
+    """
+    Check if the database pool is available.
+    Only a global read, so call it where needed; don't copy the result at
+    import time, since init_db() runs after most modules are loaded.
+    """
     return _pool is not None
 
 
@@ -214,6 +224,37 @@ async def get_or_create_user(
         return dict(row) if row else None
 
 
+async def get_or_create_user_returning_isnew(
+    user_id: int,
+    username: Optional[str] = None,
+    first_name: Optional[str] = None,
+    platform: str = "telegram",
+) -> Tuple[Optional[dict], bool]:
+    """
+    Upsert a user in one round-trip. Returns (user, is_new), where is_new is
+    True only when this call inserted the row (xmax is 0 for a fresh tuple).
+    """
+    if not _pool:
+        return None, False
+
+    async with _pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO users (user_id, telegram_username, first_name, platform)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (user_id) DO UPDATE SET
+                telegram_username = COALESCE($2, users.telegram_username),
+                first_name = COALESCE($3, users.first_name)
+            RETURNING (xmax = 0) AS inserted, *
+            """,
+            user_id, username, first_name, platform,
+        )
+        if not row:
+            return None, False
+        user = dict(row)
+        return user, user.pop("inserted")
+
+
 async def get_user(user_id: int) -> Optional[dict]:
     """Fetch a user by ID."""
     if not _pool:
@@ -230,19 +271,24 @@ async def update_user_tier(
     stripe_customer_id: Optional[str] = None,
     stripe_subscription_id: Optional[str] = None,
 ) -> Optional[dict]:
-    """Update a user's subscription tier and optional Stripe IDs."""
+    """
+    Update a user's subscription tier and optional Stripe IDs.
+    Returns the updated record plus "from_tier", the tier before the change,
+    so callers don't need a separate get_user() to log the transition.
+    """
     if not _pool:
         return None
 
     async with _pool.acquire() as conn:
         row = await conn.fetchrow(
             """
-            UPDATE users
+            UPDATE users u
             SET tier = $2,
-                stripe_customer_id = COALESCE($3, stripe_customer_id),
-                stripe_subscription_id = COALESCE($4, stripe_subscription_id)
-            WHERE user_id = $1
-            RETURNING *
+                stripe_customer_id = COALESCE($3, u.stripe_customer_id),
+                stripe_subscription_id = COALESCE($4, u.stripe_subscription_id)
+            FROM (SELECT tier FROM users WHERE user_id = $1 FOR UPDATE) old
+            WHERE u.user_id = $1
+            RETURNING u.*, old.tier AS from_tier
             """,
             user_id, tier, stripe_customer_id, stripe_subscription_id,
         )
@@ -420,6 +466,96 @@ async def log_subscription_event(
         )
 
 
+# Reads the previous tier, updates the user and logs the event in one statement.
+# Parameters: user_id, to_tier, event_type, stripe_event_id, amount_aed,
+# stripe_customer_id, stripe_subscription_id
+_APPLY_SUBSCRIPTION_EVENT_SQL = """
+WITH old AS (
+    SELECT tier FROM users WHERE user_id = $1 FOR UPDATE
+), upd AS (
+    UPDATE users
+    SET tier = $2,
+        stripe_customer_id = COALESCE($6, stripe_customer_id),
+        stripe_subscription_id = COALESCE($7, stripe_subscription_id)
+    WHERE user_id = $1
+), ins AS (
+    INSERT INTO subscription_events (user_id, event_type, from_tier, to_tier, stripe_event_id, amount_aed)
+    VALUES ($1, $3, COALESCE((SELECT tier FROM old), 'free'), $2, $4, $5)
+)
+SELECT COALESCE((SELECT tier FROM old), 'free') AS from_tier
+"""
+
+
+async def apply_subscription_event(
+    user_id: int,
+    to_tier: str,
+    event_type: str,
+    stripe_event_id: Optional[str] = None,
+    amount_aed: float = 0,
+    stripe_customer_id: Optional[str] = None,
+    stripe_subscription_id: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Change a user's tier and log the subscription event in one statement.
+    Returns {"from_tier": ...} with the tier the user had before the change.
+    """
+    if not _pool:
+        return None
+
+    async with _pool.acquire() as conn:
+        row = await conn.fetchrow(
+            _APPLY_SUBSCRIPTION_EVENT_SQL,
+            user_id, to_tier, event_type, stripe_event_id, amount_aed,
+            stripe_customer_id, stripe_subscription_id,
+        )
+        return dict(row) if row else None
+
+
+async def bulk_apply_subscription_events(events: list) -> None:
+    """
+    Apply a batch of subscription events in one transaction.
+    Each item is a tuple in apply_subscription_event's argument order; asyncpg
+    pipelines the batch so it costs a single round-trip.
+    """
+    if not _pool or not events:
+        return
+
+    async with _pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(_APPLY_SUBSCRIPTION_EVENT_SQL, events)
+
+
+async def mark_stripe_event_processed(event_id: str) -> bool:
+    """
+    Record a Stripe event ID as processed.
+    Returns False if the event was already recorded (a duplicate delivery),
+    True otherwise — including when the database is unavailable.
+    """
+    if not _pool:
+        return True
+
+    async with _pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO processed_stripe_events (event_id)
+            VALUES ($1)
+            ON CONFLICT (event_id) DO NOTHING
+            RETURNING event_id
+            """,
+            event_id,
+        )
+        return row is not None
+
+
+async def unmark_stripe_event_processed(event_id: str) -> None:
+    """Forget a Stripe event ID whose processing failed, so a redelivery is applied."""
+    if not _pool:
+        return
+
+    async with _pool.acquire() as conn:
+        await conn.execute("DELETE FROM processed_stripe_events WHERE event_id = $1", event_id)
+
+
 # =====================================================
 # SAVED PROPERTIES / WATCHLIST
 # =====================================================
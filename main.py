@@ -41,6 +41,8 @@ from observability import (
     CostCalculator,
     get_prometheus_metrics,
     record_command_metrics,
+    record_cache_hit,
+    record_prompt_cache_tokens,
     record_web_search,
 )
 
@@ -81,9 +83,20 @@ from database import init_db, close_db
 @app.on_event("startup")
 async def startup():
     await init_db()
+    from payments import start_subscription_event_flusher, recover_pending_webhook_events
+    start_subscription_event_flusher()
+    await recover_pending_webhook_events()
 
 @app.on_event("shutdown")
 async def shutdown():
+    from payments import stop_subscription_event_flusher, wait_for_webhook_tasks
+    from shared.bot_core import wait_for_background_writes
+    await wait_for_webhook_tasks()
+    await wait_for_background_writes()
+    # Telegram webhook mode: stop the bot's metrics flusher, if it was started
+    if hasattr(telegram_webhook, "_bot"):
+        await telegram_webhook._bot.shutdown()
+    await stop_subscription_event_flusher()
     await close_db()
 
 # Anthropic client
@@ -2700,6 +2713,26 @@ Dubai Marina, Business Bay, JBR, Downtown, JVC, Palm Jumeirah, JLT, Arjan, Dubai
 # CORE QUERY HANDLER (importable by Telegram bot)
 # =====================================================
 
+# Static prefix shared by every query; the breakpoint caches tools + system
+SYSTEM_BLOCKS = [{
+    "type": "text",
+    "text": SYSTEM_PROMPT,
+    "cache_control": {"type": "ephemeral"},
+}]
+
+
+def _mark_cache_breakpoint(conversation: list, previous: dict | None) -> dict:
+    """
+    Put the cache_control breakpoint on the last block of the conversation,
+    moving it off the previous one (the API allows only four per request).
+    """
+    if previous is not None:
+        previous.pop("cache_control", None)
+    block = conversation[-1]["content"][-1]
+    block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+
 async def handle_query(query: str, user_id: str = "anonymous", conversation_context: str = None) -> QueryResponse:
     """
     Process a user query through Claude with iterative tool-use (max 7 iterations).
@@ -2707,21 +2740,57 @@ async def handle_query(query: str, user_id: str = "anonymous", conversation_cont
 
     If conversation_context is provided (a compact summary of prior turns),
     it is prepended to the user message so Claude has follow-up context.
+
+    Answers come from the query cache when the same question was asked
+    within the last hour (after the same conversation context, if any), or
+    from the semantic cache for a close paraphrase when that is enabled.
     """
+    from cache import get_cached_response, set_cached_response
+    import semantic_cache
+
+    model = "claude-haiku-4-5-20251001"
+
     # Start query tracking
     start_time = log_query_start(logger, user_id, query)
 
+    cached = await get_cached_response(query, conversation_context)
+    cache_kind = "query"
+    if cached is None:
+        cached = await semantic_cache.lookup(query, conversation_context)
+        cache_kind = "semantic_query"
+    if cached is not None:
+        logger.info("Query cache HIT for user_id=%s", user_id)
+        # Counted like any other query (no tools, no tokens) so traffic and
+        # latency figures don't shrink as the hit rate grows
+        record_cache_hit(cache_kind)
+        log_query_complete(
+            logger=logger,
+            user_id=user_id,
+            query=query,
+            start_time=start_time,
+            tools_used=[],
+            model=model,
+            success=True
+        )
+        return QueryResponse(**{**cached, "timestamp": datetime.now().isoformat()})
+
     tools_used: list[str] = []
+    # The context goes in the first user message, after the cached system
+    # prompt, so it never breaks the shared tools + system prefix
+    user_content = [{"type": "text", "text": query}]
     if conversation_context:
-        user_content = f"[Previous conversation context: {conversation_context}]\n\n{query}"
-    else:
-        user_content = query
+        user_content.insert(0, {
+            "type": "text",
+            "text": f"[Previous conversation context: {conversation_context}]",
+        })
     conversation = [{"role": "user", "content": user_content}]
+    # Moving cache breakpoint on the newest user turn: each tool-use
+    # iteration re-reads everything before it from the prompt cache
+    cache_marker = _mark_cache_breakpoint(conversation, None)
 
     # Track total tokens across all iterations
     total_input_tokens = 0
     total_output_tokens = 0
-    model = "claude-haiku-4-5-20251001"
 
     try:
         for iteration in range(7):  # Capped at 7 — batching instruction in prompt reduces iterations
@@ -2730,11 +2799,7 @@ async def handle_query(query: str, user_id: str = "anonymous", conversation_cont
             response = claude.messages.create(
                 model=model,
                 max_tokens=4000,
-                system=[{
-                    "type": "text",
-                    "text": SYSTEM_PROMPT,
-                    "cache_control": {"type": "ephemeral"}
-                }],
+                system=SYSTEM_BLOCKS,
                 tools=TOOLS,
                 messages=conversation,
                 extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
@@ -2743,6 +2808,13 @@ async def handle_query(query: str, user_id: str = "anonymous", conversation_cont
             # Track tokens from this iteration
             total_input_tokens += response.usage.input_tokens
             total_output_tokens += response.usage.output_tokens
+            # Every entry point shares the tools + system prefix, so cache
+            # reads here show how often a warm prefix was reused
+            record_prompt_cache_tokens(
+                model,
+                getattr(response.usage, "cache_read_input_tokens", 0) or 0,
+                getattr(response.usage, "cache_creation_input_tokens", 0) or 0,
+            )
 
             logger.debug("Stop reason: %s", response.stop_reason)
 
@@ -2767,11 +2839,17 @@ async def handle_query(query: str, user_id: str = "anonymous", conversation_cont
                     success=True
                 )
 
-                return QueryResponse(
+                result = QueryResponse(
                     response=final_text,
                     tools_used=tools_used,
                     timestamp=datetime.now().isoformat(),
                 )
+                # Only complete answers are reusable
+                if response.stop_reason == "end_turn":
+                    cached = result.model_dump()
+                    await set_cached_response(query, cached, conversation_context)
+                    await semantic_cache.store(query, cached, conversation_context)
+                return result
 
             elif response.stop_reason == "tool_use":
                 # Convert ContentBlocks to plain dicts for serialization
@@ -2818,6 +2896,7 @@ async def handle_query(query: str, user_id: str = "anonymous", conversation_cont
                 conversation.append({"role": "assistant", "content": assistant_content})
                 # Append user message with tool results
                 conversation.append({"role": "user", "content": tool_results})
+                cache_marker = _mark_cache_breakpoint(conversation, cache_marker)
 
             else:
                 logger.error("Unexpected stop_reason: %s", response.stop_reason)
@@ -3005,7 +3084,8 @@ async def telegram_webhook(request: Request):
     if not hasattr(telegram_webhook, "_app"):
         from bot import TelegramBotServer
         bot = TelegramBotServer()
-        await bot.application.initialize()
+        await bot.initialize()
+        telegram_webhook._bot = bot
         telegram_webhook._app = bot.application
 
     update = Update.de_json(data, telegram_webhook._app.bot)
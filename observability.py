@@ -9,33 +9,37 @@ import os
 import json
 import logging
 import time
-import traceback
 import shutil
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Any, Union
 from collections import defaultdict, Counter
 from dataclasses import dataclass, asdict
 
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
 # =====================================================
 # MULTIPROCESS PROMETHEUS SETUP
 # =====================================================
-# IMPORTANT: Must set environment variable BEFORE importing prometheus_client
-
-# Set up multiprocess directory for Prometheus metrics sharing
-PROMETHEUS_MULTIPROC_DIR = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)),
-    'prometheus_multiproc_dir'
-)
+# prometheus_client reads PROMETHEUS_MULTIPROC_DIR when it is imported.
 
-# Create the directory if it doesn't exist
-os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+# Multiprocess mode lets separate processes (e.g. `uvicorn main:app` next to
+# `python run.py`) share one /metrics view through files in that directory.
+# It is on only when the deployment sets PROMETHEUS_MULTIPROC_DIR; a single
+# process (python run.py) scrapes the in-memory registry instead.
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+PROMETHEUS_MULTIPROCESS = bool(PROMETHEUS_MULTIPROC_DIR)
 
-# Set environment variable for prometheus_client (MUST be before import)
-os.environ['PROMETHEUS_MULTIPROC_DIR'] = PROMETHEUS_MULTIPROC_DIR
+if PROMETHEUS_MULTIPROCESS:
+    # prometheus_client expects the directory to exist
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
 
 # NOW import prometheus_client after environment is configured
 from prometheus_client import Counter as PromCounter, Histogram, Gauge, generate_latest, REGISTRY, CollectorRegistry
-from prometheus_client import multiprocess, values
 
 
 def cleanup_prometheus_multiproc_dir():
@@ -43,7 +47,7 @@ def cleanup_prometheus_multiproc_dir():
     Clean up the multiprocess metrics directory.
     Call this ONCE at application startup (before any metrics are recorded).
     """
-    if os.path.exists(PROMETHEUS_MULTIPROC_DIR):
+    if PROMETHEUS_MULTIPROCESS and os.path.exists(PROMETHEUS_MULTIPROC_DIR):
         for filename in os.listdir(PROMETHEUS_MULTIPROC_DIR):
             file_path = os.path.join(PROMETHEUS_MULTIPROC_DIR, filename)
             try:
@@ -57,66 +61,76 @@ def cleanup_prometheus_multiproc_dir():
 # STRUCTURED JSON LOGGING
 # =====================================================
 
+# Standard LogRecord attributes that are never copied into the JSON payload
+_LOG_RECORD_ATTRS = frozenset([
+    'name', 'msg', 'args', 'created', 'filename', 'funcName',
+    'levelname', 'levelno', 'lineno', 'module', 'msecs',
+    'message', 'pathname', 'process', 'processName',
+    'relativeCreated', 'thread', 'threadName', 'exc_info',
+    'exc_text', 'stack_info',
+])
+
+# Custom fields from the extra dict, emitted first and in this order
+_LOG_FIELDS = (
+    'user_id', 'query', 'duration_ms', 'cost_usd', 'tools_used',
+    'error_type', 'error_message', 'stack_trace', 'input_tokens',
+    'output_tokens', 'model', 'success',
+)
+
+
+def _dumps_log(log_data: Dict[str, Any]) -> str:
+    """Serialise a log payload, stringifying anything JSON can't represent"""
+    if orjson is not None:
+        return orjson.dumps(
+            log_data,
+            default=str,
+            option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+        ).decode('utf-8')
+    return json.dumps(log_data, default=_json_default)
+
+
+def _json_default(value: Any) -> str:
+    """Fallback encoder matching orjson's handling of datetimes"""
+    if isinstance(value, datetime):
+        return value.isoformat().replace('+00:00', 'Z')
+    return str(value)
+
+
 class JSONFormatter(logging.Formatter):
     """Format logs as JSON for easy parsing and analysis"""
 
     def format(self, record):
         log_data = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            # Record creation time, serialised by the encoder (…Z, microseconds)
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
         }
 
+        record_dict = record.__dict__
+
         # Add custom fields from extra dict
-        if hasattr(record, 'user_id'):
-            log_data['user_id'] = record.user_id
-        if hasattr(record, 'query'):
-            log_data['query'] = record.query
-        if hasattr(record, 'duration_ms'):
-            log_data['duration_ms'] = record.duration_ms
-        if hasattr(record, 'cost_usd'):
-            log_data['cost_usd'] = record.cost_usd
-        if hasattr(record, 'tools_used'):
-            log_data['tools_used'] = record.tools_used
-        if hasattr(record, 'error_type'):
-            log_data['error_type'] = record.error_type
-        if hasattr(record, 'error_message'):
-            log_data['error_message'] = record.error_message
-        if hasattr(record, 'stack_trace'):
-            log_data['stack_trace'] = record.stack_trace
-        if hasattr(record, 'input_tokens'):
-            log_data['input_tokens'] = record.input_tokens
-        if hasattr(record, 'output_tokens'):
-            log_data['output_tokens'] = record.output_tokens
-        if hasattr(record, 'model'):
-            log_data['model'] = record.model
-        if hasattr(record, 'success'):
-            log_data['success'] = record.success
-
-        # Add any other extra attributes
-        for key, value in record.__dict__.items():
-            if key not in ['name', 'msg', 'args', 'created', 'filename', 'funcName',
-                          'levelname', 'levelno', 'lineno', 'module', 'msecs',
-                          'message', 'pathname', 'process', 'processName',
-                          'relativeCreated', 'thread', 'threadName', 'exc_info',
-                          'exc_text', 'stack_info'] and key not in log_data:
-                try:
-                    json.dumps(value)  # Test if serializable
-                    log_data[key] = value
-                except (TypeError, ValueError):
-                    log_data[key] = str(value)
-
-        return json.dumps(log_data)
+        for key in _LOG_FIELDS:
+            if key in record_dict:
+                log_data[key] = record_dict[key]
+
+        # Add any other extra attributes; non-serialisable values are
+        # stringified by the encoder
+        for key, value in record_dict.items():
+            if key not in _LOG_RECORD_ATTRS and key not in log_data:
+                log_data[key] = value
+
+        return _dumps_log(log_data)
 
 
 # =====================================================
 # METRICS TRACKING
 # =====================================================
 
-@dataclass
+@dataclass(slots=True)
 class QueryMetrics:
-    """Metrics for a single query"""
+    """Metrics for a single query (slotted: no per-instance __dict__)"""
     user_id: str
     query: str
     success: bool
@@ -124,14 +138,44 @@ class QueryMetrics:
     cost_usd: float
     tools_used: List[str]
     error: Optional[str] = None
+    error_type: Optional[str] = None
     input_tokens: int = 0
     output_tokens: int = 0
     model: str = ""
-    timestamp: str = ""
+    timestamp_epoch: float = 0.0
 
     def __post_init__(self):
-        if not self.timestamp:
-            self.timestamp = datetime.utcnow().isoformat() + "Z"
+        # Store the raw epoch; ISO formatting is deferred until timestamp is read
+        if not self.timestamp_epoch:
+            self.timestamp_epoch = time.time()
+
+    @property
+    def timestamp(self) -> str:
+        """ISO-8601 UTC timestamp, e.g. 2025-01-01T12:00:00.000Z"""
+        return datetime.fromtimestamp(self.timestamp_epoch, tz=timezone.utc).isoformat(
+            timespec='milliseconds'
+        ).replace('+00:00', 'Z')
+
+
+def _response_time_summary(times: List[float]) -> tuple:
+    """
+    Return (avg, p50, p95, p99) for a window of response times.
+
+    Runs on a contiguous float64 array and uses np.partition to place only the
+    three percentile ranks, which is O(n) instead of a full Python sort.
+    """
+    n = len(times)
+    if not n:
+        return 0, 0, 0, 0
+
+    ranks = (n // 2, int(n * 0.95), int(n * 0.99))
+    arr = np.partition(np.asarray(times, dtype=np.float64), ranks)
+    return (
+        float(arr.mean()),
+        float(arr[ranks[0]]),
+        float(arr[ranks[1]]),
+        float(arr[ranks[2]]),
+    )
 
 
 class MetricsTracker:
@@ -142,14 +186,23 @@ class MetricsTracker:
         self.queries_success = 0
         self.queries_failed = 0
         self.costs_total_usd = 0.0
-        self.response_times: List[float] = []
-        self.tool_usage: Dict[str, int] = defaultdict(int)
-        self.errors_by_type: Dict[str, int] = defaultdict(int)
-        self.queries_by_user: Dict[str, int] = defaultdict(int)
+        # Latency samples live in a contiguous float64 column (grown by
+        # doubling) so summaries read them without boxing Python floats
+        self._response_times = np.empty(1024, dtype=np.float64)
+        self._response_count = 0
+        self.tool_usage: Counter = Counter()
+        self.errors_by_type: Counter = Counter()
+        self.queries_by_user: Counter = Counter()
         self.cost_by_user: Dict[str, float] = defaultdict(float)
         self.recent_queries: List[QueryMetrics] = []
         self.max_recent = 100  # Keep last 100 queries in memory
 
+        # Running per-user aggregates over recent_queries, as
+        # user_id -> [count, duration_sum, cost_sum, success_count], so
+        # get_user_stats is a dict fetch instead of a scan. Entries follow the
+        # global window, so only users with a query in it are kept.
+        self._user_window: Dict[str, list] = {}
+
     def record_query(
         self,
         user_id: str,
@@ -158,60 +211,102 @@ class MetricsTracker:
         duration_ms: float,
         cost_usd: float,
         tools: List[str],
-        error: Optional[str] = None,
+        error: Optional[Union[str, Exception]] = None,
         input_tokens: int = 0,
         output_tokens: int = 0,
-        model: str = ""
+        model: str = "",
+        error_type: Optional[str] = None
     ):
-        """Record metrics for a query"""
+        """
+        Record metrics for a query.
+
+        error may be an exception or its message; callers that already know the
+        exception class name pass it as error_type so it is not derived twice.
+        """
+        # Checked against None, not truthiness: asyncio.TimeoutError() and
+        # friends have an empty message but are still errors
+        error_message = None
+        if error is not None:
+            if error_type is None:
+                error_type = type(error).__name__ if isinstance(error, BaseException) else "Unknown"
+            error_message = str(error) or error_type
         self.queries_total += 1
 
         if success:
             self.queries_success += 1
         else:
             self.queries_failed += 1
-            if error:
-                error_type = type(error).__name__ if isinstance(error, Exception) else "Unknown"
+            if error_type is not None:
                 self.errors_by_type[error_type] += 1
 
         self.costs_total_usd += cost_usd
-        self.response_times.append(duration_ms)
+        self._append_response_time(duration_ms)
         self.queries_by_user[user_id] += 1
         self.cost_by_user[user_id] += cost_usd
 
-        for tool in tools:
-            self.tool_usage[tool] += 1
+        self.tool_usage.update(tools)
 
         # Store recent query
         metrics = QueryMetrics(
             user_id=user_id,
-            query=query[:100],  # Truncate for privacy
+            query=query[:100],  # Truncate for privacy (no copy if already short)
             success=success,
             duration_ms=duration_ms,
             cost_usd=cost_usd,
             tools_used=tools,
-            error=str(error) if error else None,
+            error=error_message,
+            error_type=error_type,
             input_tokens=input_tokens,
             output_tokens=output_tokens,
             model=model
         )
 
         self.recent_queries.append(metrics)
-        if len(self.recent_queries) > self.max_recent:
-            self.recent_queries.pop(0)
+        self._add_to_user_window(metrics, 1)
+        while len(self.recent_queries) > self.max_recent:
+            self._add_to_user_window(self.recent_queries.pop(0), -1)
+
+    @property
+    def response_times(self) -> np.ndarray:
+        """All recorded response times in ms (a view, oldest first)"""
+        return self._response_times[:self._response_count]
+
+    @response_times.setter
+    def response_times(self, times: List[float]):
+        samples = np.asarray(times, dtype=np.float64)
+        self._response_times = np.empty(max(1024, len(samples)), dtype=np.float64)
+        self._response_times[:len(samples)] = samples
+        self._response_count = len(samples)
+
+    def _append_response_time(self, duration_ms: float):
+        """Append one latency sample, doubling the column when it is full"""
+        if self._response_count == len(self._response_times):
+            grown = np.empty(len(self._response_times) * 2, dtype=np.float64)
+            grown[:self._response_count] = self._response_times
+            self._response_times = grown
+        self._response_times[self._response_count] = duration_ms
+        self._response_count += 1
+
+    def _add_to_user_window(self, metrics: QueryMetrics, sign: int):
+        """Add (sign=1) or remove (sign=-1) a query in its user's running sums"""
+        user_id = metrics.user_id
+        window = self._user_window.get(user_id)
+        if window is None:
+            window = self._user_window[user_id] = [0, 0.0, 0.0, 0]
+        window[0] += sign
+        if not window[0]:
+            del self._user_window[user_id]
+            return
+        window[1] += sign * metrics.duration_ms
+        window[2] += sign * metrics.cost_usd
+        window[3] += sign * metrics.success
 
     def get_summary(self) -> Dict[str, Any]:
-        """Get summary of all metrics"""
-        avg_response_time = (
-            sum(self.response_times) / len(self.response_times)
-            if self.response_times else 0
-        )
-
-        # Calculate percentiles
-        sorted_times = sorted(self.response_times) if self.response_times else []
-        p50 = sorted_times[len(sorted_times) // 2] if sorted_times else 0
-        p95 = sorted_times[int(len(sorted_times) * 0.95)] if sorted_times else 0
-        p99 = sorted_times[int(len(sorted_times) * 0.99)] if sorted_times else 0
+        """
+        Get summary of all metrics as raw numbers (rates are 0-1 fractions,
+        costs in USD, times in ms). Use format_summary() for display.
+        """
+        avg_response_time, p50, p95, p99 = _response_time_summary(self.response_times)
 
         success_rate = (
             self.queries_success / self.queries_total
@@ -227,50 +322,53 @@ class MetricsTracker:
             "total_queries": self.queries_total,
             "success_queries": self.queries_success,
             "failed_queries": self.queries_failed,
-            "success_rate": f"{success_rate * 100:.1f}%",
-            "error_rate": f"{error_rate * 100:.1f}%",
-            "total_cost_usd": f"${self.costs_total_usd:.4f}",
-            "avg_cost_per_query": f"${self.costs_total_usd / self.queries_total:.4f}" if self.queries_total > 0 else "$0.00",
+            "success_rate": success_rate,
+            "error_rate": error_rate,
+            "total_cost_usd": self.costs_total_usd,
+            "avg_cost_per_query": self.costs_total_usd / self.queries_total if self.queries_total > 0 else 0.0,
             "response_times": {
-                "avg_ms": f"{avg_response_time:.0f}",
-                "p50_ms": f"{p50:.0f}",
-                "p95_ms": f"{p95:.0f}",
-                "p99_ms": f"{p99:.0f}",
+                "avg_ms": avg_response_time,
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
             },
-            "most_used_tools": dict(sorted(
-                self.tool_usage.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]),
+            "most_used_tools": dict(self.tool_usage.most_common(5)),
             "errors_by_type": dict(self.errors_by_type),
             "unique_users": len(self.queries_by_user),
-            "top_users_by_queries": dict(sorted(
-                self.queries_by_user.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]),
+            "top_users_by_queries": dict(self.queries_by_user.most_common(5)),
         }
 
     def get_user_stats(self, user_id: str) -> Dict[str, Any]:
         """Get stats for a specific user"""
-        user_queries = [q for q in self.recent_queries if q.user_id == user_id]
+        window = self._user_window.get(user_id)
 
-        if not user_queries:
+        if not window:
             return {"queries": 0, "cost_usd": 0, "avg_duration_ms": 0}
 
-        total_duration = sum(q.duration_ms for q in user_queries)
-        total_cost = sum(q.cost_usd for q in user_queries)
-        successful = sum(1 for q in user_queries if q.success)
+        count, total_duration, total_cost, successful = window
 
         return {
-            "queries": len(user_queries),
-            "success_rate": f"{successful / len(user_queries) * 100:.1f}%",
+            "queries": count,
+            "success_rate": f"{successful / count * 100:.1f}%",
             "total_cost_usd": f"${total_cost:.4f}",
-            "avg_cost_per_query": f"${total_cost / len(user_queries):.4f}",
-            "avg_duration_ms": f"{total_duration / len(user_queries):.0f}",
+            "avg_cost_per_query": f"${total_cost / count:.4f}",
+            "avg_duration_ms": f"{total_duration / count:.0f}",
         }
 
 
+def format_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Render a get_summary() result with display strings for CLI/chat output"""
+    times = summary["response_times"]
+    return {
+        **summary,
+        "success_rate": f"{summary['success_rate'] * 100:.1f}%",
+        "error_rate": f"{summary['error_rate'] * 100:.1f}%",
+        "total_cost_usd": f"${summary['total_cost_usd']:.4f}",
+        "avg_cost_per_query": f"${summary['avg_cost_per_query']:.4f}" if summary["total_queries"] > 0 else "$0.00",
+        "response_times": {key: f"{value:.0f}" for key, value in times.items()},
+    }
+
+
 # =====================================================
 # USER ANALYTICS
 # =====================================================
@@ -302,7 +400,7 @@ class UserAnalytics:
         event_data = {
             'user_id': user_id,
             'event': event,
-            'timestamp': datetime.utcnow().isoformat() + "Z",
+            'timestamp': time.time(),  # epoch seconds, formatted only when exported
             'properties': properties or {}
         }
 
@@ -356,6 +454,14 @@ class CostCalculator:
         }
     }
 
+    # Flat (input_rate, output_rate) table so each call is a single dict.get
+    _PRICING_FLAT = {
+        model: (rates["input"], rates["output"]) for model, rates in PRICING.items()
+    }
+
+    # Default to Sonnet 4 pricing if model unknown
+    _DEFAULT_RATES = _PRICING_FLAT["claude-sonnet-4-20250514"]
+
     @classmethod
     def calculate_cost(
         cls,
@@ -364,13 +470,8 @@ class CostCalculator:
         output_tokens: int
     ) -> float:
         """Calculate cost in USD for a Claude API call"""
-        if model not in cls.PRICING:
-            # Default to Sonnet 4 pricing if model unknown
-            model = "claude-sonnet-4-20250514"
-
-        pricing = cls.PRICING[model]
-        cost = (input_tokens * pricing["input"]) + (output_tokens * pricing["output"])
-        return cost
+        input_rate, output_rate = cls._PRICING_FLAT.get(model, cls._DEFAULT_RATES)
+        return input_tokens * input_rate + output_tokens * output_rate
 
 
 # =====================================================
@@ -418,12 +519,17 @@ def log_user_error(
     query: Optional[str] = None
 ):
     """Log an error that was sent to a user"""
+    import traceback  # error path only; keeps it off the import-time critical path
+
+    error_type = type(exception).__name__
+    error_message = error_message[:200]
+
     logger.error(
         "Error sent to user",
         extra={
             'user_id': user_id,
-            'error_message': error_message[:200],
-            'error_type': type(exception).__name__,
+            'error_message': error_message,
+            'error_type': error_type,
             'stack_trace': traceback.format_exc(),
             'query': query[:100] if query else None,
         }
@@ -434,8 +540,8 @@ def log_user_error(
         user_id=user_id,
         event='error_occurred',
         properties={
-            'error_type': type(exception).__name__,
-            'error_message': error_message[:200],
+            'error_type': error_type,
+            'error_message': error_message,
         }
     )
 
@@ -448,17 +554,43 @@ def log_query_start(
     """Log query start and return start time"""
     start_time = time.time()
 
-    logger.info(
-        "Query started",
-        extra={
-            'user_id': user_id,
-            'query': query[:100],
-        }
-    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Query started",
+            extra={
+                'user_id': user_id,
+                'query': query[:100],
+            }
+        )
 
     return start_time
 
 
+def _query_log_extras(
+    user_id: str,
+    query: str,
+    duration_ms: float,
+    cost_usd: float,
+    tools_used: List[str],
+    input_tokens: int,
+    output_tokens: int,
+    model: str,
+    success: bool
+) -> Dict[str, Any]:
+    """Build the structured extras for a query completion log line"""
+    return {
+        'user_id': user_id,
+        'query': query,
+        'duration_ms': duration_ms,
+        'cost_usd': cost_usd,
+        'tools_used': tools_used,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'model': model,
+        'success': success,
+    }
+
+
 def log_query_complete(
     logger: logging.Logger,
     user_id: str,
@@ -472,42 +604,31 @@ def log_query_complete(
     error: Optional[Exception] = None
 ):
     """Log query completion with full metrics"""
+    query = query[:100]  # Truncate once for privacy; reused by logs and tracker
+    error_type = type(error).__name__ if error is not None else None
+    error_message = (str(error) or error_type) if error is not None else None
     duration_ms = (time.time() - start_time) * 1000
     duration_seconds = duration_ms / 1000.0
     cost_usd = CostCalculator.calculate_cost(model, input_tokens, output_tokens)
 
+    # Only build the extras dict when the record will actually be emitted
     if success:
-        logger.info(
-            "Query completed successfully",
-            extra={
-                'user_id': user_id,
-                'query': query[:100],
-                'duration_ms': duration_ms,
-                'cost_usd': cost_usd,
-                'tools_used': tools_used,
-                'input_tokens': input_tokens,
-                'output_tokens': output_tokens,
-                'model': model,
-                'success': True,
-            }
-        )
-    else:
-        logger.error(
-            "Query failed",
-            extra={
-                'user_id': user_id,
-                'query': query[:100],
-                'duration_ms': duration_ms,
-                'cost_usd': cost_usd,
-                'tools_used': tools_used,
-                'input_tokens': input_tokens,
-                'output_tokens': output_tokens,
-                'model': model,
-                'success': False,
-                'error_type': type(error).__name__ if error else "Unknown",
-                'error_message': str(error) if error else "Unknown error",
-            }
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Query completed successfully",
+                extra=_query_log_extras(
+                    user_id, query, duration_ms, cost_usd, tools_used,
+                    input_tokens, output_tokens, model, True
+                )
+            )
+    elif logger.isEnabledFor(logging.ERROR):
+        extra = _query_log_extras(
+            user_id, query, duration_ms, cost_usd, tools_used,
+            input_tokens, output_tokens, model, False
         )
+        extra['error_type'] = error_type or "Unknown"
+        extra['error_message'] = error_message or "Unknown error"
+        logger.error("Query failed", extra=extra)
 
     # Record in metrics tracker
     metrics_tracker.record_query(
@@ -517,7 +638,8 @@ def log_query_complete(
         duration_ms=duration_ms,
         cost_usd=cost_usd,
         tools=tools_used,
-        error=error,
+        error=error_message,
+        error_type=error_type,
         input_tokens=input_tokens,
         output_tokens=output_tokens,
         model=model
@@ -535,9 +657,9 @@ def log_query_complete(
         }
     )
 
-    # Record Prometheus metrics
+    # Record Prometheus metrics (per-user figures stay in metrics_tracker to keep
+    # label cardinality bounded)
     record_query_metrics(
-        user_id=user_id,
         success=success,
         duration_seconds=duration_seconds,
         cost_usd=cost_usd,
@@ -556,7 +678,7 @@ def log_query_complete(
 query_total = PromCounter(
     'dubai_estate_queries_total',
     'Total number of queries processed',
-    ['status', 'user_id', 'model']
+    ['status', 'model']
 )
 
 query_duration = Histogram(
@@ -577,7 +699,7 @@ query_cost = Histogram(
 tokens_used = PromCounter(
     'dubai_estate_tokens_total',
     'Total tokens used',
-    ['type', 'model']  # type: input/output
+    ['type', 'model']  # type: input/output/cache_read/cache_write
 )
 
 # Tool metrics
@@ -616,14 +738,14 @@ query_limit_hits = PromCounter(
 command_usage = PromCounter(
     'dubai_estate_command_usage_total',
     'Telegram command usage',
-    ['command', 'user_id']
+    ['command']
 )
 
 # Error metrics
 errors_total = PromCounter(
     'dubai_estate_errors_total',
     'Total errors',
-    ['error_type', 'user_id']
+    ['error_type']
 )
 
 # Business metrics
@@ -718,8 +840,23 @@ payment_events_total = PromCounter(
 # PROMETHEUS EXPORTER FUNCTIONS
 # =====================================================
 
+# Label-bound children keyed by (metric, label values). The label sets used on
+# the query, cache, DB and follow-up paths are small and bounded (tool names,
+# operations, statuses), so caching skips labels()'s per-call lock, validation
+# and wrapper lookup.
+_bound_children: Dict[tuple, Any] = {}
+
+
+def _bound(metric, *label_values: str):
+    """Return the cached child of metric for label_values (in declared label order)"""
+    key = (metric, label_values)
+    child = _bound_children.get(key)
+    if child is None:
+        child = _bound_children[key] = metric.labels(*label_values)
+    return child
+
+
 def record_query_metrics(
-    user_id: str,
     success: bool,
     duration_seconds: float,
     cost_usd: float,
@@ -732,27 +869,35 @@ def record_query_metrics(
     status = 'success' if success else 'failure'
     
     # Query metrics
-    query_total.labels(status=status, user_id=user_id, model=model).inc()
-    query_duration.labels(status=status, model=model).observe(duration_seconds)
-    query_cost.labels(model=model).observe(cost_usd)
+    _bound(query_total, status, model).inc()
+    _bound(query_duration, status, model).observe(duration_seconds)
+    _bound(query_cost, model).observe(cost_usd)
     
     # Token metrics
-    tokens_used.labels(type='input', model=model).inc(input_tokens)
-    tokens_used.labels(type='output', model=model).inc(output_tokens)
+    _bound(tokens_used, 'input', model).inc(input_tokens)
+    _bound(tokens_used, 'output', model).inc(output_tokens)
     
-    # Tool metrics
-    for tool in tools:
-        tool_usage.labels(tool_name=tool, status=status).inc()
+    # Tool metrics: one inc(n) per distinct tool rather than one per call
+    for tool, count in Counter(tools).items():
+        _bound(tool_usage, tool, status).inc(count)
+
+
+def record_prompt_cache_tokens(model: str, read_tokens: int, written_tokens: int):
+    """Record prompt-cache reads and writes for one Claude call"""
+    if read_tokens:
+        _bound(tokens_used, 'cache_read', model).inc(read_tokens)
+    if written_tokens:
+        _bound(tokens_used, 'cache_write', model).inc(written_tokens)
 
 
-def record_command_metrics(command: str, user_id: str):
+def record_command_metrics(command: str, count: int = 1):
     """Record command usage"""
-    command_usage.labels(command=command, user_id=user_id).inc()
+    _bound(command_usage, command).inc(count)
 
 
-def record_error_metrics(error_type: str, user_id: str):
+def record_error_metrics(error_type: str):
     """Record error occurrence"""
-    errors_total.labels(error_type=error_type, user_id=user_id).inc()
+    errors_total.labels(error_type=error_type).inc()
 
 
 def record_user_signup(tier: str = 'free'):
@@ -784,7 +929,7 @@ def update_revenue_metrics(total_revenue: float, monthly_revenue: float):
 
 def record_followup_detected(is_followup: bool):
     """Record whether a query was classified as follow-up or fresh."""
-    followup_detected_total.labels(type='followup' if is_followup else 'fresh').inc()
+    _bound(followup_detected_total, 'followup' if is_followup else 'fresh').inc()
 
 
 def record_conversation_reset(reason: str = 'command'):
@@ -804,19 +949,19 @@ def record_web_search(status: str):
 
 def record_db_query(operation: str, duration_seconds: float = 0):
     """Record a database query."""
-    db_queries_total.labels(operation=operation).inc()
+    _bound(db_queries_total, operation).inc()
     if duration_seconds > 0:
-        db_query_duration.labels(operation=operation).observe(duration_seconds)
+        _bound(db_query_duration, operation).observe(duration_seconds)
 
 
 def record_cache_hit(tool_name: str):
     """Record a cache hit."""
-    cache_hits_total.labels(tool_name=tool_name).inc()
+    _bound(cache_hits_total, tool_name).inc()
 
 
 def record_cache_miss(tool_name: str):
     """Record a cache miss."""
-    cache_misses_total.labels(tool_name=tool_name).inc()
+    _bound(cache_misses_total, tool_name).inc()
 
 
 def record_pdf_generation(status: str):
@@ -834,9 +979,30 @@ def record_payment_event(event_type: str):
     payment_events_total.labels(event_type=event_type).inc()
 
 
+# Back-to-back scrapes (several Prometheus targets, Grafana previews) within this
+# window reuse the last rendered payload
+METRICS_CACHE_TTL_SECONDS = 1.0
+_metrics_cache_text = ""
+_metrics_cache_at = 0.0
+
+
 def get_prometheus_metrics() -> str:
     """Generate Prometheus metrics in text format (multiprocess-aware)"""
-    # Create a new registry and collect metrics from all processes
-    registry = CollectorRegistry()
-    multiprocess.MultiProcessCollector(registry)
-    return generate_latest(registry).decode('utf-8')
+    global _metrics_cache_text, _metrics_cache_at
+
+    now = time.monotonic()
+    if _metrics_cache_text and now - _metrics_cache_at < METRICS_CACHE_TTL_SECONDS:
+        return _metrics_cache_text
+
+    if PROMETHEUS_MULTIPROCESS:
+        from prometheus_client import multiprocess  # only needed when scraping shared files
+
+        # Create a new registry and collect metrics from all processes
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    _metrics_cache_text = generate_latest(registry).decode('utf-8')
+    _metrics_cache_at = now
+    return _metrics_cache_text
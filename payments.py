@@ -9,12 +9,32 @@ Env vars required:
 """
 
 import os
+import re
+import hmac
+import json
+import time
+import asyncio
+import hashlib
 import logging
+from collections import OrderedDict
 from typing import Optional
 
 import stripe
 
-from database import update_user_tier, log_subscription_event, get_user
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib parser
+    orjson = None
+
+from cache import get_pending, push_pending, remove_pending
+from database import (
+    apply_subscription_event,
+    bulk_apply_subscription_events,
+    get_user,
+    log_subscription_event,
+    mark_stripe_event_processed,
+    unmark_stripe_event_processed,
+)
 
 logger = logging.getLogger("payments")
 
@@ -22,6 +42,18 @@ logger = logging.getLogger("payments")
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
 WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 
+# Resolved once at import; both values come from the environment and never
+# change at runtime.
+_STRIPE_CONFIGURED = bool(stripe.api_key and stripe.api_key.startswith("sk_"))
+
+# Webhook signature verification (same scheme as stripe.Webhook.construct_event).
+# The keyed HMAC is built once and copied per request, so the secret's key
+# schedule isn't recomputed for every delivery.
+SIGNATURE_TOLERANCE_SECONDS = 300
+_SIG_TIMESTAMP_RE = re.compile(r"(?:^|,)\s*t=(\d+)")
+_SIG_V1_RE = re.compile(r"(?:^|,)\s*v1=([0-9a-fA-F]+)")
+_WEBHOOK_HMAC = hmac.new(WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256)
+
 # Price IDs for each tier (set in Stripe Dashboard)
 PRICE_IDS = {
     "basic": os.getenv("STRIPE_PRICE_BASIC", ""),
@@ -40,9 +72,220 @@ TIER_PRICING_AED = {
 }
 
 
+# user_id -> Stripe customer ID. A user's customer ID never changes once set,
+# so known IDs are cached to skip the DB lookup when a returning customer
+# starts another checkout. Misses (no customer yet) are not cached, since the
+# checkout webhook may be handled by another process.
+_customer_ids: dict = {}
+
+# Stripe retries deliveries (up to 3 days); remember recently processed event
+# IDs so retries short-circuit before touching the database. The
+# processed_stripe_events table backs this across restarts.
+SEEN_EVENTS_MAX = 10000
+SEEN_EVENTS_TTL_SECONDS = 24 * 3600
+_seen_events: "OrderedDict[str, float]" = OrderedDict()
+
+
+def _is_duplicate_event(event_id: str) -> bool:
+    """Check the in-memory dedup cache, recording event_id if it is new."""
+    now = time.monotonic()
+
+    # Entries are in insertion order, so expired ones sit at the front
+    while _seen_events:
+        oldest_id, seen_at = next(iter(_seen_events.items()))
+        if now - seen_at < SEEN_EVENTS_TTL_SECONDS:
+            break
+        del _seen_events[oldest_id]
+
+    if event_id in _seen_events:
+        return True
+
+    _seen_events[event_id] = now
+    if len(_seen_events) > SEEN_EVENTS_MAX:
+        _seen_events.popitem(last=False)
+    return False
+
+
+async def _forget_event(event_id: str) -> None:
+    """
+    Drop the dedup markers for an event whose processing failed, so Stripe's
+    retry (or the next delivery of it) is applied instead of skipped.
+    """
+    _seen_events.pop(event_id, None)
+    try:
+        await unmark_stripe_event_processed(event_id)
+    except Exception as exc:
+        logger.error("Could not clear processed marker for Stripe event %s: %s", event_id, exc)
+
+
+# Accepted webhook events are processed in background tasks. The raw payloads
+# sit on this Redis pending queue until their handler finishes.
+WEBHOOK_PENDING_QUEUE = "stripe:webhooks"
+_event_tasks: set = set()
+
+# Stripe never redelivers an event it got a 2xx for, so a background handler
+# that fails is retried here with exponential backoff. After the last attempt
+# the event stays on the pending queue for the startup replay.
+WEBHOOK_RETRY_ATTEMPTS = 10
+WEBHOOK_RETRY_BASE_SECONDS = 5.0
+WEBHOOK_RETRY_MAX_SECONDS = 600.0
+_retry_tasks: set = set()
+
+# Tier changes from webhooks are queued and written in batches, so a burst of
+# deliveries (e.g. a mass renewal run) costs one DB round-trip per batch
+# rather than one per event. Each queued item carries a future that resolves
+# once its write has committed (or fails with the write's error), so handlers
+# still finish only after the change is applied. Without a running flusher
+# they apply directly.
+FLUSH_MAX_EVENTS = 100
+FLUSH_WINDOW_SECONDS = 0.05
+_event_queue: Optional[asyncio.Queue] = None
+_flush_task: Optional[asyncio.Task] = None
+
+
+async def _submit_subscription_event(
+    user_id: int,
+    to_tier: str,
+    event_type: str,
+    stripe_event_id: Optional[str] = None,
+    amount_aed: float = 0,
+    stripe_customer_id: Optional[str] = None,
+    stripe_subscription_id: Optional[str] = None,
+) -> None:
+    """
+    Apply a tier change through the batch flusher, or directly if none is
+    running. Returns once the change has committed; raises if it failed.
+    """
+    args = (user_id, to_tier, event_type, stripe_event_id, amount_aed,
+            stripe_customer_id, stripe_subscription_id)
+    if _flush_task is not None and not _flush_task.done():
+        committed = asyncio.get_running_loop().create_future()
+        await _event_queue.put((args, committed))
+        await committed
+    else:
+        await apply_subscription_event(*args)
+
+
+async def _drain_batch(queue: asyncio.Queue) -> tuple:
+    """
+    Wait for one event, then collect more until the batch or window fills.
+    Returns (batch, stopping); stopping is set once the None sentinel is seen.
+    """
+    loop = asyncio.get_running_loop()
+    item = await queue.get()
+    if item is None:
+        return [], True
+
+    batch = [item]
+    deadline = loop.time() + FLUSH_WINDOW_SECONDS
+    while len(batch) < FLUSH_MAX_EVENTS:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+def _settle(committed: asyncio.Future, exc: Optional[BaseException] = None) -> None:
+    if committed.done():  # the submitting handler was cancelled
+        return
+    if exc is None:
+        committed.set_result(None)
+    else:
+        committed.set_exception(exc)
+
+
+async def _flush_batch(batch: list) -> None:
+    """
+    Write a batch and resolve each item's future. If the transaction fails,
+    events are retried one at a time and any that still fail raise in their
+    submitting handler.
+    """
+    try:
+        await bulk_apply_subscription_events([args for args, _ in batch])
+    except Exception as exc:
+        logger.warning("Bulk subscription flush failed (%d events): %s", len(batch), exc)
+    else:
+        for _, committed in batch:
+            _settle(committed)
+        return
+
+    for args, committed in batch:
+        try:
+            await apply_subscription_event(*args)
+        except Exception as exc:
+            logger.error("Failed to apply subscription event %s: %s", args[3], exc)
+            _settle(committed, exc)
+        else:
+            _settle(committed)
+
+
+async def _flush_loop(queue: asyncio.Queue) -> None:
+    stopping = False
+    batch = []
+    try:
+        while not stopping:
+            batch, stopping = await _drain_batch(queue)
+            if batch:
+                await _flush_batch(batch)
+            batch = []
+    finally:
+        # Never leave a handler waiting on a write that won't happen
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+        for _, committed in batch:
+            _settle(committed, RuntimeError("Subscription event flusher stopped"))
+
+
+def start_subscription_event_flusher() -> None:
+    """Start the background batch writer (call once from app startup)."""
+    global _event_queue, _flush_task
+    if _flush_task is not None and not _flush_task.done():
+        return
+    _event_queue = asyncio.Queue()
+    _flush_task = asyncio.create_task(_flush_loop(_event_queue))
+
+
+async def stop_subscription_event_flusher() -> None:
+    """Flush anything still queued and stop the batch writer."""
+    global _flush_task
+    if _flush_task is None:
+        return
+    # Later submissions apply directly; events queued before the sentinel
+    # are written before the loop exits
+    task, _flush_task = _flush_task, None
+    await _event_queue.put(None)
+    await task
+
+
 def is_stripe_configured() -> bool:
     """Check if Stripe is properly configured."""
-    return bool(stripe.api_key and stripe.api_key.startswith("sk_"))
+    return _STRIPE_CONFIGURED
+
+
+def _verify_signature(payload: bytes, sig_header: str) -> bool:
+    """Check a Stripe-Signature header (t=...,v1=...) against the payload."""
+    ts_match = _SIG_TIMESTAMP_RE.search(sig_header)
+    signatures = _SIG_V1_RE.findall(sig_header)
+    if not ts_match or not signatures:
+        return False
+
+    timestamp = ts_match.group(1)
+    if abs(time.time() - int(timestamp)) > SIGNATURE_TOLERANCE_SECONDS:
+        return False
+
+    mac = _WEBHOOK_HMAC.copy()
+    mac.update(timestamp.encode() + b"." + payload)
+    expected = mac.hexdigest()
+    return any(hmac.compare_digest(expected, sig.lower()) for sig in signatures)
 
 
 async def create_checkout_session(
@@ -67,8 +310,12 @@ async def create_checkout_session(
 
     try:
         # Check if user already has a Stripe customer
-        user = await get_user(user_id)
-        customer_id = user.get("stripe_customer_id") if user else None
+        customer_id = _customer_ids.get(user_id)
+        if customer_id is None:
+            user = await get_user(user_id)
+            customer_id = user.get("stripe_customer_id") if user else None
+            if customer_id:
+                _customer_ids[user_id] = customer_id
 
         session_params = {
             "mode": "subscription",
@@ -99,43 +346,166 @@ async def create_checkout_session(
 
 async def handle_webhook_event(payload: bytes, sig_header: str) -> dict:
     """
-    Process a Stripe webhook event.
-    Returns a dict with event processing result.
+    Verify a Stripe webhook event and hand it off for processing.
+    Returns as soon as the event is accepted so Stripe gets its 2xx quickly;
+    the handlers run in a background task. Accepted payloads are persisted to
+    a Redis pending queue until processed, so an event acknowledged just
+    before a crash is replayed on the next startup. Without Redis the event
+    is processed before returning.
     """
     if not WEBHOOK_SECRET:
         return {"error": "Webhook secret not configured"}
 
-    try:
-        event = stripe.Webhook.construct_event(payload, sig_header, WEBHOOK_SECRET)
-    except stripe.SignatureVerificationError:
+    if isinstance(payload, str):
+        payload = payload.encode()
+
+    if not _verify_signature(payload, sig_header):
         logger.warning("Invalid Stripe webhook signature")
         return {"error": "Invalid signature"}
+
+    try:
+        event = orjson.loads(payload) if orjson else json.loads(payload)
     except ValueError:
         logger.warning("Invalid Stripe webhook payload")
         return {"error": "Invalid payload"}
 
+    event_id = event["id"]
+    event_type = event["type"]
+
+    if _is_duplicate_event(event_id):
+        logger.info("Skipping duplicate Stripe event: %s", event_id)
+        return {"status": "duplicate", "event_id": event_id}
+    try:
+        is_new = await mark_stripe_event_processed(event_id)
+    except Exception:
+        # Not marked anywhere yet: let Stripe's retry through
+        _seen_events.pop(event_id, None)
+        raise
+    if not is_new:
+        logger.info("Skipping duplicate Stripe event: %s", event_id)
+        return {"status": "duplicate", "event_id": event_id}
+
+    pending_item = payload.decode()
+    if await push_pending(WEBHOOK_PENDING_QUEUE, pending_item):
+        _spawn_event_task(event, pending_item)
+    elif not await _process_event(event, None):
+        # No replayable copy without Redis: apply before acknowledging, and
+        # answer with an error on failure so Stripe redelivers
+        return {"error": "Event processing failed"}
+
+    return {"status": "accepted", "event_id": event_id, "event_type": event_type}
+
+
+def _spawn_event_task(event: dict, pending_item: str, attempt: int = 0) -> None:
+    task = asyncio.create_task(_process_event(event, pending_item, attempt))
+    # Hold a reference so the task isn't garbage-collected mid-flight
+    _event_tasks.add(task)
+    task.add_done_callback(_event_tasks.discard)
+
+
+def _schedule_retry(event: dict, pending_item: str, attempt: int) -> None:
+    """Re-run a failed background event after a backoff delay."""
+    if attempt > WEBHOOK_RETRY_ATTEMPTS:
+        logger.error(
+            "Giving up on Stripe event %s after %d attempts; left for the startup replay",
+            event.get("id"), attempt,
+        )
+        return
+    delay = min(WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempt - 1), WEBHOOK_RETRY_MAX_SECONDS)
+    logger.warning("Retrying Stripe event %s in %.0fs (attempt %d)", event.get("id"), delay, attempt)
+    task = asyncio.create_task(_retry_event_after(delay, event, pending_item, attempt))
+    _retry_tasks.add(task)
+    task.add_done_callback(_retry_tasks.discard)
+
+
+async def _retry_event_after(delay: float, event: dict, pending_item: str, attempt: int) -> None:
+    await asyncio.sleep(delay)
+    _spawn_event_task(event, pending_item, attempt)
+
+
+async def _process_event(event: dict, pending_item: Optional[str], attempt: int = 0) -> bool:
+    """
+    Run the handler for an accepted event, then clear it from the pending
+    queue. Handlers return only once their writes have committed, so the
+    pending copy is never dropped before the change is durable.
+    Returns False if processing failed.
+    """
+    try:
+        result = await _dispatch_event(event)
+    except Exception:
+        logger.exception("Failed to process Stripe event %s", event.get("id"))
+        if pending_item is None:
+            # Processed inline and answered with an error: Stripe redelivers
+            await _forget_event(event["id"])
+        else:
+            # Already acknowledged; stays on the pending queue meanwhile
+            _schedule_retry(event, pending_item, attempt + 1)
+        return False
+
+    logger.debug("Stripe event %s processed: %s", event["id"], result)
+    if pending_item is not None:
+        await remove_pending(WEBHOOK_PENDING_QUEUE, pending_item)
+    return True
+
+
+async def _dispatch_event(event: dict) -> dict:
+    """Route a verified event to its handler."""
+    event_id = event["id"]
     event_type = event["type"]
     data = event["data"]["object"]
 
     logger.info("Processing Stripe event: %s", event_type)
 
     if event_type == "checkout.session.completed":
-        return await _handle_checkout_completed(data, event["id"])
+        return await _handle_checkout_completed(data, event_id)
 
     elif event_type == "customer.subscription.updated":
-        return await _handle_subscription_updated(data, event["id"])
+        return await _handle_subscription_updated(data, event_id)
 
     elif event_type == "customer.subscription.deleted":
-        return await _handle_subscription_deleted(data, event["id"])
+        return await _handle_subscription_deleted(data, event_id)
 
     elif event_type == "invoice.payment_failed":
-        return await _handle_payment_failed(data, event["id"])
+        return await _handle_payment_failed(data, event_id)
 
     else:
         logger.debug("Unhandled Stripe event type: %s", event_type)
         return {"status": "ignored", "event_type": event_type}
 
 
+async def recover_pending_webhook_events() -> int:
+    """
+    Re-run events that were accepted but never finished processing
+    (call once at startup, after the cache is initialised).
+    Returns the number of events replayed.
+    """
+    items = await get_pending(WEBHOOK_PENDING_QUEUE)
+    for item in items:
+        try:
+            event = orjson.loads(item) if orjson else json.loads(item)
+        except ValueError:
+            logger.warning("Dropping unreadable pending Stripe event")
+            await remove_pending(WEBHOOK_PENDING_QUEUE, item)
+            continue
+        _spawn_event_task(event, item)
+
+    if items:
+        logger.info("Replaying %d pending Stripe events", len(items))
+    return len(items)
+
+
+async def wait_for_webhook_tasks() -> None:
+    """
+    Wait for in-flight webhook handlers (call on shutdown, before the flusher
+    stops). Retries still waiting out their backoff are cancelled; their
+    events stay on the pending queue for the next startup.
+    """
+    while _event_tasks:
+        await asyncio.gather(*_event_tasks, return_exceptions=True)
+    for task in list(_retry_tasks):
+        task.cancel()
+
+
 async def _handle_checkout_completed(session: dict, event_id: str) -> dict:
     """Handle successful checkout — upgrade user tier."""
     metadata = session.get("metadata", {})
@@ -147,30 +517,20 @@ async def _handle_checkout_completed(session: dict, event_id: str) -> dict:
     if not user_id:
         return {"error": "No user_id in session metadata"}
 
-    # Get current tier for logging
-    user = await get_user(user_id)
-    from_tier = user.get("tier", "free") if user else "free"
-
-    # Update user in database
-    await update_user_tier(
-        user_id=user_id,
-        tier=tier,
-        stripe_customer_id=customer_id,
-        stripe_subscription_id=subscription_id,
-    )
+    if customer_id:
+        _customer_ids[user_id] = customer_id
 
-    # Log subscription event
-    amount_aed = TIER_PRICING_AED.get(tier, 0)
-    await log_subscription_event(
+    await _submit_subscription_event(
         user_id=user_id,
-        event_type="checkout_completed",
-        from_tier=from_tier,
         to_tier=tier,
+        event_type="checkout_completed",
         stripe_event_id=event_id,
-        amount_aed=amount_aed,
+        amount_aed=TIER_PRICING_AED.get(tier, 0),
+        stripe_customer_id=customer_id,
+        stripe_subscription_id=subscription_id,
     )
 
-    logger.info("User %s upgraded from %s to %s", user_id, from_tier, tier)
+    logger.info("User %s upgraded to %s", user_id, tier)
     return {"status": "upgraded", "user_id": user_id, "tier": tier}
 
 
@@ -190,15 +550,10 @@ async def _handle_subscription_updated(subscription: dict, event_id: str) -> dic
         logger.warning("Cannot find user for subscription update: %s", subscription_id)
         return {"status": "user_not_found"}
 
-    user = await get_user(user_id)
-    from_tier = user.get("tier", "free") if user else "free"
-
-    await update_user_tier(user_id=user_id, tier=new_tier)
-    await log_subscription_event(
+    await _submit_subscription_event(
         user_id=user_id,
-        event_type="subscription_updated",
-        from_tier=from_tier,
         to_tier=new_tier,
+        event_type="subscription_updated",
         stripe_event_id=event_id,
     )
 
@@ -213,15 +568,10 @@ async def _handle_subscription_deleted(subscription: dict, event_id: str) -> dic
     if not user_id:
         return {"status": "user_not_found"}
 
-    user = await get_user(user_id)
-    from_tier = user.get("tier", "free") if user else "free"
-
-    await update_user_tier(user_id=user_id, tier="free", stripe_subscription_id=None)
-    await log_subscription_event(
+    await _submit_subscription_event(
         user_id=user_id,
-        event_type="subscription_cancelled",
-        from_tier=from_tier,
         to_tier="free",
+        event_type="subscription_cancelled",
         stripe_event_id=event_id,
     )
 
@@ -4,6 +4,17 @@ TrueValue AI PDF Report Generator
 Generates institutional-grade A4 PDF reports from analysis data.
 """
 
-from pdf_generator.generator import generate_report
+import os
+
+from reportlab import rl_config
+
+# Per-attribute validation on graphics shapes is a development aid; the
+# vector charts build hundreds of shapes per report. ReportLab reads this
+# flag when reportlab.graphics.shapes is first imported, so it must be set
+# before the generator (and svglib) load.
+if not os.getenv("REPORTLAB_DEBUG"):
+    rl_config.shapeChecking = 0
+
+from pdf_generator.generator import generate_report  # noqa: E402
 
 __all__ = ["generate_report"]
@@ -1,146 +1,193 @@
 """
 Chart Generation for TrueValue PDF Reports
-Uses matplotlib with Agg backend (non-interactive, thread-safe).
+Uses matplotlib's object API with Agg canvases directly; pyplot (and its
+global figure registry) is never touched, so rendering is reentrant.
 """
 
 import io
 import math
+import threading
+from contextlib import contextmanager
 import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.patches as mpatches
+from matplotlib.colors import to_rgba, to_rgba_array
 import numpy as np
 
-
-def create_score_gauge(score: int, max_score: int = 100) -> io.BytesIO:
+# Fixed SVG element IDs so identical charts produce identical bytes. Set once
+# here rather than per render: rc_context isn't safe across render threads.
+matplotlib.rcParams["svg.hashsalt"] = "truevalue-charts"
+
+# Gauge background: 100 wedges from pi to 0 (left to right semicircle)
+_GAUGE_THETA = np.linspace(np.pi, 0, 100)
+_GAUGE_RADII = np.ones(100)
+
+# Color zones per wedge: red, orange, yellow, light green, green
+_GAUGE_PCT = np.arange(100) / 100
+_GAUGE_COLORS = np.select(
+    [_GAUGE_PCT < 0.2, _GAUGE_PCT < 0.4, _GAUGE_PCT < 0.6, _GAUGE_PCT < 0.8],
+    ["#e53e3e", "#ed8936", "#d69e2e", "#48bb78"],
+    default="#38a169",
+)
+
+# Translucency is baked into the colors rather than passed as alpha=, so SVG
+# output carries fill-opacity (which svglib understands) instead of opacity
+_GAUGE_FILL = to_rgba_array(_GAUGE_COLORS, 0.3)
+_RADAR_FILL = to_rgba("#2b6cb0", 0.25)
+
+# Radar layout: fixed 5 pillars with their maximum scores
+_RADAR_CATEGORIES = ("Price", "Yield", "Liquidity", "Quality", "Chiller")
+_RADAR_MAX_INT = (30, 25, 20, 15, 10)
+_RADAR_MAX = np.array(_RADAR_MAX_INT, dtype=float)
+_RADAR_ANGLES = np.linspace(0, 2 * np.pi, len(_RADAR_CATEGORIES), endpoint=False)
+_RADAR_ANGLES_CLOSED = np.append(_RADAR_ANGLES, _RADAR_ANGLES[0])
+
+# Per-thread pool of (fig, ax) keyed by (figsize, projection). Building a
+# Figure/Axes/renderer is the expensive part of a chart, so each thread keeps
+# one per layout and clears the axes between uses.
+_fig_pool = threading.local()
+
+
+def _acquire_figure(figsize: tuple, projection: str = None):
+    """Return this thread's pooled (fig, ax) for the given layout."""
+    pool = getattr(_fig_pool, "figures", None)
+    if pool is None:
+        pool = _fig_pool.figures = {}
+
+    key = (figsize, projection)
+    entry = pool.get(key)
+    if entry is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(projection=projection)
+        entry = pool[key] = (fig, ax)
+    return entry
+
+
+def _release_figure(fig, ax):
+    """Reset a pooled figure so the next chart lays out from scratch."""
+    ax.clear()
+    # tight_layout() moved the axes; restore the default subplot params so the
+    # next render computes the same layout as a freshly created figure
+    fig.subplots_adjust(**{
+        param: matplotlib.rcParams[f"figure.subplot.{param}"]
+        for param in ("left", "right", "bottom", "top", "wspace", "hspace")
+    })
+
+
+@contextmanager
+def _pooled_figure(figsize: tuple, projection: str = None):
+    """Borrow this thread's pooled (fig, ax), resetting it afterwards."""
+    fig, ax = _acquire_figure(figsize, projection)
+    try:
+        yield fig, ax
+    finally:
+        _release_figure(fig, ax)
+
+
+def _render_chart(fig, fmt: str = "png", **savefig_kwargs) -> io.BytesIO:
     """
-    Create a semicircular gauge chart for the investment score.
-    Returns a BytesIO PNG image.
+    Lay out and save a pooled figure to a buffer.
+    fmt="png" rasterizes at 150 dpi; fmt="svg" keeps the chart as vectors.
     """
-    fig, ax = plt.subplots(figsize=(4, 2.5), subplot_kw={"projection": "polar"})
-
-    # Gauge spans from pi to 0 (left to right semicircle)
-    theta_bg = np.linspace(np.pi, 0, 100)
-    radii_bg = [1] * 100
-
-    # Color zones
-    colors_bg = []
-    for i in range(100):
-        pct = i / 100
-        if pct < 0.2:
-            colors_bg.append("#e53e3e")   # Red
-        elif pct < 0.4:
-            colors_bg.append("#ed8936")   # Orange
-        elif pct < 0.6:
-            colors_bg.append("#d69e2e")   # Yellow
-        elif pct < 0.8:
-            colors_bg.append("#48bb78")   # Light green
-        else:
-            colors_bg.append("#38a169")   # Green
-
-    ax.bar(theta_bg, radii_bg, width=np.pi / 100, bottom=0.6,
-           color=colors_bg, alpha=0.3, edgecolor="none")
-
-    # Score needle
-    score_pct = min(score / max_score, 1.0)
-    needle_angle = np.pi * (1 - score_pct)
-    ax.annotate("", xy=(needle_angle, 1.5), xytext=(needle_angle, 0.55),
-                arrowprops=dict(arrowstyle="-|>", color="#1a365d", lw=2.5))
-
-    # Score text
-    ax.text(np.pi / 2, 0.15, f"{score}", ha="center", va="center",
-            fontsize=28, fontweight="bold", color="#1a365d")
-    ax.text(np.pi / 2, -0.2, f"/ {max_score}", ha="center", va="center",
-            fontsize=10, color="#718096")
-
-    ax.set_ylim(0, 1.7)
-    ax.set_theta_zero_location("N")
-    ax.set_theta_direction(-1)
-    ax.set_thetamin(0)
-    ax.set_thetamax(180)
-    ax.axis("off")
-
-    plt.tight_layout()
+    fig.tight_layout()
+    if fmt == "svg":
+        # No timestamp, so identical charts produce identical bytes
+        savefig_kwargs.setdefault("metadata", {"Date": None})
     buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight",
-                transparent=True, pad_inches=0.1)
-    plt.close(fig)
+    fig.savefig(buf, format=fmt, dpi=150, bbox_inches="tight",
+                transparent=True, **savefig_kwargs)
     buf.seek(0)
     return buf
 
 
-def create_pillar_radar(scores: dict) -> io.BytesIO:
+def create_score_gauge(score: int, max_score: int = 100, fmt: str = "png") -> io.BytesIO:
     """
-    Create a radar/spider chart for the 5-pillar breakdown.
-    scores = {"Price": 25, "Yield": 18, "Liquidity": 16, "Quality": 12, "Chiller": 8}
-    Max values: Price=30, Yield=25, Liquidity=20, Quality=15, Chiller=10
+    Create a semicircular gauge chart for the investment score.
+    Returns a BytesIO image in the requested format ("png" or "svg").
     """
-    categories = list(scores.keys())
-    max_values = [30, 25, 20, 15, 10]
-    values = [scores.get(cat, 0) for cat in categories]
+    with _pooled_figure((4, 2.5), "polar") as (fig, ax):
+        ax.bar(_GAUGE_THETA, _GAUGE_RADII, width=np.pi / 100, bottom=0.6,
+               color=_GAUGE_FILL, edgecolor="none")
 
-    # Normalize to 0-1
-    normalized = [v / m if m > 0 else 0 for v, m in zip(values, max_values)]
+        # Score needle
+        score_pct = min(score / max_score, 1.0)
+        needle_angle = np.pi * (1 - score_pct)
+        ax.annotate("", xy=(needle_angle, 1.5), xytext=(needle_angle, 0.55),
+                    arrowprops=dict(arrowstyle="-|>", color="#1a365d", lw=2.5))
 
-    # Close the polygon
-    normalized += normalized[:1]
-    angles = np.linspace(0, 2 * np.pi, len(categories), endpoint=False).tolist()
-    angles += angles[:1]
+        # Score text
+        ax.text(np.pi / 2, 0.15, f"{score}", ha="center", va="center",
+                fontsize=28, fontweight="bold", color="#1a365d")
+        ax.text(np.pi / 2, -0.2, f"/ {max_score}", ha="center", va="center",
+                fontsize=10, color="#718096")
 
-    fig, ax = plt.subplots(figsize=(4, 4), subplot_kw={"projection": "polar"})
+        ax.set_ylim(0, 1.7)
+        ax.set_theta_zero_location("N")
+        ax.set_theta_direction(-1)
+        ax.set_thetamin(0)
+        ax.set_thetamax(180)
+        ax.axis("off")
 
-    ax.fill(angles, normalized, color="#2b6cb0", alpha=0.25)
-    ax.plot(angles, normalized, color="#2b6cb0", linewidth=2)
-    ax.scatter(angles[:-1], normalized[:-1], color="#1a365d", s=50, zorder=5)
-
-    ax.set_xticks(angles[:-1])
-    labels = [f"{cat}\n{val}/{mx}" for cat, val, mx in zip(categories, values, max_values)]
-    ax.set_xticklabels(labels, fontsize=8, color="#1a202c")
-    ax.set_ylim(0, 1)
-    ax.set_yticks([0.25, 0.5, 0.75, 1.0])
-    ax.set_yticklabels(["25%", "50%", "75%", "100%"], fontsize=6, color="#a0aec0")
-    ax.spines["polar"].set_color("#e2e8f0")
-
-    plt.tight_layout()
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight", transparent=True)
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+        return _render_chart(fig, fmt, pad_inches=0.1)
 
 
-def create_yield_comparison(gross: float, net: float, benchmark: float = 6.0) -> io.BytesIO:
+def create_pillar_radar(scores: dict, fmt: str = "png") -> io.BytesIO:
     """
-    Create a horizontal bar chart comparing gross yield, net yield, and benchmark.
+    Create a radar/spider chart for the 5-pillar breakdown.
+    scores = {"Price": 25, "Yield": 18, "Liquidity": 16, "Quality": 12, "Chiller": 8}
+    Max values: Price=30, Yield=25, Liquidity=20, Quality=15, Chiller=10
     """
-    fig, ax = plt.subplots(figsize=(5, 2))
+    values = [scores.get(cat, 0) for cat in _RADAR_CATEGORIES]
 
-    categories = ["Benchmark", "Net Yield", "Gross Yield"]
-    values = [benchmark, net, gross]
-    colors = ["#a0aec0", "#2b6cb0", "#1a365d"]
+    # Normalize to 0-1 and close the polygon
+    normalized = np.divide(values, _RADAR_MAX)
+    normalized = np.append(normalized, normalized[0])
 
-    # Color net yield red if below benchmark
-    if net < benchmark:
-        colors[1] = "#e53e3e"
+    with _pooled_figure((4, 4), "polar") as (fig, ax):
+        ax.fill(_RADAR_ANGLES_CLOSED, normalized, color=_RADAR_FILL)
+        ax.plot(_RADAR_ANGLES_CLOSED, normalized, color="#2b6cb0", linewidth=2)
+        ax.scatter(_RADAR_ANGLES, normalized[:-1], color="#1a365d", s=50, zorder=5)
 
-    bars = ax.barh(categories, values, height=0.5, color=colors, edgecolor="none")
+        ax.set_xticks(_RADAR_ANGLES)
+        labels = [f"{cat}\n{val}/{mx}" for cat, val, mx in zip(_RADAR_CATEGORIES, values, _RADAR_MAX_INT)]
+        ax.set_xticklabels(labels, fontsize=8, color="#1a202c")
+        ax.set_ylim(0, 1)
+        ax.set_yticks([0.25, 0.5, 0.75, 1.0])
+        ax.set_yticklabels(["25%", "50%", "75%", "100%"], fontsize=6, color="#a0aec0")
+        ax.spines["polar"].set_color("#e2e8f0")
 
-    # Add value labels
-    for bar, val in zip(bars, values):
-        ax.text(bar.get_width() + 0.2, bar.get_y() + bar.get_height() / 2,
-                f"{val:.1f}%", va="center", fontsize=10, fontweight="bold", color="#1a202c")
+        return _render_chart(fig, fmt)
 
-    ax.set_xlim(0, max(values) * 1.3)
-    ax.set_xlabel("Yield %", fontsize=9, color="#718096")
-    ax.spines["top"].set_visible(False)
-    ax.spines["right"].set_visible(False)
-    ax.spines["bottom"].set_color("#e2e8f0")
-    ax.spines["left"].set_color("#e2e8f0")
-    ax.tick_params(colors="#718096")
 
-    plt.tight_layout()
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight", transparent=True)
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+def create_yield_comparison(gross: float, net: float, benchmark: float = 6.0,
+                            fmt: str = "png") -> io.BytesIO:
+    """
+    Create a horizontal bar chart comparing gross yield, net yield, and benchmark.
+    """
+    with _pooled_figure((5, 2)) as (fig, ax):
+        categories = ["Benchmark", "Net Yield", "Gross Yield"]
+        values = [benchmark, net, gross]
+        colors = ["#a0aec0", "#2b6cb0", "#1a365d"]
+
+        # Color net yield red if below benchmark
+        if net < benchmark:
+            colors[1] = "#e53e3e"
+
+        bars = ax.barh(categories, values, height=0.5, color=colors, edgecolor="none")
+
+        # Add value labels
+        for bar, val in zip(bars, values):
+            ax.text(bar.get_width() + 0.2, bar.get_y() + bar.get_height() / 2,
+                    f"{val:.1f}%", va="center", fontsize=10, fontweight="bold", color="#1a202c")
+
+        ax.set_xlim(0, max(values) * 1.3)
+        ax.set_xlabel("Yield %", fontsize=9, color="#718096")
+        ax.spines["top"].set_visible(False)
+        ax.spines["right"].set_visible(False)
+        ax.spines["bottom"].set_color("#e2e8f0")
+        ax.spines["left"].set_color("#e2e8f0")
+        ax.tick_params(colors="#718096")
+
+        return _render_chart(fig, fmt)
@@ -5,7 +5,12 @@ Builds multi-page A4 PDF reports from analysis data.
 
 import io
 import re
+import html
+import asyncio
+import hashlib
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from reportlab.lib.pagesizes import A4
@@ -24,11 +29,83 @@ from pdf_generator.styles import (
 from pdf_generator.charts import (
     create_score_gauge, create_pillar_radar, create_yield_comparison,
 )
+from pdf_generator.patterns import EMOJI_RE, HEADING_RE, MARKDOWN_RE
+
+try:
+    from svglib.svglib import svg2rlg
+except ImportError:  # fall back to embedding rasterized PNG charts
+    svg2rlg = None
 
 logger = logging.getLogger("pdf_generator")
 
+# Charts are embedded as vector drawings when svglib is available
+CHART_FORMAT = "svg" if svg2rlg else "png"
+
 PAGE_WIDTH, PAGE_HEIGHT = A4
 
+# Pillar names with their maximum scores, in chart order
+PILLARS = (("Price", 30), ("Yield", 25), ("Liquidity", 20), ("Quality", 15), ("Chiller", 10))
+
+RECOMMENDATIONS = ("STRONG BUY", "GOOD BUY", "CAUTION", "NEGOTIATE", "DO NOT BUY")
+
+# The three charts are independent, so each report renders them in parallel.
+# Long-lived workers keep their per-thread figure pools warm between reports.
+_chart_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="pdf-chart")
+
+# Built once; styles are only read while building a report
+_STYLES = get_report_styles()
+
+# Finished reports keyed by a hash of their inputs, so re-downloads and
+# delivery retries skip the rebuild. Bounded LRU (~50 KB per report).
+PDF_CACHE_MAX = 128
+_pdf_cache: "OrderedDict[bytes, bytes]" = OrderedDict()
+
+# Precompiled patterns used on every report
+_SCORE_RE = re.compile(r'(?:Score|score)[:\s]*(\d+)\s*/\s*100')
+_GROSS_RE = re.compile(r'(\d+\.?\d*)\s*%\s*gross\s*yield', re.IGNORECASE)
+_NET_RE = re.compile(r'(\d+\.?\d*)\s*%\s*net\s*yield', re.IGNORECASE)
+_PSF_RE = re.compile(r'AED\s*([\d,]+)\s*/\s*sqft')
+_REC_RE = re.compile(rf'\b({"|".join(RECOMMENDATIONS)})\b')
+_PILLAR_RES = {
+    name: re.compile(rf'{name.lower()}\s*(?:score)?[:\s]*(\d+)\s*/\s*{max_val}', re.IGNORECASE)
+    for name, max_val in PILLARS
+}
+
+
+def _chart_flowable(buf: io.BytesIO, width: float, height: float):
+    """Wrap a rendered chart in a flowable sized to width x height."""
+    if CHART_FORMAT != "svg":
+        return Image(buf, width=width, height=height)
+
+    drawing = svg2rlg(buf)
+    drawing.scale(width / drawing.width, height / drawing.height)
+    drawing.width, drawing.height = width, height
+    drawing.hAlign = "CENTER"  # match Image's default placement
+    return drawing
+
+
+def _paragraph_sub(match: re.Match) -> str:
+    bold, italic, tag, tag_body = match.group(1, 2, 3, 4)
+    if bold is not None:
+        return f"<b>{MARKDOWN_RE.sub(_paragraph_sub, bold)}</b>"
+    if italic is not None:
+        return f"<i>{MARKDOWN_RE.sub(_paragraph_sub, italic)}</i>"
+    if tag is not None:
+        return f"<{tag}>{MARKDOWN_RE.sub(_paragraph_sub, tag_body)}</{tag}>"
+    text = match.group()
+    if text.startswith("&lt;br"):
+        return "<br/>"
+    return "-" if text in "━─" else ""
+
+
+def _markdown_to_markup(text: str) -> str:
+    """
+    Convert a markdown paragraph to ReportLab paragraph markup.
+    &, < and > are escaped first; only matched <b>/<i> pairs and <br> are
+    restored, and every tag emitted is balanced, so the result always parses.
+    """
+    return MARKDOWN_RE.sub(_paragraph_sub, html.escape(text, quote=False))
+
 
 def _parse_score_from_text(text: str) -> dict:
     """Extract structured data from Claude's analysis text."""
@@ -44,28 +121,27 @@ def _parse_score_from_text(text: str) -> dict:
     }
 
     # Investment score
-    score_match = re.search(r'(?:Score|score)[:\s]*(\d+)\s*/\s*100', text)
+    score_match = _SCORE_RE.search(text)
     if score_match:
         data["score"] = int(score_match.group(1))
 
     # Recommendation
-    for rec in ["STRONG BUY", "GOOD BUY", "CAUTION", "NEGOTIATE", "DO NOT BUY"]:
-        if rec in text.upper():
-            data["recommendation"] = rec
-            break
+    rec_match = _REC_RE.search(text.upper())
+    if rec_match:
+        data["recommendation"] = rec_match.group(1)
 
     # Gross yield
-    gross_match = re.search(r'(\d+\.?\d*)\s*%\s*gross\s*yield', text, re.IGNORECASE)
+    gross_match = _GROSS_RE.search(text)
     if gross_match:
         data["gross_yield"] = float(gross_match.group(1))
 
     # Net yield
-    net_match = re.search(r'(\d+\.?\d*)\s*%\s*net\s*yield', text, re.IGNORECASE)
+    net_match = _NET_RE.search(text)
     if net_match:
         data["net_yield"] = float(net_match.group(1))
 
     # Price per sqft
-    psf_match = re.search(r'AED\s*([\d,]+)\s*/\s*sqft', text)
+    psf_match = _PSF_RE.search(text)
     if psf_match:
         data["price_per_sqft"] = int(psf_match.group(1).replace(",", ""))
 
@@ -81,7 +157,36 @@ async def generate_report(
     """
     Generate a multi-page A4 PDF report from analysis text.
     Returns the PDF as bytes.
+
+    Chart rendering and the ReportLab build are CPU-bound and take
+    seconds, so they run in worker threads to keep the event loop free.
+    Identical requests are served from an in-memory LRU of built reports.
     """
+    key = hashlib.sha256(
+        "\x1f".join((user_name, query, repr(tools_used), analysis_text)).encode()
+    ).digest()
+    cached = _pdf_cache.get(key)
+    if cached is not None:
+        _pdf_cache.move_to_end(key)
+        return cached
+
+    pdf_bytes = await asyncio.to_thread(
+        _build_pdf_sync, analysis_text, query, user_name, tools_used,
+    )
+
+    _pdf_cache[key] = pdf_bytes
+    if len(_pdf_cache) > PDF_CACHE_MAX:
+        _pdf_cache.popitem(last=False)
+    return pdf_bytes
+
+
+def _build_pdf_sync(
+    analysis_text: str,
+    query: str,
+    user_name: str,
+    tools_used: list,
+) -> bytes:
+    """Build the report synchronously; see generate_report."""
     buf = io.BytesIO()
     doc = SimpleDocTemplate(
         buf,
@@ -92,10 +197,38 @@ async def generate_report(
         rightMargin=2 * cm,
     )
 
-    styles = get_report_styles()
+    styles = _STYLES
     story = []
     parsed = _parse_score_from_text(analysis_text)
 
+    # Extract pillar scores from text (best effort)
+    pillar_scores = {
+        "Price": 20,
+        "Yield": 18,
+        "Liquidity": 14,
+        "Quality": 10,
+        "Chiller": 6,
+    }
+
+    # Try to parse from text
+    for pillar, pattern in _PILLAR_RES.items():
+        match = pattern.search(analysis_text)
+        if match:
+            pillar_scores[pillar] = int(match.group(1))
+
+    # Start all chart renders now; each is collected where it's placed
+    gauge_future = _chart_executor.submit(create_score_gauge, parsed["score"], fmt=CHART_FORMAT)
+    radar_future = _chart_executor.submit(create_pillar_radar, pillar_scores, fmt=CHART_FORMAT)
+    has_yield = parsed["gross_yield"] > 0 or parsed["net_yield"] > 0
+    if has_yield:
+        yield_future = _chart_executor.submit(
+            create_yield_comparison,
+            gross=parsed["gross_yield"],
+            net=parsed["net_yield"],
+            benchmark=6.0,
+            fmt=CHART_FORMAT,
+        )
+
     # =====================================================
     # COVER PAGE
     # =====================================================
@@ -146,8 +279,8 @@ async def generate_report(
 
     # Score gauge chart
     try:
-        gauge_img = create_score_gauge(parsed["score"])
-        story.append(Image(gauge_img, width=8 * cm, height=5 * cm))
+        gauge_img = gauge_future.result()
+        story.append(_chart_flowable(gauge_img, 8 * cm, 5 * cm))
     except Exception as exc:
         logger.warning("Could not generate score gauge: %s", exc)
         story.append(Paragraph(
@@ -177,29 +310,14 @@ async def generate_report(
     story.append(HRFlowable(width="100%", color=BRAND_PRIMARY, thickness=2))
     story.append(Spacer(1, 0.5 * cm))
 
-    # Extract pillar scores from text (best effort)
-    pillar_scores = {
-        "Price": 20,
-        "Yield": 18,
-        "Liquidity": 14,
-        "Quality": 10,
-        "Chiller": 6,
-    }
-
-    # Try to parse from text
-    for pillar, max_val in [("Price", 30), ("Yield", 25), ("Liquidity", 20), ("Quality", 15), ("Chiller", 10)]:
-        match = re.search(rf'{pillar.lower()}\s*(?:score)?[:\s]*(\d+)\s*/\s*{max_val}', analysis_text, re.IGNORECASE)
-        if match:
-            pillar_scores[pillar] = int(match.group(1))
-
     try:
-        radar_img = create_pillar_radar(pillar_scores)
-        story.append(Image(radar_img, width=10 * cm, height=10 * cm))
+        radar_img = radar_future.result()
+        story.append(_chart_flowable(radar_img, 10 * cm, 10 * cm))
     except Exception as exc:
         logger.warning("Could not generate radar chart: %s", exc)
 
     # Pillar details table
-    pillar_max = {"Price": 30, "Yield": 25, "Liquidity": 20, "Quality": 15, "Chiller": 10}
+    pillar_max = dict(PILLARS)
     pillar_table_data = [
         [
             Paragraph("Pillar", styles["TableHeader"]),
@@ -236,18 +354,14 @@ async def generate_report(
     # YIELD COMPARISON
     # =====================================================
 
-    if parsed["gross_yield"] > 0 or parsed["net_yield"] > 0:
+    if has_yield:
         story.append(Paragraph("Yield Analysis", styles["SectionHeader"]))
         story.append(HRFlowable(width="100%", color=BRAND_PRIMARY, thickness=2))
         story.append(Spacer(1, 0.5 * cm))
 
         try:
-            yield_img = create_yield_comparison(
-                gross=parsed["gross_yield"],
-                net=parsed["net_yield"],
-                benchmark=6.0,
-            )
-            story.append(Image(yield_img, width=12 * cm, height=5 * cm))
+            yield_img = yield_future.result()
+            story.append(_chart_flowable(yield_img, 12 * cm, 5 * cm))
         except Exception as exc:
             logger.warning("Could not generate yield chart: %s", exc)
 
@@ -269,27 +383,14 @@ async def generate_report(
             continue
 
         # Handle headers (### or ** ... **)
-        if clean.startswith("###") or clean.startswith("##"):
-            clean = re.sub(r'^#+\s*', '', clean)
+        if clean.startswith("##"):
+            clean = html.escape(EMOJI_RE.sub('', HEADING_RE.sub('', clean)), quote=False)
             story.append(Paragraph(clean, styles["SubHeader"]))
         elif clean.startswith("**") and clean.endswith("**"):
-            story.append(Paragraph(clean.strip("*"), styles["SubHeader"]))
+            clean = html.escape(EMOJI_RE.sub('', clean.strip("*")), quote=False)
+            story.append(Paragraph(clean, styles["SubHeader"]))
         else:
-            # Clean markdown formatting for PDF
-            clean = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', clean)
-            clean = re.sub(r'\*(.+?)\*', r'<i>\1</i>', clean)
-            clean = clean.replace("━", "-").replace("─", "-")
-            # Remove emojis that ReportLab can't render
-            clean = re.sub(
-                r'[\U0001F300-\U0001F9FF\U00002702-\U000027B0\U0001FA00-\U0001FA6F\U0001FA70-\U0001FAFF]',
-                '', clean
-            )
-            try:
-                story.append(Paragraph(clean, styles["BodyText2"]))
-            except Exception:
-                # Fallback: strip all XML-like tags
-                plain = re.sub(r'<[^>]+>', '', clean)
-                story.append(Paragraph(plain, styles["BodyText2"]))
+            story.append(Paragraph(_markdown_to_markup(clean), styles["BodyText2"]))
 
     # =====================================================
     # DISCLAIMER
@@ -0,0 +1,22 @@
+"""
+Shared compiled patterns for turning analysis markdown into PDF text.
+"""
+
+import re
+
+# Emoji ranges ReportLab's built-in fonts can't render
+EMOJI_CLASS = r'[\U0001F300-\U0001F9FF\U00002702-\U000027B0\U0001FA00-\U0001FA6F\U0001FA70-\U0001FAFF]'
+EMOJI_RE = re.compile(EMOJI_CLASS)
+
+# Leading markdown heading marker ("### ")
+HEADING_RE = re.compile(r'^#+\s*')
+
+# Markdown -> ReportLab markup in one pass over html-escaped text: **bold**
+# (group 1), *italic* (group 2), allow-listed inline HTML that arrived
+# escaped -- a matched <b>/<i> pair (tag in group 3, content in group 4) or
+# <br> -- box-drawing rules, and emojis
+MARKDOWN_RE = re.compile(
+    r'\*\*(.+?)\*\*|\*(.+?)\*'
+    r'|&lt;(b|i)&gt;(.+?)&lt;/\3&gt;|&lt;br\s*/?&gt;'
+    rf'|[━─]|{EMOJI_CLASS}'
+)
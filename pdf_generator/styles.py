@@ -2,6 +2,8 @@
 TrueValue Brand Styles for PDF Reports
 """
 
+from functools import lru_cache
+
 from reportlab.lib.colors import HexColor
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
@@ -20,6 +22,7 @@ BRAND_DARK_TEXT = HexColor("#1a202c")     # Near-black text
 BRAND_MUTED = HexColor("#718096")        # Gray text
 BRAND_WHITE = HexColor("#ffffff")
 BRAND_BORDER = HexColor("#e2e8f0")       # Light border
+BRAND_COVER_SUBTITLE = HexColor("#bee3f8")  # Pale blue (on navy cover)
 
 # Score color mapping
 SCORE_COLORS = {
@@ -40,8 +43,12 @@ def get_score_color(recommendation: str) -> HexColor:
 # PARAGRAPH STYLES
 # =====================================================
 
+@lru_cache(maxsize=1)
 def get_report_styles():
-    """Return custom paragraph styles for the PDF report."""
+    """
+    Return custom paragraph styles for the PDF report.
+    Built once and shared by every caller, so treat the sheet as read-only.
+    """
     styles = getSampleStyleSheet()
 
     styles.add(ParagraphStyle(
@@ -57,7 +64,7 @@ def get_report_styles():
         name="CoverSubtitle",
         fontName="Helvetica",
         fontSize=14,
-        textColor=HexColor("#bee3f8"),
+        textColor=BRAND_COVER_SUBTITLE,
         alignment=TA_CENTER,
         spaceAfter=8,
     ))
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Dubai Estate AI - Main Entry Point
-Runs FastAPI (uvicorn) + Telegram bot concurrently via asyncio.gather.
+Runs FastAPI (uvicorn) + Telegram bot concurrently in an asyncio.TaskGroup.
 Supports BOT_MODE=webhook for production (bot receives updates via webhook).
 """
 
@@ -14,14 +14,42 @@ from dotenv import load_dotenv
 # Load environment variables first
 load_dotenv()
 
-# Add current directory to path
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Add current directory and the bot package to path
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _ROOT_DIR)
+sys.path.insert(0, os.path.join(_ROOT_DIR, "telegram-bot"))
+
+# Imported up front so the cost is paid before the event loop starts, not on
+# the loop thread while FastAPI is trying to come up. The bot is imported by
+# the modes that run it: it loads main.py, which needs ANTHROPIC_API_KEY, so
+# it must come after check_required_vars(), and webhook mode doesn't need it.
+import uvicorn  # noqa: E402
+from cache import init_cache, close_cache  # noqa: E402
+from database import init_db, close_db  # noqa: E402
+from digest import start_digest_scheduler as _start_digest_scheduler  # noqa: E402
+
+# Environment read once after load_dotenv(); startup checks index this
+# instead of hitting os.environ per lookup
+_ENV_KEYS = (
+    "ANTHROPIC_API_KEY", "TELEGRAM_BOT_TOKEN", "BAYUT_API_KEY", "BRAVE_API_KEY",
+    "DATABASE_URL", "REDIS_URL", "STRIPE_SECRET_KEY", "OPENAI_API_KEY",
+    "BOT_MODE", "BOT_WORKER_PARTITION", "PORT",
+)
+_ENV_SNAPSHOT = {key: os.getenv(key) for key in _ENV_KEYS}
+
+
+def env(key: str, default=None):
+    """Read an environment variable through the startup snapshot."""
+    if key not in _ENV_SNAPSHOT:
+        _ENV_SNAPSHOT[key] = os.getenv(key)
+    value = _ENV_SNAPSHOT[key]
+    return default if value is None else value
 
 
 def check_required_vars():
     """Validate required environment variables."""
     required_vars = ["ANTHROPIC_API_KEY", "TELEGRAM_BOT_TOKEN"]
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
+    missing_vars = [var for var in required_vars if not env(var)]
 
     if missing_vars:
         print("Missing required environment variables:")
@@ -33,30 +61,37 @@ def check_required_vars():
 
 def print_startup_banner():
     """Print startup status."""
+    bayut_key = env("BAYUT_API_KEY")
+    brave_key = env("BRAVE_API_KEY")
+    database_url = env("DATABASE_URL", "")
+    bayut_status = "Set" if bayut_key and bayut_key not in ("demo", "your_rapidapi_key_here") else "Mock data"
+    brave_status = "Set" if brave_key and brave_key not in ("demo", "") else "Disabled"
+    database_status = "Set" if database_url and "user:pass" not in database_url else "In-memory"
+
     print("Starting TrueValue AI...")
-    print(f"  Anthropic API Key: {'Set' if os.getenv('ANTHROPIC_API_KEY') else 'Missing'}")
-    print(f"  Telegram Token:    {'Set' if os.getenv('TELEGRAM_BOT_TOKEN') else 'Missing'}")
-    print(f"  Bayut API Key:     {'Set' if os.getenv('BAYUT_API_KEY') and os.getenv('BAYUT_API_KEY') not in ['demo', 'your_rapidapi_key_here'] else 'Mock data'}")
-    print(f"  Brave API Key:     {'Set' if os.getenv('BRAVE_API_KEY') and os.getenv('BRAVE_API_KEY') not in ['demo', ''] else 'Disabled'}")
-    print(f"  Database:          {'Set' if os.getenv('DATABASE_URL') and 'user:pass' not in os.getenv('DATABASE_URL', '') else 'In-memory'}")
-    print(f"  Redis:             {'Set' if os.getenv('REDIS_URL') else 'Disabled'}")
-    print(f"  Stripe:            {'Set' if os.getenv('STRIPE_SECRET_KEY') else 'Disabled'}")
-    print(f"  OpenAI (Whisper):  {'Set' if os.getenv('OPENAI_API_KEY') else 'Disabled'}")
-    print(f"  Bot Mode:          {os.getenv('BOT_MODE', 'polling')}")
+    print(f"  Anthropic API Key: {'Set' if env('ANTHROPIC_API_KEY') else 'Missing'}")
+    print(f"  Telegram Token:    {'Set' if env('TELEGRAM_BOT_TOKEN') else 'Missing'}")
+    print(f"  Bayut API Key:     {bayut_status}")
+    print(f"  Brave API Key:     {brave_status}")
+    print(f"  Database:          {database_status}")
+    print(f"  Redis:             {'Set' if env('REDIS_URL') else 'Disabled'}")
+    print(f"  Stripe:            {'Set' if env('STRIPE_SECRET_KEY') else 'Disabled'}")
+    print(f"  OpenAI (Whisper):  {'Set' if env('OPENAI_API_KEY') else 'Disabled'}")
+    print(f"  Bot Mode:          {env('BOT_MODE', 'polling')}")
     print()
 
 
 async def start_fastapi():
     """Run the FastAPI server."""
-    import uvicorn
-
-    port = int(os.getenv("PORT", 8000))
+    port = int(env("PORT", 8000))
     config = uvicorn.Config(
         "main:app",
         host="0.0.0.0",
         port=port,
         log_level="info",
         access_log=False,
+        http="auto",  # httptools when installed (uvicorn[standard]), else h11
+        lifespan="on",
     )
     server = uvicorn.Server(config)
     await server.serve()
@@ -64,61 +99,110 @@ async def start_fastapi():
 
 async def start_telegram_bot():
     """Run the Telegram bot in polling mode."""
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "telegram-bot"))
     from bot import TelegramBotServer
 
     bot = TelegramBotServer()
     await bot.run()
 
 
+async def start_update_poller():
+    """Long-poll Telegram into the Redis update streams (BOT_MODE=poller)."""
+    from bot import TelegramBotServer
+
+    bot = TelegramBotServer()
+    await bot.run_update_poller()
+
+
+async def start_update_worker():
+    """Handle one partition of the Redis update streams (BOT_MODE=worker)."""
+    from bot import TelegramBotServer
+
+    bot = TelegramBotServer()
+    await bot.run_update_worker(int(env("BOT_WORKER_PARTITION", 0)))
+
+
 async def start_digest_scheduler():
     """Run the market digest scheduler."""
-    from digest import start_digest_scheduler as _start
-    await _start()
+    await _start_digest_scheduler()
 
 
 async def init_services():
     """Initialise database and cache connections."""
-    from database import init_db
-    from cache import init_cache
-
     await init_db()
     await init_cache()
 
 
 async def shutdown_services():
     """Clean up database and cache connections."""
-    from database import close_db
-    from cache import close_cache
-
     await close_db()
     await close_cache()
 
 
+def _install_signal_handlers():
+    """
+    Cancel the main task on SIGINT/SIGTERM so every leg shuts down in one
+    loop tick. Not supported on Windows, where KeyboardInterrupt still works.
+    """
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, main_task.cancel)
+        except NotImplementedError:
+            pass
+
+
 async def main():
     """Main async entry point — runs FastAPI + Telegram bot concurrently."""
+    _install_signal_handlers()
     await init_services()
 
-    bot_mode = os.getenv("BOT_MODE", "polling").lower()
+    bot_mode = env("BOT_MODE", "polling").lower()
 
     try:
         if bot_mode == "webhook":
             # Webhook mode: only run FastAPI (bot receives updates via /webhook/telegram)
             print("Running in webhook mode (FastAPI only)...")
             await start_fastapi()
+        elif bot_mode == "poller":
+            # Multi-process mode, poller side: updates are queued in Redis for
+            # the BOT_MODE=worker processes instead of being handled here
+            print("Running in poller mode (FastAPI + update poller + Digest scheduler)...")
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(start_fastapi())
+                tg.create_task(start_update_poller())
+                tg.create_task(start_digest_scheduler())
+        elif bot_mode == "worker":
+            print(f"Running in worker mode (partition {env('BOT_WORKER_PARTITION', 0)})...")
+            await start_update_worker()
         else:
-            # Polling mode: run FastAPI, Telegram bot, and digest scheduler
+            # Polling mode: run FastAPI, Telegram bot, and digest scheduler.
+            # If any leg fails, the TaskGroup cancels the others immediately.
             print("Running in polling mode (FastAPI + Telegram bot + Digest scheduler)...")
-            await asyncio.gather(
-                start_fastapi(),
-                start_telegram_bot(),
-                start_digest_scheduler(),
-            )
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(start_fastapi())
+                tg.create_task(start_telegram_bot())
+                tg.create_task(start_digest_scheduler())
+    except asyncio.CancelledError:
+        print("Shutting down...")
     finally:
         await shutdown_services()
 
 
+def run_event_loop(coro):
+    """
+    Run the app on uvloop when available (Linux/macOS), else stock asyncio.
+    uvicorn only picks its loop in uvicorn.run(); Server.serve() inherits
+    whichever loop is running, so the choice has to be made here.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(coro)
+    return uvloop.run(coro)
+
+
 if __name__ == "__main__":
     check_required_vars()
     print_startup_banner()
-    asyncio.run(main())
+    run_event_loop(main())
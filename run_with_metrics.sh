@@ -3,9 +3,12 @@
 echo "🚀 Starting Dubai Estate AI with Observability"
 echo "=============================================="
 
-# Clean up old Prometheus multiprocess metrics
+# FastAPI and the bot run as separate processes, so share metrics through
+# Prometheus multiprocess mode; clean up old metrics first
+export PROMETHEUS_MULTIPROC_DIR="$(pwd)/prometheus_multiproc_dir"
 echo "🧹 Cleaning up old metrics..."
-rm -rf prometheus_multiproc_dir/*.db 2>/dev/null || true
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"/*.db 2>/dev/null || true
 
 # Start FastAPI in background for /metrics endpoint
 echo "📊 Starting metrics server..."
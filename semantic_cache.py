@@ -0,0 +1,201 @@
+"""
+Semantic Query Cache for TrueValue AI
+======================================
+Catches paraphrases that the exact query cache (cache.py) misses, e.g.
+"Find 2BR apartments in Marina under 2M" vs "2-bedroom apts Dubai Marina <2M".
+
+Queries are embedded with OpenAI's embeddings API and compared by cosine
+similarity against recent answers held in process memory. A candidate only
+counts as a hit if it was asked after the same conversation context and
+mentions the same numbers and the same names (areas, buildings), so a
+follow-up, a "3BR" question or one about "Marina Heights" never reuses an
+answer given for a different exchange, a "2BR" one or "Marina Gate".
+
+Opt-in (SEMANTIC_CACHE=1) and needs OPENAI_API_KEY. Every failure is a miss.
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import functools
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+import numpy as np
+
+logger = logging.getLogger("semantic_cache")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+TOP_K = 5
+MAX_ENTRIES = 5000
+ENTRY_TTL = 3600  # same as the exact query cache
+EMBEDDING_MEMO_MAX = 1024
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_WORD_RE = re.compile(r"\b[a-z_]+\b")
+
+# Wording that paraphrases vary freely; every other word is taken as a name
+# (area, building, developer) and must match exactly
+_GENERIC_WORDS = frozenset("""
+    a an the in at on of for to with and or by from me my i is are it this that
+    what whats which how much many show find search get give list tell please
+    any some all best good top cheap cheapest affordable new
+    analyze analyse analysis compare vs versus about near under below over
+    above less more than between around within up down
+    buy buying rent rental rentals renting sell selling invest investment
+    price prices cost costs worth value yield yields roi return returns
+    market trend trends ready off plan offplan
+    apartment apartments apt apts flat flats villa villas townhouse townhouses
+    studio studios property properties unit units home homes
+    bedroom bedrooms bed beds br bhk sqft sq ft aed m k million dubai area areas
+""".split())
+
+# Ring buffer of unit vectors, row i describing _entries[i]; allocated
+# (~30 MB) on first store so a disabled cache costs nothing
+_vectors: Optional[np.ndarray] = None
+_entries: list = []  # (context_hash, numbers, names, expires_at, response)
+_next_slot = 0
+
+# Embeddings of recent queries, so storing an answer after a miss doesn't
+# embed the same text twice
+_embedding_memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def is_semantic_cache_available() -> bool:
+    """Check if the semantic cache is enabled and configured."""
+    return SEMANTIC_CACHE_ENABLED and bool(OPENAI_API_KEY)
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+@functools.lru_cache(maxsize=1)
+def _location_alias_re():
+    """Pattern over main.py's area aliases (longest first) and their slugs."""
+    from main import LOCATION_ALIASES
+    aliases = sorted(LOCATION_ALIASES, key=len, reverse=True)
+    pattern = re.compile(r"\b(?:%s)\b" % "|".join(re.escape(a) for a in aliases))
+    slugs = {alias: slug.replace("-", "_") for alias, slug in LOCATION_ALIASES.items()}
+    return pattern, slugs
+
+
+def _name_terms(query: str) -> frozenset:
+    """
+    The names a query mentions, with area aliases folded to one slug so
+    "JLT" and "Jumeirah Lake Towers" still agree.
+    """
+    pattern, slugs = _location_alias_re()
+    text = pattern.sub(lambda m: f" {slugs[m.group(0)]} ", _normalize(query))
+    return frozenset(w for w in _WORD_RE.findall(text) if w not in _GENERIC_WORDS)
+
+
+def _context_hash(conversation_context: Optional[str]) -> str:
+    return hashlib.sha256((conversation_context or "").encode()).hexdigest()[:16]
+
+
+async def _embed(query: str) -> Optional[np.ndarray]:
+    """Unit-length embedding for a query, or None on failure."""
+    global _client
+    key = hashlib.sha256(_normalize(query).encode()).hexdigest()[:16]
+    vector = _embedding_memo.get(key)
+    if vector is not None:
+        _embedding_memo.move_to_end(key)
+        return vector
+
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=5.0)
+    try:
+        response = await _client.post(
+            EMBEDDINGS_URL,
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            json={"model": EMBEDDING_MODEL, "input": _normalize(query)},
+        )
+        if response.status_code != 200:
+            logger.warning("Embeddings API returned %d: %s", response.status_code, response.text[:200])
+            return None
+        vector = np.asarray(response.json()["data"][0]["embedding"], dtype=np.float32)
+    except Exception as exc:
+        logger.warning("Embedding failed: %s", exc)
+        return None
+
+    norm = np.linalg.norm(vector)
+    if vector.shape != (EMBEDDING_DIM,) or not norm:
+        return None
+    vector /= norm
+    _embedding_memo[key] = vector
+    if len(_embedding_memo) > EMBEDDING_MEMO_MAX:
+        _embedding_memo.popitem(last=False)
+    return vector
+
+
+async def lookup(query: str, conversation_context: Optional[str] = None) -> Optional[dict]:
+    """Return a cached response for a paraphrase of query, or None."""
+    if not is_semantic_cache_available() or not _entries:
+        return None
+
+    vector = await _embed(query)
+    if vector is None:
+        return None
+
+    scores = _vectors[:len(_entries)] @ vector
+    k = min(TOP_K, len(scores))
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    context_hash = _context_hash(conversation_context)
+    numbers = _NUMBER_RE.findall(query)
+    names = _name_terms(query)
+    now = time.time()
+
+    for i in sorted(candidates, key=lambda i: -scores[i]):
+        if scores[i] < SIMILARITY_THRESHOLD:
+            break
+        entry_context, entry_numbers, entry_names, expires_at, response = _entries[i]
+        if (
+            entry_context == context_hash
+            and entry_numbers == numbers
+            and entry_names == names
+            and expires_at > now
+        ):
+            logger.debug("Semantic cache HIT (%.3f)", scores[i])
+            return response
+    return None
+
+
+async def store(query: str, response: dict, conversation_context: Optional[str] = None) -> None:
+    """Remember a response for later paraphrases of query."""
+    global _next_slot, _vectors
+    if not is_semantic_cache_available():
+        return
+
+    vector = await _embed(query)
+    if vector is None:
+        return
+
+    if _vectors is None:
+        _vectors = np.zeros((MAX_ENTRIES, EMBEDDING_DIM), dtype=np.float32)
+
+    entry = (
+        _context_hash(conversation_context),
+        _NUMBER_RE.findall(query),
+        _name_terms(query),
+        time.time() + ENTRY_TTL,
+        response,
+    )
+    slot = _next_slot
+    _vectors[slot] = vector
+    if slot < len(_entries):
+        _entries[slot] = entry
+    else:
+        _entries.append(entry)
+    _next_slot = (slot + 1) % MAX_ENTRIES
@@ -5,8 +5,10 @@ Run this once to register commands with BotFather
 """
 
 import os
+import json
+import urllib.error
+import urllib.request
 from dotenv import load_dotenv
-import requests
 
 load_dotenv()
 
@@ -23,13 +25,32 @@ commands = [
     {"command": "subscribe", "description": "View and upgrade subscription plans"},
 ]
 
-url = f"https://api.telegram.org/bot{BOT_TOKEN}/setMyCommands"
-response = requests.post(url, json={"commands": commands})
 
-if response.status_code == 200:
-    print("✅ Bot commands registered successfully!")
-    print("\nRegistered commands:")
-    for cmd in commands:
-        print(f"  /{cmd['command']} - {cmd['description']}")
-else:
-    print(f"❌ Failed to register commands: {response.text}")
+def sync_bot_commands(token: str, commands: list) -> tuple[int, str]:
+    """
+    Register the command list with Telegram via setMyCommands.
+    Returns (HTTP status, response body).
+    """
+    url = f"https://api.telegram.org/bot{token}/setMyCommands"
+    req = urllib.request.Request(
+        url,
+        data=json.dumps({"commands": commands}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status, resp.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+if __name__ == "__main__":
+    status, body = sync_bot_commands(BOT_TOKEN, commands)
+
+    if status == 200:
+        print("✅ Bot commands registered successfully!")
+        print("\nRegistered commands:")
+        for cmd in commands:
+            print(f"  /{cmd['command']} - {cmd['description']}")
+    else:
+        print(f"❌ Failed to register commands: {body}")
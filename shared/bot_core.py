@@ -8,16 +8,22 @@ and conversation logging for all bot platforms.
 import os
 import sys
 import time
+import asyncio
 import logging
-from typing import Optional, Tuple
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Optional, Tuple
 
 # Ensure project root is on path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Imported from within main (the WhatsApp webhook and shutdown) and by the
+# Telegram bot, which loads main itself, so this is a sys.modules hit rather
+# than a second load of the app
 from main import handle_query
-from conversation import ConversationStore, is_followup
+from conversation import COMPACT_AFTER_TURNS, ConversationStore, is_followup
 from database import (
-    is_db_available, get_or_create_user, get_user,
+    is_db_available, get_or_create_user_returning_isnew, get_user,
     increment_query_count, log_conversation,
 )
 from observability import (
@@ -35,9 +41,29 @@ SUBSCRIPTION_TIERS = {
     "enterprise": {"name": "Enterprise", "price": 999, "queries_per_day": -1},
 }
 
+# Flat tier -> daily limit lookup for the rate-limit path
+_TIER_LIMITS: dict[str, int] = {
+    tier: cfg["queries_per_day"] for tier, cfg in SUBSCRIPTION_TIERS.items()
+}
+
 # Shared conversation store
 conversation_store = ConversationStore()
 
+# Short-lived per-user (limit, queries_today, last_reset) so check_rate_limit
+# skips the DB for warm users. Refreshed from increment_query_count's result;
+# a tier change shows up once the entry expires.
+RATE_LIMIT_CACHE_MAX = 10000
+RATE_LIMIT_CACHE_TTL_SECONDS = 30
+_rate_limit_cache: "OrderedDict[int, tuple]" = OrderedDict()
+
+# Standalone queries currently running, keyed on normalised text, so a burst
+# of identical questions shares one handle_query call
+_inflight_queries: dict[str, asyncio.Task] = {}
+
+# Usage/analytics writes run after the reply is returned; held here so the
+# tasks aren't garbage-collected mid-flight
+_background_writes: set = set()
+
 
 async def register_user(
     user_id: int,
@@ -50,9 +76,9 @@ async def register_user(
     Falls back to a synthetic dict if DB is unavailable.
     """
     if is_db_available():
-        existing = await get_user(user_id)
-        is_new = existing is None
-        user = await get_or_create_user(user_id, username, first_name, platform)
+        user, is_new = await get_or_create_user_returning_isnew(
+            user_id, username, first_name, platform,
+        )
         if is_new and user:
             user_analytics.track_event(
                 user_id=str(user_id),
@@ -76,28 +102,63 @@ def _fallback_user(user_id: int) -> dict:
     }
 
 
+def _cache_rate_limit(user_id: int, user: dict) -> tuple:
+    """Store a user's rate-limit fields and return the cached entry."""
+    tier = user.get("tier", "free")
+    limit = _TIER_LIMITS.get(tier, 50)
+    entry = (time.monotonic(), limit, user.get("queries_today", 0), user.get("last_reset"))
+    _rate_limit_cache[user_id] = entry
+    _rate_limit_cache.move_to_end(user_id)
+    if len(_rate_limit_cache) > RATE_LIMIT_CACHE_MAX:
+        _rate_limit_cache.popitem(last=False)
+    return entry
+
+
+def _cached_rate_limit(user_id: int) -> Optional[tuple]:
+    """Return a fresh cache entry for user_id, dropping it if stale."""
+    entry = _rate_limit_cache.get(user_id)
+    if entry is None:
+        return None
+    cached_at, _, _, last_reset = entry
+    if time.monotonic() - cached_at >= RATE_LIMIT_CACHE_TTL_SECONDS or (
+        last_reset and last_reset < date.today()
+    ):
+        del _rate_limit_cache[user_id]
+        return None
+    _rate_limit_cache.move_to_end(user_id)
+    return entry
+
+
+def _bump_cached_queries(user_id: int) -> None:
+    """Count a query against the cached entry until the DB write lands."""
+    entry = _rate_limit_cache.get(user_id)
+    if entry is not None:
+        cached_at, limit, used, last_reset = entry
+        _rate_limit_cache[user_id] = (cached_at, limit, used + 1, last_reset)
+
+
 async def check_rate_limit(user_id: int) -> Tuple[bool, int]:
     """
     Check if user has queries remaining.
     Returns (allowed, remaining).
     """
     if is_db_available():
-        user = await get_user(user_id)
-        if not user:
-            return True, 50
+        entry = _cached_rate_limit(user_id)
+        if entry is None:
+            user = await get_user(user_id)
+            if not user:
+                return True, 50
+            entry = _cache_rate_limit(user_id, user)
 
-        tier = user.get("tier", "free")
-        limit = SUBSCRIPTION_TIERS.get(tier, {}).get("queries_per_day", 50)
+        _, limit, used, last_reset = entry
 
         if limit == -1:
             return True, -1
 
-        from datetime import date
-        if user.get("last_reset") and user["last_reset"] < date.today():
+        if last_reset and last_reset < date.today():
             # Will be reset on next increment
             return True, limit
 
-        used = user.get("queries_today", 0)
         remaining = max(0, limit - used)
         return remaining > 0, remaining
     else:
@@ -115,33 +176,95 @@ async def process_query(
     Returns (response_text, tools_used).
     """
     uid = str(user_id)
-    start_time = time.time()
+    start_ns = time.monotonic_ns()
 
     # Detect follow-up
-    followup = is_followup(query, conversation_store.has_session(uid))
+    if conversation_store.turn_count(uid) > COMPACT_AFTER_TURNS:
+        conversation_store.compact(uid)
+    session_context = conversation_store.get_if_session(uid)
+    followup = is_followup(query, session_context is not None)
     record_followup_detected(followup)
-    conv_context = conversation_store.get_context(uid) if followup else None
+    conv_context = (session_context or None) if followup else None
 
     # Execute query
-    result = await handle_query(query, user_id=uid, conversation_context=conv_context)
-    response_text = result.response if hasattr(result, "response") else str(result)
-    tools_used = result.tools_used if hasattr(result, "tools_used") else []
+    result = await run_query_coalesced(query, uid, conv_context)
+    response_text = result.response
+    tools_used = result.tools_used
 
     # Update conversation store
     conversation_store.update(uid, query, response_text)
     update_active_conversations(conversation_store.active_session_count())
 
-    # Increment usage and log
-    elapsed_ms = (time.time() - start_time) * 1000
+    # Increment usage and log without making the user wait on the writes
+    elapsed_ms = (time.monotonic_ns() - start_ns) // 1_000_000
     if is_db_available():
-        await increment_query_count(user_id)
-        await log_conversation(
+        _bump_cached_queries(user_id)
+        _spawn_background_write(_record_query_usage(user_id))
+        _spawn_background_write(log_conversation(
             user_id=user_id,
             query=query,
             response=response_text,
             response_time_ms=elapsed_ms,
             tools_used=tools_used,
             platform=platform,
-        )
+        ))
 
     return response_text, tools_used
+
+
+async def _handle_query(query: str, uid: str, conversation_context: Optional[str] = None):
+    return await handle_query(query, user_id=uid, conversation_context=conversation_context)
+
+
+async def run_query_coalesced(
+    query: str,
+    uid: str,
+    conversation_context: Optional[str] = None,
+    run: Optional[Callable[..., Awaitable]] = None,
+):
+    """
+    Run a query, sharing the call with any identical standalone query already
+    in flight on any platform. Follow-ups depend on their user's context, so
+    they always run on their own.
+
+    run(query, uid, conversation_context) makes the actual call (handle_query
+    by default); the Telegram bot passes its concurrency-capped runner.
+    """
+    run = run or _handle_query
+    if conversation_context:
+        return await run(query, uid, conversation_context)
+
+    key = " ".join(query.lower().split())
+    task = _inflight_queries.get(key)
+    if task is None:
+        task = asyncio.ensure_future(run(query, uid))
+        _inflight_queries[key] = task
+        task.add_done_callback(lambda t: _inflight_queries.pop(key, None))
+    # Shielded so one caller being cancelled doesn't cancel the others' call
+    return await asyncio.shield(task)
+
+
+async def _record_query_usage(user_id: int) -> None:
+    """Increment the user's query count and refresh their rate-limit entry."""
+    user = await increment_query_count(user_id)
+    if user:
+        _cache_rate_limit(user_id, user)
+
+
+async def _safe_write(coro) -> None:
+    try:
+        await coro
+    except Exception:
+        logger.exception("Background write failed")
+
+
+def _spawn_background_write(coro) -> None:
+    task = asyncio.create_task(_safe_write(coro))
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+
+
+async def wait_for_background_writes() -> None:
+    """Wait for in-flight usage/log writes. Called on shutdown before close_db()."""
+    if _background_writes:
+        await asyncio.gather(*_background_writes, return_exceptions=True)
@@ -8,14 +8,22 @@ Persistent user storage via database.py (Step 2).
 import os
 import sys
 import asyncio
+import contextlib
+import functools
+import json
 import logging
+import re
+import secrets
 import time
-from datetime import datetime, date
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
 from typing import Dict
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
@@ -23,26 +31,36 @@ from telegram.ext import (
     filters,
 )
 from telegram.constants import ChatAction
+from telegram.error import RetryAfter, TelegramError
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables (once, at import; everything below reads os.environ)
 load_dotenv()
 
 # Import the main analysis engine
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from main import handle_query
-from conversation import ConversationStore, is_followup
+from conversation import COMPACT_AFTER_TURNS, ConversationStore, is_followup
+from shared.bot_core import run_query_coalesced
 
 # Database imports (Step 2)
 from database import (
     init_db, close_db, is_db_available,
-    get_or_create_user, get_user, increment_query_count,
+    get_or_create_user_returning_isnew, get_user, increment_query_count,
     log_conversation, reset_daily_queries, log_subscription_event,
     save_property, get_saved_properties, remove_saved_property, count_saved_properties,
     get_or_create_referral_code, create_referral, award_referral_bonus, get_referral_stats,
     set_digest_preference, disable_digest,
 )
 
+# Redis-backed quota counters for the no-DB fallback
+from cache import get_daily_quota, incr_daily_quota, reset_daily_quota
+from cache import create_fallback_user, get_fallback_user
+from cache import set_callback_payload, get_callback_payload
+from cache import (
+    is_cache_available, publish_updates, ensure_update_group, read_updates, ack_update,
+)
+
 # Payments import (Step 4)
 from payments import (
     create_checkout_session, create_customer_portal_session,
@@ -69,6 +87,24 @@ from observability import (
 # Set up logging for bot
 bot_logger = setup_json_logging("telegram_bot")
 
+
+def _parse_admin_ids(raw: str) -> frozenset:
+    """User ids from a comma-separated list; malformed entries are skipped."""
+    admin_ids = set()
+    for entry in raw.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if not entry.isdigit():
+            bot_logger.warning("Ignoring malformed TELEGRAM_ADMIN_IDS entry: %r", entry)
+            continue
+        admin_ids.add(int(entry))
+    return frozenset(admin_ids)
+
+
+# Telegram user ids allowed to run admin commands
+ADMIN_IDS = _parse_admin_ids(os.getenv("TELEGRAM_ADMIN_IDS", ""))
+
 # Subscription tiers
 SUBSCRIPTION_TIERS = {
     "free": {
@@ -117,6 +153,508 @@ SUBSCRIPTION_TIERS = {
     },
 }
 
+# tier -> daily query cap (-1 = unlimited), for the per-message limit check
+TIER_QUERY_LIMITS = {tier: info["queries_per_day"] for tier, info in SUBSCRIPTION_TIERS.items()}
+
+
+# =====================================================
+# STATIC COMMAND RESPONSES (rendered once at import)
+# =====================================================
+
+ANALYZING_MSG = "🔍 Analyzing...\n⏱️ This will take 30-60 seconds"
+
+WELCOME_TEMPLATE = (
+    "🏢 *Welcome to TrueValue.ae!*\n\n"
+    "I'm your AI-powered real estate analyst for the Dubai property market.\n\n"
+    "🎯 *What I Can Do:*\n"
+    "• Search properties across all platforms\n"
+    "• Analyze investment potential with institutional-grade metrics\n"
+    "• Track chiller costs and hidden fees (our secret weapon!)\n"
+    "• Identify red flags and building issues\n"
+    "• Calculate ROI and rental yields\n"
+    "• Compare properties side-by-side\n"
+    "• Monitor market trends\n\n"
+    "📊 *Your Plan:* {plan}\n"
+    "📈 *Queries Left Today:* {remaining}\n\n"
+    "💡 *Quick Start:*\n"
+    "Just send me a message like:\n"
+    '• "Find 2BR apartments in Marina under 2M"\n'
+    '• "Analyze Boulevard Point Business Bay"\n'
+    '• "Compare Marina Gate vs Princess Tower"\n'
+    '• "Calculate chiller cost for 1500 sqft Empower property"\n\n'
+    "🎤 *Voice messages supported!* Just record and send.\n\n"
+    "Type /help for all commands or /subscribe to upgrade!"
+)
+
+HELP_MSG = """
+📚 *Available Commands:*
+
+*Analysis:*
+/search - Search for properties
+/analyze - Deep analysis of a specific property
+/compare - Compare multiple properties
+/trends - Get market trends for a zone
+
+*Watchlist:*
+/save <id> - Save a property to your watchlist
+/watchlist - View saved properties
+/remove <id> - Remove from watchlist
+
+*Account:*
+/subscribe - View and upgrade subscription plans
+/manage - Manage your subscription
+/status - Check your account status
+/referral - Get your referral link & earn bonus queries
+
+*Digest:*
+/digest <zones> - Subscribe to market digest
+/digest\\_off - Unsubscribe from digest
+
+/new - Start a fresh conversation
+
+*Natural Language:*
+Just type naturally — I understand questions like:
+• "What's the best investment in JBR under 3M?"
+• "Calculate mortgage for 2M property"
+• "Show DLD transactions in Dubai Marina"
+• "What are actual rents for 1BR in Business Bay?"
+
+🎤 Voice messages supported!
+💡 Follow-up questions work!
+"""
+
+STATUS_TEMPLATE = (
+    "📊 *Your Account Status*\n\n"
+    "*Plan:* {plan}\n"
+    "*Price:* AED {price}/month\n"
+    "*Queries Today:* {queries_today}\n"
+    "*Queries Remaining:* {remaining}\n"
+    "*Total Queries:* {total}\n"
+    "*Member Since:* {joined}\n\n"
+    "Type /subscribe to upgrade for more queries and features!"
+)
+
+
+# Per-tier pieces of the /subscribe view. Tier data never changes at runtime.
+TIER_FEATURE_BLOCK = {
+    tier_id: "\n".join(f"• {feature}" for feature in tier_info['features'])
+    for tier_id, tier_info in SUBSCRIPTION_TIERS.items()
+}
+TIER_UPGRADE_BUTTON = {
+    tier_id: InlineKeyboardButton(f"Upgrade to {tier_info['name']}", callback_data=f"upgrade_{tier_id}")
+    for tier_id, tier_info in SUBSCRIPTION_TIERS.items()
+}
+UPGRADE_NOW_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("📈 Upgrade Now", callback_data="upgrade_basic")
+]])
+
+
+def _build_subscribe_view(current_tier: str) -> tuple:
+    """Render the /subscribe message and upgrade keyboard for a user's tier."""
+    msg = "💳 *Subscription Plans*\n\n"
+
+    keyboard = []
+    for tier_id, tier_info in SUBSCRIPTION_TIERS.items():
+        is_current = tier_id == current_tier
+        status = "✅ Current Plan" if is_current else f"AED {tier_info['price']}/month"
+
+        msg += f"*{tier_info['name']}* - {status}\n"
+        msg += f"• {tier_info['queries_per_day']} queries/day\n" if tier_info['queries_per_day'] > 0 else "• Unlimited queries\n"
+        msg += TIER_FEATURE_BLOCK[tier_id]
+        msg += "\n\n"
+
+        if not is_current and tier_id != "free":
+            keyboard.append([TIER_UPGRADE_BUTTON[tier_id]])
+
+    return msg, InlineKeyboardMarkup(keyboard)
+
+
+# One (message, keyboard) per current tier
+SUBSCRIBE_VIEWS = {tier_id: _build_subscribe_view(tier_id) for tier_id in SUBSCRIPTION_TIERS}
+
+
+# User-facing error classes, highest priority first; group N of the pattern
+# selects _ERROR_CLASS_MESSAGES[N]
+_ERROR_CLASS_RE = re.compile(
+    r"(credit balance is too low)|(rate limit)|(timeout)|(network|connection)",
+    re.IGNORECASE,
+)
+_ERROR_CLASS_MESSAGES = (
+    None,
+    (
+        "❌ *API Credits Issue*\n\n"
+        "The Anthropic API credits are running low.\n\n"
+        "📧 Please contact support or try again later.\n\n"
+        "_Error: Insufficient API credits_"
+    ),
+    (
+        "⏱️ *Rate Limit Reached*\n\n"
+        "Too many requests. Please wait a moment and try again.\n\n"
+        "_The API has temporary rate limits._"
+    ),
+    (
+        "⏱️ *Request Timeout*\n\n"
+        "The analysis took too long. Please try a simpler query.\n\n"
+        "_The API request timed out._"
+    ),
+    (
+        "🌐 *Connection Issue*\n\n"
+        "Could not connect to the AI service.\n\n"
+        "Please try again in a moment.\n\n"
+        "_Network connectivity error_"
+    ),
+)
+_GENERIC_ERROR_TEMPLATE = (
+    "❌ *Something Went Wrong*\n\n"
+    "An error occurred while processing your request.\n\n"
+    "Please try again or contact support if the issue persists.\n\n"
+    "Error details: {}"
+)
+
+# Characters Telegram's (legacy) Markdown treats as markup outside an entity
+_MARKDOWN_SPECIAL_RE = re.compile(r"([_*`\[])")
+
+
+def escape_markdown(text: str) -> str:
+    """Backslash-escape text so it shows literally in a Markdown message."""
+    return _MARKDOWN_SPECIAL_RE.sub(r"\\\1", text)
+
+
+# /compare arguments: "<property> vs <property>", optionally "vs."
+COMPARE_ARGS_RE = re.compile(r"^(.+?)\s+vs\.?\s+(.+)$", re.IGNORECASE)
+
+# Prompts for /analyze, /compare and /trends. Free-text messages phrased like
+# those commands are sent as the same prompt, so they share query cache
+# entries (and in-flight calls) with the commands.
+ANALYZE_PROMPT = "Analyze this property: {}"
+COMPARE_PROMPT = (
+    "Compare these properties: {} vs {}. "
+    "Create side-by-side comparison with price, location, "
+    "chiller costs, ROI, and recommendation."
+)
+TRENDS_PROMPT = (
+    "Get comprehensive market trends for {}. "
+    "Include: price trends, supply pipeline, liquidity metrics, "
+    "and investment recommendation."
+)
+MESSAGE_INTENTS = (
+    (re.compile(r"^\s*analy[sz]e\s+(.+?)[\s?.!]*$", re.IGNORECASE | re.DOTALL), ANALYZE_PROMPT),
+    (re.compile(r"^\s*compare\s+(.+?)\s+vs\.?\s+(.+?)[\s?.!]*$", re.IGNORECASE | re.DOTALL), COMPARE_PROMPT),
+    (re.compile(r"^\s*(?:market\s+)?trends\s+(?:in|for)\s+(.+?)[\s?.!]*$", re.IGNORECASE | re.DOTALL), TRENDS_PROMPT),
+)
+
+
+def intent_prompt(text: str) -> str:
+    """Return the command prompt a message matches, or the message unchanged."""
+    for pattern, template in MESSAGE_INTENTS:
+        match = pattern.match(text)
+        if match:
+            return template.format(*match.groups())
+    return text
+
+
+# Today's date and the local-midnight timestamp it ends at, recomputed only
+# when the date rolls over rather than on every quota check
+_today_date = date.min
+_today_ends = 0.0
+
+
+def _today() -> date:
+    global _today_date, _today_ends
+    if time.time() >= _today_ends:
+        _today_date = date.today()
+        _today_ends = datetime.combine(_today_date + timedelta(days=1), datetime.min.time()).timestamp()
+    return _today_date
+
+
+# Users already at their daily cap, so repeat attempts are turned away without
+# a DB/Redis lookup. An entry lasts until local midnight (when quotas reset) or
+# LIMIT_REACHED_TTL_SECONDS, whichever is sooner, so an upgrade completed via
+# the Stripe webhook is picked up within minutes.
+LIMIT_REACHED_MAX = 100_000
+LIMIT_REACHED_TTL_SECONDS = 300
+_limit_reached: "OrderedDict[int, tuple]" = OrderedDict()
+
+
+def _mark_limit_reached(user_id: int, tier: str, queries_today: int) -> None:
+    now = time.time()
+    _today()  # refreshes _today_ends if the date has rolled over
+    _limit_reached[user_id] = (min(_today_ends, now + LIMIT_REACHED_TTL_SECONDS), tier, queries_today)
+    _limit_reached.move_to_end(user_id)
+    if len(_limit_reached) > LIMIT_REACHED_MAX:
+        _limit_reached.popitem(last=False)
+
+
+# Follow-up buttons under a query result:
+# action -> (status shown while working, prompt, max 4096-char parts sent)
+RESULT_ACTIONS = {
+    "full": (
+        "📊 Generating full institutional report...\n⏱️ This will take 1-2 minutes",
+        "Give me a full detailed analysis with all sections for: {}",
+        2,
+    ),
+    "compare": (
+        "📈 Finding comparable properties...",
+        "Show me 3 comparable alternatives to: {}",
+        1,
+    ),
+    "mortgage": (
+        "💰 Calculating mortgage scenarios...",
+        "Calculate mortgage options for: {}. Show 75% and 80% LTV scenarios.",
+        1,
+    ),
+    "websearch": (
+        "🔍 Searching web for latest info...",
+        "Search the web for current information about: {}",
+        1,
+    ),
+}
+
+# Rows of (label, action) for the result keyboard; only the ref in each
+# button's callback_data changes between messages
+RESULT_KEYBOARD_ROWS = (
+    (("📊 Full Report", "full"), ("📈 Compare Options", "compare")),
+    (("💰 Calculate Mortgage", "mortgage"), ("🔍 Web Search", "websearch")),
+)
+PDF_KEYBOARD_ROWS = RESULT_KEYBOARD_ROWS + ((("📄 Generate PDF Report", "pdf"),),)
+
+# Query text behind recent result buttons, by the ref in their callback_data.
+# Redis holds the same entries for other workers and after a restart.
+CALLBACK_PAYLOADS_MAX = 10000
+_callback_payloads: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _remember_callback_payload(ref: str, payload: str) -> None:
+    _callback_payloads[ref] = payload
+    if len(_callback_payloads) > CALLBACK_PAYLOADS_MAX:
+        _callback_payloads.popitem(last=False)
+
+
+# Updates from different chats are handled concurrently so one slow analysis
+# doesn't hold up everyone else; updates within a chat still run in order.
+BOT_MAX_RUNNING_UPDATES = int(os.getenv("BOT_MAX_RUNNING_UPDATES", "16"))
+BOT_MAX_PENDING_UPDATES = 256
+POLLING_TIMEOUT_SECONDS = 30
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Multi-process mode (BOT_MODE=poller / worker): updates go through Redis
+# streams, one per partition; a chat always maps to the same partition, and
+# each partition is served by one worker process
+BOT_STREAM_PARTITIONS = int(os.getenv("BOT_STREAM_PARTITIONS", "1"))
+STREAM_READ_COUNT = 32
+
+
+def update_partition(update: Update) -> int:
+    chat = update.effective_chat
+    return chat.id % BOT_STREAM_PARTITIONS if chat else 0
+
+
+# Cap on handle_query calls running at once, so a burst of users doesn't turn
+# into a burst of concurrent Claude requests
+BOT_MAX_INFLIGHT_QUERIES = int(os.getenv("BOT_MAX_INFLIGHT_QUERIES", "8"))
+
+# Command counters and the active-conversations gauge are buffered and
+# pushed to Prometheus at most this often, off the request path
+METRICS_FLUSH_SECONDS = 1.0
+
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+TELEGRAM_MESSAGES_PER_SECOND = 30  # bot-wide limit
+TELEGRAM_CHAT_MESSAGES_PER_SECOND = 1  # per chat, with short bursts allowed
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_MESSAGES_PER_MINUTE = 20  # per group chat
+BOT_SEND_MAX_RETRIES = 2
+
+
+def split_message(text: str, max_length: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> list:
+    """
+    Split text into chunks of at most max_length, breaking between paragraphs
+    ("\n\n") where possible. A single paragraph longer than max_length is
+    cut at max_length. One forward scan; chunks are slices of text.
+    """
+    if len(text) <= max_length:
+        return [text]
+
+    parts = []
+    n = len(text)
+    chunk_start = 0
+    chunk_end = None  # end of the last paragraph that fits in the current chunk
+    pos = 0
+    while True:
+        brk = text.find("\n\n", pos)
+        para_end = n if brk == -1 else brk
+        if para_end - chunk_start > max_length:
+            if chunk_end is not None:
+                parts.append(text[chunk_start:chunk_end])
+                chunk_start = pos
+            while para_end - chunk_start > max_length:
+                parts.append(text[chunk_start:chunk_start + max_length])
+                chunk_start += max_length
+        chunk_end = para_end
+        if brk == -1:
+            break
+        pos = brk + 2
+    parts.append(text[chunk_start:chunk_end])
+
+    return [part for part in (p.strip() for p in parts) if part]
+
+
+def markdown_balanced(text: str) -> bool:
+    """
+    Whether every Markdown marker in text is paired. A part split out of a
+    long answer can cut a *bold* span in two, which Telegram rejects; such
+    parts are sent as plain text up front instead of failing and retrying.
+    """
+    return text.count("*") % 2 == 0 and text.count("_") % 2 == 0 and text.count("`") % 2 == 0
+
+
+# Fire-and-forget sends (typing indicator, progress-note deletes, callback
+# answers), held so they aren't garbage-collected mid-flight
+_background_sends: set = set()
+
+
+def _finish_background_send(task: asyncio.Task) -> None:
+    _background_sends.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        bot_logger.debug("Background send failed: %s", task.exception())
+
+
+def send_in_background(call) -> None:
+    """Run a Telegram call the user doesn't wait on; failures are only logged."""
+    task = asyncio.ensure_future(call)
+    _background_sends.add(task)
+    task.add_done_callback(_finish_background_send)
+
+
+def command_args(update: Update) -> str:
+    """
+    The text after a command, as typed. Used instead of joining context.args,
+    which PTB has already split on whitespace.
+    """
+    parts = (update.message.text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+
+class TokenBucket:
+    """Async token bucket: rate tokens per second, bursting up to capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available, then take it."""
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens = 0
+            self._updated = time.monotonic()
+
+
+class SendRateLimiter(BaseRateLimiter):
+    """
+    Rate limiter for every Bot API call the application makes: a bot-wide
+    token bucket plus one per chat (slower for groups), applied to requests
+    that target a chat (getUpdates and friends pass straight through).
+    A 429 pauses all chat-targeted requests for Telegram's retry_after, and
+    the failed call is retried up to BOT_SEND_MAX_RETRIES times.
+    """
+
+    MAX_TRACKED_CHATS = 10000
+
+    def __init__(self):
+        self._overall = TokenBucket(TELEGRAM_MESSAGES_PER_SECOND, TELEGRAM_MESSAGES_PER_SECOND)
+        self._chats: "OrderedDict[object, TokenBucket]" = OrderedDict()
+        self._paused_until = 0.0  # time.monotonic() deadline set by a 429
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Group ids are negative ints (or @channel usernames)
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = TELEGRAM_GROUP_MESSAGES_PER_MINUTE / 60 if is_group else TELEGRAM_CHAT_MESSAGES_PER_SECOND
+            bucket = self._chats[chat_id] = TokenBucket(rate, TELEGRAM_CHAT_BURST)
+            if len(self._chats) > self.MAX_TRACKED_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        max_retries = rate_limit_args or BOT_SEND_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            if chat_id is not None:
+                delay = self._paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._chat_bucket(chat_id).acquire()
+                await self._overall.acquire()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                # Hold back every chat-targeted call, not just this one, so
+                # the rest don't keep hitting the limit in the meantime
+                self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after + 0.1)
+                if attempt == max_retries:
+                    raise
+                bot_logger.info("Telegram rate limit hit on %s, retrying in %ss", endpoint, exc.retry_after)
+                if chat_id is None:
+                    await asyncio.sleep(exc.retry_after + 0.1)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Run updates concurrently across chats but one at a time per chat.
+    The base class semaphore bounds updates in flight (including those
+    waiting on their chat); _running bounds the ones actually executing.
+    """
+
+    def __init__(self, max_running: int, max_pending: int):
+        super().__init__(max_pending)
+        self._running = asyncio.Semaphore(max_running)
+        # chat_id -> [lock, number of updates holding or waiting on it]
+        self._chat_locks: Dict[int, list] = {}
+
+    async def do_process_update(self, update, coroutine) -> None:
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._chat_locks.get(chat.id)
+        if entry is None:
+            entry = self._chat_locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._running:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
 
 class TelegramBotServer:
     def __init__(self):
@@ -124,7 +662,7 @@ class TelegramBotServer:
         if not self.bot_token:
             raise ValueError("TELEGRAM_BOT_TOKEN not set in environment")
 
-        self.admin_ids = os.getenv("TELEGRAM_ADMIN_IDS", "").split(",")
+        self.admin_ids = ADMIN_IDS
 
         # In-memory fallback for when DB is unavailable
         self._users_fallback = {}
@@ -132,7 +670,35 @@ class TelegramBotServer:
         # Conversation memory for follow-up detection
         self.conversation_store = ConversationStore()
 
-        self.application = Application.builder().token(self.bot_token).build()
+        # handle_query concurrency cap
+        self._query_slots = asyncio.Semaphore(BOT_MAX_INFLIGHT_QUERIES)
+
+        # Metrics buffered for _flush_metrics: command -> uses since the last
+        # flush, daily-cap rejections, and whether the conversation count may
+        # have changed
+        self._command_counts: Dict[str, int] = {}
+        self._limit_hits: list = []
+        self._sessions_changed = False
+        self._metrics_task = None
+
+        # Button action -> handler(query, arg, user_id), for handle_callback
+        self._callback_handlers = {
+            "upgrade": self.process_upgrade,
+            "pdf": self.generate_pdf_report,
+            "save": self._save_from_button,
+            "removeprop": self._remove_from_button,
+            **{action: functools.partial(self._run_result_action, action) for action in RESULT_ACTIONS},
+        }
+
+        self.application = (
+            Application.builder()
+            .token(self.bot_token)
+            .concurrent_updates(PerChatUpdateProcessor(BOT_MAX_RUNNING_UPDATES, BOT_MAX_PENDING_UPDATES))
+            .rate_limiter(SendRateLimiter())
+            .post_init(self._start_metrics_flusher)
+            .post_shutdown(self._stop_metrics_flusher)
+            .build()
+        )
         self.setup_handlers()
 
     def setup_handlers(self):
@@ -177,13 +743,18 @@ class TelegramBotServer:
             if user:
                 return user
         # Fallback
-        return self._users_fallback.get(user_id, {
+        user = self._users_fallback.get(user_id, {
             "user_id": user_id,
             "tier": "free",
             "queries_today": 0,
-            "last_reset": date.today(),
+            "last_reset": _today(),
             "total_queries": 0,
         })
+        used = await get_daily_quota(user_id)
+        if used is not None:
+            # Redis holds today's count, so it outlives this process
+            user = {**user, "queries_today": used, "last_reset": _today()}
+        return user
 
     async def _get_user_tier(self, user_id: int) -> str:
         """Get user's subscription tier."""
@@ -192,16 +763,24 @@ class TelegramBotServer:
 
     async def check_query_limit(self, user_id: int) -> bool:
         """Check if user has queries remaining."""
+        blocked = _limit_reached.get(user_id)
+        if blocked is not None:
+            expires_at, tier, queries_today = blocked
+            if time.time() < expires_at:
+                self._record_limit_hit(user_id, tier, queries_today)
+                return False
+            del _limit_reached[user_id]
+
         user_data = await self._get_user_data(user_id)
         tier = user_data.get("tier", "free")
-        tier_info = SUBSCRIPTION_TIERS[tier]
+        daily_limit = TIER_QUERY_LIMITS[tier]
 
-        if tier_info["queries_per_day"] == -1:
+        if daily_limit == -1:
             return True
 
         # Reset daily counter if needed
         last_reset = user_data.get("last_reset")
-        today = date.today()
+        today = _today()
         queries_today = user_data.get("queries_today", 0)
 
         if last_reset and last_reset < today:
@@ -212,43 +791,110 @@ class TelegramBotServer:
                 self._users_fallback[user_id]["queries_today"] = 0
                 self._users_fallback[user_id]["last_reset"] = today
 
-        has_queries = queries_today < tier_info["queries_per_day"]
+        has_queries = queries_today < daily_limit
 
         if not has_queries:
-            user_analytics.track_event(
-                user_id=str(user_id),
-                event='query_limit_hit',
-                properties={'tier': tier, 'queries_used': queries_today}
-            )
-            record_query_limit_hit(tier)
+            self._record_limit_hit(user_id, tier, queries_today)
+            _mark_limit_reached(user_id, tier, queries_today)
 
         return has_queries
 
+    def _record_limit_hit(self, user_id: int, tier: str, queries_today: int):
+        # Recorded by _flush_metrics, off the path that rejects the message
+        self._limit_hits.append((user_id, tier, queries_today))
+
     async def get_remaining_queries(self, user_id: int) -> int:
         """Get remaining queries for today (includes bonus queries from referrals)."""
         user_data = await self._get_user_data(user_id)
-        tier = user_data.get("tier", "free")
-        tier_info = SUBSCRIPTION_TIERS[tier]
+        daily_limit = TIER_QUERY_LIMITS[user_data.get("tier", "free")]
 
-        if tier_info["queries_per_day"] == -1:
+        if daily_limit == -1:
             return -1
 
         queries_today = user_data.get("queries_today", 0)
         last_reset = user_data.get("last_reset")
-        if last_reset and last_reset < date.today():
+        if last_reset and last_reset < _today():
             queries_today = 0
 
         bonus = user_data.get("bonus_queries", 0)
-        return max(0, tier_info["queries_per_day"] + bonus - queries_today)
+        return max(0, daily_limit + bonus - queries_today)
 
-    async def increment_usage(self, user_id: int):
-        """Increment query usage."""
+    async def increment_usage(self, user_id: int) -> dict:
+        """Increment query usage and return the user's record (for its tier)."""
         if is_db_available():
-            await increment_query_count(user_id)
-        elif user_id in self._users_fallback:
+            user = await increment_query_count(user_id)
+            if user:
+                return user
+        elif await incr_daily_quota(user_id) is None and user_id in self._users_fallback:
+            # No Redis either: count in process memory
             self._users_fallback[user_id]["queries_today"] = (
                 self._users_fallback[user_id].get("queries_today", 0) + 1
             )
+        return self._users_fallback.get(user_id, {"tier": "free"})
+
+    # =====================================================
+    # QUERY DISPATCH
+    # =====================================================
+
+    async def run_query(self, query: str, uid: str, conversation_context: str = None):
+        """
+        Run handle_query with at most BOT_MAX_INFLIGHT_QUERIES calls in flight.
+        A standalone query identical to one already running waits for that
+        call's result instead of making its own.
+        """
+        return await run_query_coalesced(query, uid, conversation_context, self._run_limited)
+
+    async def _run_limited(self, query: str, uid: str, conversation_context: str = None):
+        async with self._query_slots:
+            return await handle_query(query, user_id=uid, conversation_context=conversation_context)
+
+    # =====================================================
+    # METRICS
+    # =====================================================
+
+    def _record_command(self, command: str):
+        self._command_counts[command] = self._command_counts.get(command, 0) + 1
+
+    def _mark_sessions_changed(self):
+        self._sessions_changed = True
+
+    async def _start_metrics_flusher(self, application: Application):
+        """post_init hook: start the periodic metrics flush."""
+        if self._metrics_task is None or self._metrics_task.done():
+            self._metrics_task = asyncio.create_task(self._metrics_flusher())
+
+    async def _stop_metrics_flusher(self, application: Application):
+        """post_shutdown hook: stop the flusher and push what it still holds."""
+        task, self._metrics_task = self._metrics_task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._flush_metrics()
+
+    async def _metrics_flusher(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                self._flush_metrics()
+            except Exception:
+                bot_logger.exception("Metrics flush failed")
+
+    def _flush_metrics(self):
+        counts, self._command_counts = self._command_counts, {}
+        for command, count in counts.items():
+            record_command_metrics(command, count)
+        limit_hits, self._limit_hits = self._limit_hits, []
+        for user_id, tier, queries_today in limit_hits:
+            user_analytics.track_event(
+                user_id=str(user_id),
+                event='query_limit_hit',
+                properties={'tier': tier, 'queries_used': queries_today}
+            )
+            record_query_limit_hit(tier)
+        if self._sessions_changed:
+            self._sessions_changed = False
+            update_active_conversations(self.conversation_store.active_session_count())
 
     # =====================================================
     # COMMANDS
@@ -261,25 +907,30 @@ class TelegramBotServer:
             username = update.effective_user.username
             first_name = update.effective_user.first_name
 
-            record_command_metrics('start', str(user_id))
+            self._record_command('start')
 
             # Register user in DB (Step 2)
             is_new = True
             if is_db_available():
-                existing = await get_user(user_id)
-                is_new = existing is None
-                await get_or_create_user(user_id, username, first_name)
+                _, is_new = await get_or_create_user_returning_isnew(user_id, username, first_name)
+            elif user_id not in self._users_fallback:
+                joined = datetime.now().isoformat()
+                # Redis remembers users across restarts; without it only
+                # this process does
+                created = await create_fallback_user(user_id, {"tier": "free", "joined": joined})
+                is_new = created is not False
+                self._users_fallback[user_id] = {
+                    "user_id": user_id,
+                    "tier": "free",
+                    "joined": joined,
+                    "queries_today": 0,
+                    "last_reset": _today(),
+                    "total_queries": 0,
+                }
+                if not is_new:
+                    self._users_fallback[user_id].update(await get_fallback_user(user_id) or {})
             else:
-                is_new = user_id not in self._users_fallback
-                if is_new:
-                    self._users_fallback[user_id] = {
-                        "user_id": user_id,
-                        "tier": "free",
-                        "joined": datetime.now().isoformat(),
-                        "queries_today": 0,
-                        "last_reset": date.today(),
-                        "total_queries": 0,
-                    }
+                is_new = False
 
             # Handle referral code from deep link: /start ref_XXXX
             if is_new and context.args and is_db_available():
@@ -309,27 +960,9 @@ class TelegramBotServer:
             tier = await self._get_user_tier(user_id)
             remaining = await self.get_remaining_queries(user_id)
 
-            welcome_msg = (
-                "🏢 *Welcome to TrueValue.ae!*\n\n"
-                "I'm your AI-powered real estate analyst for the Dubai property market.\n\n"
-                "🎯 *What I Can Do:*\n"
-                "• Search properties across all platforms\n"
-                "• Analyze investment potential with institutional-grade metrics\n"
-                "• Track chiller costs and hidden fees (our secret weapon!)\n"
-                "• Identify red flags and building issues\n"
-                "• Calculate ROI and rental yields\n"
-                "• Compare properties side-by-side\n"
-                "• Monitor market trends\n\n"
-                f"📊 *Your Plan:* {SUBSCRIPTION_TIERS.get(tier, SUBSCRIPTION_TIERS['free'])['name']}\n"
-                f"📈 *Queries Left Today:* {remaining if remaining >= 0 else 'Unlimited'}\n\n"
-                "💡 *Quick Start:*\n"
-                "Just send me a message like:\n"
-                '• "Find 2BR apartments in Marina under 2M"\n'
-                '• "Analyze Boulevard Point Business Bay"\n'
-                '• "Compare Marina Gate vs Princess Tower"\n'
-                '• "Calculate chiller cost for 1500 sqft Empower property"\n\n'
-                "🎤 *Voice messages supported!* Just record and send.\n\n"
-                "Type /help for all commands or /subscribe to upgrade!"
+            welcome_msg = WELCOME_TEMPLATE.format(
+                plan=SUBSCRIPTION_TIERS.get(tier, SUBSCRIPTION_TIERS['free'])['name'],
+                remaining=remaining if remaining >= 0 else 'Unlimited',
             )
 
             await update.message.reply_text(welcome_msg, parse_mode="Markdown")
@@ -349,86 +982,47 @@ class TelegramBotServer:
 
     async def cmd_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show help message"""
-        record_command_metrics('help', str(update.effective_user.id))
-        help_msg = """
-📚 *Available Commands:*
-
-*Analysis:*
-/search - Search for properties
-/analyze - Deep analysis of a specific property
-/compare - Compare multiple properties
-/trends - Get market trends for a zone
-
-*Watchlist:*
-/save <id> - Save a property to your watchlist
-/watchlist - View saved properties
-/remove <id> - Remove from watchlist
+        self._record_command('help')
 
-*Account:*
-/subscribe - View and upgrade subscription plans
-/manage - Manage your subscription
-/status - Check your account status
-/referral - Get your referral link & earn bonus queries
-
-*Digest:*
-/digest <zones> - Subscribe to market digest
-/digest\\_off - Unsubscribe from digest
-
-/new - Start a fresh conversation
-
-*Natural Language:*
-Just type naturally — I understand questions like:
-• "What's the best investment in JBR under 3M?"
-• "Calculate mortgage for 2M property"
-• "Show DLD transactions in Dubai Marina"
-• "What are actual rents for 1BR in Business Bay?"
-
-🎤 Voice messages supported!
-💡 Follow-up questions work!
-        """
-
-        await update.message.reply_text(help_msg, parse_mode="Markdown")
+        await update.message.reply_text(HELP_MSG, parse_mode="Markdown")
 
     async def cmd_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Search properties"""
         user_id = update.effective_user.id
-        record_command_metrics('search', str(user_id))
+        self._record_command('search')
 
         if not await self.check_query_limit(user_id):
             await self.send_upgrade_message(update)
             return
 
-        query = " ".join(context.args) if context.args else ""
+        query = command_args(update)
         if not query:
             await update.message.reply_text(
                 "Please provide search criteria.\nExample: /search Marina 2BR under 2M"
             )
             return
 
-        await update.message.chat.send_action(ChatAction.TYPING)
+        self._send_typing(update)
 
         try:
             uid = str(user_id)
             search_query = f"Search for properties: {query}. Return top 5 results with key metrics."
             start = time.time()
-            result = await handle_query(search_query, user_id=uid)
+            result = await self.run_query(search_query, uid)
             elapsed = (time.time() - start) * 1000
             await self.increment_usage(user_id)
-            response_text = result.response if hasattr(result, 'response') else str(result)
+            response_text = result.response
             self.conversation_store.update(uid, search_query, response_text)
-            update_active_conversations(self.conversation_store.active_session_count())
+            self._mark_sessions_changed()
             # Log to DB (Step 2)
             if is_db_available():
                 await log_conversation(user_id, search_query, response_text,
                                        response_time_ms=elapsed,
-                                       tools_used=result.tools_used if hasattr(result, 'tools_used') else [])
+                                       tools_used=result.tools_used)
             await self.send_split_message(update, response_text)
         except Exception as e:
             error_msg = self.format_error_message(e, user_id=str(user_id), query=query)
-            try:
-                await update.message.reply_text(error_msg, parse_mode="Markdown")
-            except:
-                await update.message.reply_text(error_msg)
+            await update.message.reply_text(error_msg, parse_mode="Markdown")
 
     async def cmd_analyze(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Analyze a specific property"""
@@ -438,93 +1032,51 @@ Just type naturally — I understand questions like:
             await self.send_upgrade_message(update)
             return
 
-        property_query = " ".join(context.args) if context.args else ""
+        property_query = command_args(update)
         if not property_query:
             await update.message.reply_text(
                 "Please specify a property.\nExample: /analyze Marina Gate Tower 1"
             )
             return
 
-        progress_msg = await update.message.reply_text(
-            "🔍 Analyzing...\n⏱️ This will take 30-60 seconds"
-        )
-
         try:
-            full_query = f"Analyze this property: {property_query}"
+            full_query = ANALYZE_PROMPT.format(property_query)
             uid = str(user_id)
             start = time.time()
-            result = await handle_query(full_query, user_id=uid)
+            progress_msg, result = await self._run_with_progress(
+                update, self.run_query(full_query, uid)
+            )
             elapsed = (time.time() - start) * 1000
-            await self.increment_usage(user_id)
-            response_text = result.response if hasattr(result, 'response') else str(result)
+            response_text = result.response
 
-            try:
-                await progress_msg.delete()
-            except:
-                pass
+            send_in_background(progress_msg.delete())
 
             self.conversation_store.update(uid, full_query, response_text)
-            update_active_conversations(self.conversation_store.active_session_count())
+            self._mark_sessions_changed()
 
+            # Usage count and conversation log are independent writes
+            writes = [self.increment_usage(user_id)]
             if is_db_available():
-                await log_conversation(user_id, full_query, response_text,
-                                       response_time_ms=elapsed,
-                                       tools_used=result.tools_used if hasattr(result, 'tools_used') else [])
-
-            # Interactive buttons
-            keyboard = [
-                [
-                    InlineKeyboardButton("📊 Full Report", callback_data=f"full_{property_query[:50]}"),
-                    InlineKeyboardButton("📈 Compare Options", callback_data=f"compare_{property_query[:50]}")
-                ],
-                [
-                    InlineKeyboardButton("💰 Calculate Mortgage", callback_data=f"mortgage_{property_query[:50]}"),
-                    InlineKeyboardButton("🔍 Web Search", callback_data=f"websearch_{property_query[:50]}")
-                ]
-            ]
-
-            # PDF button for Pro/Enterprise (Step 5)
-            tier = await self._get_user_tier(user_id)
-            if tier in ["pro", "enterprise"]:
-                keyboard.append([
-                    InlineKeyboardButton("📄 Generate PDF Report", callback_data=f"pdf_{property_query[:50]}")
-                ])
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
+                writes.append(log_conversation(user_id, full_query, response_text,
+                                               response_time_ms=elapsed,
+                                               tools_used=result.tools_used))
+            user_data, *_ = await asyncio.gather(*writes)
+
+            # Interactive buttons, plus PDF for Pro/Enterprise (Step 5); the
+            # usage update already returned the tier
+            tier = user_data.get("tier", "free")
+            reply_markup = await self._query_keyboard(property_query, with_pdf=tier in ["pro", "enterprise"])
             await self.send_split_message(update, response_text, reply_markup=reply_markup)
         except Exception as e:
             error_msg = self.format_error_message(e, user_id=str(user_id), query=property_query)
-            try:
-                await update.message.reply_text(error_msg, parse_mode="Markdown")
-            except:
-                await update.message.reply_text(error_msg)
+            await update.message.reply_text(error_msg, parse_mode="Markdown")
 
     async def cmd_subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show subscription options"""
         user_id = update.effective_user.id
         current_tier = await self._get_user_tier(user_id)
 
-        msg = "💳 *Subscription Plans*\n\n"
-
-        keyboard = []
-        for tier_id, tier_info in SUBSCRIPTION_TIERS.items():
-            is_current = tier_id == current_tier
-            status = "✅ Current Plan" if is_current else f"AED {tier_info['price']}/month"
-
-            msg += f"*{tier_info['name']}* - {status}\n"
-            msg += f"• {tier_info['queries_per_day']} queries/day\n" if tier_info['queries_per_day'] > 0 else "• Unlimited queries\n"
-            msg += "\n".join(f"• {feature}" for feature in tier_info['features'])
-            msg += "\n\n"
-
-            if not is_current and tier_id != "free":
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"Upgrade to {tier_info['name']}",
-                        callback_data=f"upgrade_{tier_id}"
-                    )
-                ])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        msg, reply_markup = SUBSCRIBE_VIEWS.get(current_tier) or _build_subscribe_view(current_tier)
         await update.message.reply_text(msg, parse_mode="Markdown", reply_markup=reply_markup)
 
     async def cmd_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -542,19 +1094,14 @@ Just type naturally — I understand questions like:
         elif isinstance(joined, str):
             joined = joined[:10]
 
-        msg = f"""
-📊 *Your Account Status*
-
-*Plan:* {tier_info.get('name', 'Free')}
-*Price:* AED {tier_info.get('price', 0)}/month
-*Queries Today:* {user_data.get('queries_today', 0)}
-*Queries Remaining:* {queries_remaining if queries_remaining >= 0 else 'Unlimited'}
-*Total Queries:* {total}
-*Member Since:* {joined}
-
-Type /subscribe to upgrade for more queries and features!
-        """
-
+        msg = STATUS_TEMPLATE.format(
+            plan=tier_info.get('name', 'Free'),
+            price=tier_info.get('price', 0),
+            queries_today=user_data.get('queries_today', 0),
+            remaining=queries_remaining if queries_remaining >= 0 else 'Unlimited',
+            total=total,
+            joined=joined,
+        )
         await update.message.reply_text(msg, parse_mode="Markdown")
 
     async def cmd_trends(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -565,35 +1112,28 @@ Type /subscribe to upgrade for more queries and features!
             await self.send_upgrade_message(update)
             return
 
-        zone = " ".join(context.args) if context.args else "Dubai Marina"
+        zone = command_args(update) or "Dubai Marina"
 
-        await update.message.chat.send_action(ChatAction.TYPING)
+        self._send_typing(update)
 
         try:
-            trends_query = (
-                f"Get comprehensive market trends for {zone}. "
-                f"Include: price trends, supply pipeline, liquidity metrics, "
-                f"and investment recommendation."
-            )
+            trends_query = TRENDS_PROMPT.format(zone)
             uid = str(user_id)
             start = time.time()
-            result = await handle_query(trends_query, user_id=uid)
+            result = await self.run_query(trends_query, uid)
             elapsed = (time.time() - start) * 1000
             await self.increment_usage(user_id)
-            response_text = result.response if hasattr(result, 'response') else str(result)
+            response_text = result.response
             self.conversation_store.update(uid, trends_query, response_text)
-            update_active_conversations(self.conversation_store.active_session_count())
+            self._mark_sessions_changed()
             if is_db_available():
                 await log_conversation(user_id, trends_query, response_text,
                                        response_time_ms=elapsed,
-                                       tools_used=result.tools_used if hasattr(result, 'tools_used') else [])
+                                       tools_used=result.tools_used)
             await self.send_split_message(update, response_text)
         except Exception as e:
             error_msg = self.format_error_message(e, user_id=str(user_id), query=zone)
-            try:
-                await update.message.reply_text(error_msg, parse_mode="Markdown")
-            except:
-                await update.message.reply_text(error_msg)
+            await update.message.reply_text(error_msg, parse_mode="Markdown")
 
     async def cmd_compare(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Compare properties"""
@@ -603,55 +1143,50 @@ Type /subscribe to upgrade for more queries and features!
             await self.send_upgrade_message(update)
             return
 
-        query = " ".join(context.args) if context.args else ""
-        if not query or "vs" not in query.lower():
+        query = command_args(update)
+        match = COMPARE_ARGS_RE.match(query)
+        if not match:
             await update.message.reply_text(
                 "Please specify properties to compare.\n"
                 "Example: /compare Marina Gate vs Princess Tower"
             )
             return
 
-        await update.message.chat.send_action(ChatAction.TYPING)
+        self._send_typing(update)
 
         try:
-            compare_query = (
-                f"Compare these properties: {query}. "
-                f"Create side-by-side comparison with price, location, "
-                f"chiller costs, ROI, and recommendation."
-            )
+            # Rebuilt from the operands so "A VS. B" and "A vs B" send one prompt
+            compare_query = COMPARE_PROMPT.format(match[1], match[2])
             uid = str(user_id)
             start = time.time()
-            result = await handle_query(compare_query, user_id=uid)
+            result = await self.run_query(compare_query, uid)
             elapsed = (time.time() - start) * 1000
             await self.increment_usage(user_id)
-            response_text = result.response if hasattr(result, 'response') else str(result)
+            response_text = result.response
             self.conversation_store.update(uid, compare_query, response_text)
-            update_active_conversations(self.conversation_store.active_session_count())
+            self._mark_sessions_changed()
             if is_db_available():
                 await log_conversation(user_id, compare_query, response_text,
                                        response_time_ms=elapsed,
-                                       tools_used=result.tools_used if hasattr(result, 'tools_used') else [])
+                                       tools_used=result.tools_used)
             await self.send_split_message(update, response_text)
         except Exception as e:
             error_msg = self.format_error_message(e, user_id=str(user_id), query=query)
-            try:
-                await update.message.reply_text(error_msg, parse_mode="Markdown")
-            except:
-                await update.message.reply_text(error_msg)
+            await update.message.reply_text(error_msg, parse_mode="Markdown")
 
     async def cmd_new(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Reset conversation context"""
         uid = str(update.effective_user.id)
-        record_command_metrics('new', uid)
+        self._record_command('new')
         self.conversation_store.reset(uid)
         record_conversation_reset('command')
-        update_active_conversations(self.conversation_store.active_session_count())
+        self._mark_sessions_changed()
         await update.message.reply_text("🔄 Conversation reset. Ask me anything about Dubai real estate!")
 
     async def cmd_manage(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Open Stripe Customer Portal for subscription management (Step 4)."""
         user_id = update.effective_user.id
-        record_command_metrics('manage', str(user_id))
+        self._record_command('manage')
 
         if not is_stripe_configured():
             await update.message.reply_text(
@@ -682,9 +1217,8 @@ Type /subscribe to upgrade for more queries and features!
     async def cmd_reset_limit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Admin command to reset query limits for testing"""
         user_id = update.effective_user.id
-        uid = str(user_id)
 
-        if uid not in self.admin_ids and str(user_id) not in self.admin_ids:
+        if user_id not in self.admin_ids:
             await update.message.reply_text("⛔ Admin access required.")
             return
 
@@ -693,12 +1227,15 @@ Type /subscribe to upgrade for more queries and features!
         else:
             target_user_id = user_id
 
+        _limit_reached.pop(target_user_id, None)
         if is_db_available():
             await reset_daily_queries(target_user_id)
             await update.message.reply_text(f"✅ Query limit reset for user {target_user_id}")
+        elif await reset_daily_quota(target_user_id):
+            await update.message.reply_text(f"✅ Query limit reset for user {target_user_id}")
         elif target_user_id in self._users_fallback:
             self._users_fallback[target_user_id]["queries_today"] = 0
-            self._users_fallback[target_user_id]["last_reset"] = date.today()
+            self._users_fallback[target_user_id]["last_reset"] = _today()
             await update.message.reply_text(f"✅ Query limit reset for user {target_user_id}")
         else:
             await update.message.reply_text(f"❌ User {target_user_id} not found in database")
@@ -710,7 +1247,7 @@ Type /subscribe to upgrade for more queries and features!
     async def cmd_save(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Save a property to watchlist"""
         user_id = update.effective_user.id
-        record_command_metrics('save', str(user_id))
+        self._record_command('save')
 
         if not context.args:
             await update.message.reply_text(
@@ -746,7 +1283,7 @@ Type /subscribe to upgrade for more queries and features!
     async def cmd_watchlist(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show saved properties"""
         user_id = update.effective_user.id
-        record_command_metrics('watchlist', str(user_id))
+        self._record_command('watchlist')
 
         if not is_db_available():
             await update.message.reply_text("Database not available. Please try again later.")
@@ -790,7 +1327,7 @@ Type /subscribe to upgrade for more queries and features!
     async def cmd_remove(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Remove a property from watchlist"""
         user_id = update.effective_user.id
-        record_command_metrics('remove', str(user_id))
+        self._record_command('remove')
 
         if not context.args:
             await update.message.reply_text(
@@ -819,7 +1356,7 @@ Type /subscribe to upgrade for more queries and features!
     async def cmd_referral(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show referral link and stats"""
         user_id = update.effective_user.id
-        record_command_metrics('referral', str(user_id))
+        self._record_command('referral')
 
         if not is_db_available():
             await update.message.reply_text("Database not available. Please try again later.")
@@ -859,7 +1396,7 @@ Share the link above — when someone signs up, you both get rewarded!
     async def cmd_digest(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Subscribe to market digest"""
         user_id = update.effective_user.id
-        record_command_metrics('digest', str(user_id))
+        self._record_command('digest')
 
         if not context.args:
             await update.message.reply_text(
@@ -879,7 +1416,7 @@ Share the link above — when someone signs up, you both get rewarded!
             return
 
         # Parse frequency and zones
-        args_text = " ".join(context.args)
+        args_text = command_args(update)
         frequency = "weekly"
         if args_text.lower().startswith("daily "):
             frequency = "daily"
@@ -908,7 +1445,7 @@ Share the link above — when someone signs up, you both get rewarded!
     async def cmd_digest_off(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Unsubscribe from market digest"""
         user_id = update.effective_user.id
-        record_command_metrics('digest_off', str(user_id))
+        self._record_command('digest_off')
 
         if not is_db_available():
             await update.message.reply_text("Database not available. Please try again later.")
@@ -933,53 +1470,40 @@ Share the link above — when someone signs up, you both get rewarded!
         query = update.message.text
 
         # Detect follow-up and get context if needed
-        followup = is_followup(query, self.conversation_store.has_session(uid))
+        if self.conversation_store.turn_count(uid) > COMPACT_AFTER_TURNS:
+            self.conversation_store.compact(uid)
+        session_context = self.conversation_store.get_if_session(uid)
+        followup = is_followup(query, session_context is not None)
         record_followup_detected(followup)
-        conv_context = self.conversation_store.get_context(uid) if followup else None
-
-        progress_msg = await update.message.reply_text(
-            "🔍 Analyzing...\n⏱️ This will take 30-60 seconds"
-        )
+        conv_context = (session_context or None) if followup else None
 
         try:
             start = time.time()
-            result = await handle_query(query, user_id=uid, conversation_context=conv_context)
+            # Follow-ups go as typed; they depend on the conversation context
+            prompt = query if conv_context else intent_prompt(query)
+            progress_msg, result = await self._run_with_progress(
+                update, self.run_query(prompt, uid, conv_context)
+            )
             elapsed = (time.time() - start) * 1000
-            await self.increment_usage(user_id)
-            response_text = result.response if hasattr(result, 'response') else str(result)
+            response_text = result.response
 
-            try:
-                await progress_msg.delete()
-            except:
-                pass
+            send_in_background(progress_msg.delete())
 
             self.conversation_store.update(uid, query, response_text)
-            update_active_conversations(self.conversation_store.active_session_count())
+            self._mark_sessions_changed()
 
+            # Usage count, button payload and conversation log don't depend
+            # on each other
+            writes = [self.increment_usage(user_id), self._query_keyboard(query)]
             if is_db_available():
-                await log_conversation(user_id, query, response_text,
-                                       response_time_ms=elapsed,
-                                       tools_used=result.tools_used if hasattr(result, 'tools_used') else [])
-
-            keyboard = [
-                [
-                    InlineKeyboardButton("📊 Full Report", callback_data=f"full_{query[:50]}"),
-                    InlineKeyboardButton("📈 Compare Options", callback_data=f"compare_{query[:50]}")
-                ],
-                [
-                    InlineKeyboardButton("💰 Calculate Mortgage", callback_data=f"mortgage_{query[:50]}"),
-                    InlineKeyboardButton("🔍 Web Search", callback_data=f"websearch_{query[:50]}")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
+                writes.append(log_conversation(user_id, query, response_text,
+                                               response_time_ms=elapsed,
+                                               tools_used=result.tools_used))
+            _, reply_markup, *_ = await asyncio.gather(*writes)
             await self.send_split_message(update, response_text, reply_markup=reply_markup)
         except Exception as e:
             error_msg = self.format_error_message(e, user_id=uid, query=query)
-            try:
-                await update.message.reply_text(error_msg, parse_mode="Markdown")
-            except:
-                await update.message.reply_text(error_msg)
+            await update.message.reply_text(error_msg, parse_mode="Markdown")
 
     async def handle_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle voice messages (Step 8)."""
@@ -997,7 +1521,7 @@ Share the link above — when someone signs up, you both get rewarded!
             await self.send_upgrade_message(update)
             return
 
-        await update.message.chat.send_action(ChatAction.TYPING)
+        self._send_typing(update)
 
         try:
             # Download the voice file
@@ -1034,7 +1558,7 @@ Share the link above — when someone signs up, you both get rewarded!
 
         except Exception as e:
             error_msg = self.format_error_message(e, user_id=uid, query="[voice message]")
-            await update.message.reply_text(error_msg)
+            await update.message.reply_text(error_msg, parse_mode="Markdown")
 
     # =====================================================
     # CALLBACK HANDLERS
@@ -1043,89 +1567,66 @@ Share the link above — when someone signs up, you both get rewarded!
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle button callbacks"""
         query = update.callback_query
-        await query.answer()
+        # Acknowledge the press alongside the dispatch rather than before it
+        send_in_background(query.answer())
 
-        data = query.data
         user_id = query.from_user.id
-        uid = str(user_id)
 
-        if data.startswith("upgrade_"):
-            tier = data.replace("upgrade_", "")
-            await self.process_upgrade(query, tier, user_id)
-        elif data.startswith("pdf_"):
-            property_query = data.replace("pdf_", "")
-            await self.generate_pdf_report(query, property_query, user_id)
-        elif data.startswith("full_"):
-            original_query = data.replace("full_", "")
-            await query.edit_message_text("📊 Generating full institutional report...\n⏱️ This will take 1-2 minutes")
-
-            full_query = f"Give me a full detailed analysis with all sections for: {original_query}"
-            result = await handle_query(full_query, user_id=uid)
-            response_text = result.response if hasattr(result, 'response') else str(result)
-
-            await query.message.reply_text(response_text[:4096])
-            if len(response_text) > 4096:
-                await query.message.reply_text(response_text[4096:8192])
-
-        elif data.startswith("compare_"):
-            original_query = data.replace("compare_", "")
-            await query.edit_message_text("📈 Finding comparable properties...")
-
-            compare_query = f"Show me 3 comparable alternatives to: {original_query}"
-            result = await handle_query(compare_query, user_id=uid)
-            response_text = result.response if hasattr(result, 'response') else str(result)
-            await query.message.reply_text(response_text[:4096])
-
-        elif data.startswith("mortgage_"):
-            original_query = data.replace("mortgage_", "")
-            await query.edit_message_text("💰 Calculating mortgage scenarios...")
-
-            mortgage_query = f"Calculate mortgage options for: {original_query}. Show 75% and 80% LTV scenarios."
-            result = await handle_query(mortgage_query, user_id=uid)
-            response_text = result.response if hasattr(result, 'response') else str(result)
-            await query.message.reply_text(response_text[:4096])
-
-        elif data.startswith("websearch_"):
-            original_query = data.replace("websearch_", "")
-            await query.edit_message_text("🔍 Searching web for latest info...")
-
-            web_query = f"Search the web for current information about: {original_query}"
-            result = await handle_query(web_query, user_id=uid)
-            response_text = result.response if hasattr(result, 'response') else str(result)
-            await query.message.reply_text(response_text[:4096])
-
-        elif data.startswith("save_"):
-            property_id = data.replace("save_", "")
-            if is_db_available():
-                saved = await save_property(user_id, {"id": property_id, "source": "inline_save"})
-                if saved:
-                    await query.answer("Saved to watchlist!", show_alert=False)
-                else:
-                    await query.answer("Already in watchlist", show_alert=False)
+        # Result buttons send "<action>:<ref>"; the rest send "<action>_<arg>",
+        # as did result buttons on messages from before refs were used
+        action, sep, arg = query.data.partition(":")
+        if sep and action.isalpha():
+            arg = await self._callback_payload(arg)
+            if arg is None:
+                await query.message.reply_text("⌛ That button has expired. Please send your question again.")
+                return
+        else:
+            action, _, arg = query.data.partition("_")
+
+        handler = self._callback_handlers.get(action)
+        if handler is not None:
+            await handler(query, arg, user_id)
+
+    async def _run_result_action(self, action: str, query, original_query: str, user_id: int):
+        """Run a result button's follow-up query and reply with the answer."""
+        status, prompt, max_parts = RESULT_ACTIONS[action]
+        await query.edit_message_text(status)
+
+        result = await self.run_query(prompt.format(original_query), str(user_id))
+        response_text = result.response
+        for start in range(0, min(len(response_text), max_parts * 4096), 4096):
+            await query.message.reply_text(response_text[start:start + 4096])
+
+    async def _save_from_button(self, query, property_id: str, user_id: int):
+        if is_db_available():
+            saved = await save_property(user_id, {"id": property_id, "source": "inline_save"})
+            if saved:
+                await query.answer("Saved to watchlist!", show_alert=False)
             else:
-                await query.answer("Database not available", show_alert=True)
+                await query.answer("Already in watchlist", show_alert=False)
+        else:
+            await query.answer("Database not available", show_alert=True)
 
-        elif data.startswith("removeprop_"):
-            property_id = data.replace("removeprop_", "")
-            if is_db_available():
-                removed = await remove_saved_property(user_id, property_id)
-                if removed:
-                    await query.answer("Removed from watchlist", show_alert=False)
-                    # Refresh watchlist
-                    props = await get_saved_properties(user_id)
-                    if props:
-                        msg = "📋 *Your Watchlist*\n\n"
-                        for p in props:
-                            pd = p["property_data"]
-                            msg += f"• *{pd.get('title', pd.get('id', 'Unknown'))}*\n"
-                            if pd.get("price"):
-                                msg += f"  Price: AED {pd['price']:,.0f}\n"
-                            if pd.get("location"):
-                                msg += f"  Location: {pd['location']}\n"
-                            msg += f"  Saved: {p['saved_at'][:10] if p['saved_at'] else 'N/A'}\n\n"
-                        await query.edit_message_text(msg, parse_mode="Markdown")
-                    else:
-                        await query.edit_message_text("📋 Your watchlist is empty.")
+    async def _remove_from_button(self, query, property_id: str, user_id: int):
+        if is_db_available():
+            removed = await remove_saved_property(user_id, property_id)
+            if removed:
+                await query.answer("Removed from watchlist", show_alert=False)
+                # Refresh watchlist
+                props = await get_saved_properties(user_id)
+                if props:
+                    msg = "📋 *Your Watchlist*\n\n"
+                    for p in props:
+                        pd = p["property_data"]
+                        msg += f"• *{pd.get('title', pd.get('id', 'Unknown'))}*\n"
+                        if pd.get("price"):
+                            msg += f"  Price: AED {pd['price']:,.0f}\n"
+                        if pd.get("location"):
+                            msg += f"  Location: {pd['location']}\n"
+                        msg += f"  Saved: {p['saved_at'][:10] if p['saved_at'] else 'N/A'}\n\n"
+                    await query.edit_message_text(msg, parse_mode="Markdown")
+                else:
+                    await query.edit_message_text("📋 Your watchlist is empty.")
 
     # =====================================================
     # STRIPE INTEGRATION (Step 4)
@@ -1186,13 +1687,12 @@ Share the link above — when someone signs up, you both get rewarded!
             # Run a full analysis
             uid = str(user_id)
             full_query = f"Give me a full detailed analysis with all sections for: {property_query}"
-            result = await handle_query(full_query, user_id=uid)
-            response_text = result.response if hasattr(result, 'response') else str(result)
-            tools_used = result.tools_used if hasattr(result, 'tools_used') else []
+            result = await self.run_query(full_query, uid)
+            response_text = result.response
+            tools_used = result.tools_used
 
             # Generate PDF
             from pdf_generator import generate_report
-            import io
 
             user_name = query.from_user.first_name or query.from_user.username or "Investor"
             pdf_bytes = await generate_report(
@@ -1202,13 +1702,11 @@ Share the link above — when someone signs up, you both get rewarded!
                 tools_used=tools_used,
             )
 
-            # Send as Telegram document
-            pdf_file = io.BytesIO(pdf_bytes)
-            pdf_file.name = f"TrueValue_Report_{property_query[:30].replace(' ', '_')}.pdf"
-
+            # Send as Telegram document; bytes are uploaded as-is, without
+            # a BytesIO wrapper that would be read back into another copy
             await query.message.reply_document(
-                document=pdf_file,
-                filename=pdf_file.name,
+                document=pdf_bytes,
+                filename=f"TrueValue_Report_{property_query[:30].replace(' ', '_')}.pdf",
                 caption=f"📄 TrueValue AI Report: {property_query}",
             )
 
@@ -1225,17 +1723,12 @@ Share the link above — when someone signs up, you both get rewarded!
 
     async def send_upgrade_message(self, update: Update):
         """Send upgrade prompt when limit reached"""
-        keyboard = [[
-            InlineKeyboardButton("📈 Upgrade Now", callback_data="upgrade_basic")
-        ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await update.message.reply_text(
             "⚠️ *Daily Query Limit Reached*\n\n"
             "Upgrade to get more queries and advanced features!\n"
             "Type /subscribe to see plans.",
             parse_mode="Markdown",
-            reply_markup=reply_markup,
+            reply_markup=UPGRADE_NOW_MARKUP,
         )
 
     def format_error_message(self, error: Exception, user_id: str = None, query: str = None) -> str:
@@ -1251,124 +1744,210 @@ Share the link above — when someone signs up, you both get rewarded!
                 query=query
             )
 
-        if "credit balance is too low" in error_str.lower():
-            return (
-                "❌ *API Credits Issue*\n\n"
-                "The Anthropic API credits are running low.\n\n"
-                "📧 Please contact support or try again later.\n\n"
-                "_Error: Insufficient API credits_"
-            )
-        elif "rate limit" in error_str.lower():
-            return (
-                "⏱️ *Rate Limit Reached*\n\n"
-                "Too many requests. Please wait a moment and try again.\n\n"
-                "_The API has temporary rate limits._"
-            )
-        elif "timeout" in error_str.lower():
-            return (
-                "⏱️ *Request Timeout*\n\n"
-                "The analysis took too long. Please try a simpler query.\n\n"
-                "_The API request timed out._"
-            )
-        elif "network" in error_str.lower() or "connection" in error_str.lower():
-            return (
-                "🌐 *Connection Issue*\n\n"
-                "Could not connect to the AI service.\n\n"
-                "Please try again in a moment.\n\n"
-                "_Network connectivity error_"
-            )
-        else:
-            return (
-                "❌ *Something Went Wrong*\n\n"
-                "An error occurred while processing your request.\n\n"
-                "Please try again or contact support if the issue persists.\n\n"
-                f"_Error details: {error_str[:100]}_"
-            )
-
-    async def send_split_message(self, update: Update, text: str, reply_markup=None):
-        """Split long messages to respect Telegram's 4096 char limit"""
-        MAX_LENGTH = 4096
+        # Lowest group number wins when several classes match
+        matched = {m.lastindex for m in _ERROR_CLASS_RE.finditer(error_str)}
+        if matched:
+            return _ERROR_CLASS_MESSAGES[min(matched)]
+        # Error text is escaped, so every message here parses as Markdown
+        return _GENERIC_ERROR_TEMPLATE.format(escape_markdown(error_str[:100]))
 
+    async def _query_keyboard(self, query_text: str, with_pdf: bool = False) -> InlineKeyboardMarkup:
+        """
+        Follow-up buttons for a query result. The query text is stored under a
+        short ref so callback_data stays within Telegram's 64-byte limit.
+        """
+        ref = secrets.token_urlsafe(6)
+        _remember_callback_payload(ref, query_text)
+        await set_callback_payload(ref, query_text)
+
+        rows = PDF_KEYBOARD_ROWS if with_pdf else RESULT_KEYBOARD_ROWS
+        return InlineKeyboardMarkup(tuple(
+            tuple(InlineKeyboardButton(label, callback_data=f"{action}:{ref}") for label, action in row)
+            for row in rows
+        ))
+
+    async def _callback_payload(self, ref: str):
+        """Query text for a result button's ref, or None once it has expired."""
+        payload = _callback_payloads.get(ref)
+        if payload is None:
+            payload = await get_callback_payload(ref)
+        return payload
+
+    async def _run_with_progress(self, update: Update, query_coro):
+        """
+        Post the progress note while the query is already running. If the note
+        can't be sent the query is cancelled, so no uncounted answer is left
+        running behind the error reply.
+        """
+        query_task = asyncio.ensure_future(query_coro)
         try:
-            if len(text) <= MAX_LENGTH:
-                await update.message.reply_text(
-                    text, parse_mode="Markdown", reply_markup=reply_markup
-                )
-                return
+            progress_msg = await update.message.reply_text(ANALYZING_MSG)
+        except BaseException:
+            query_task.cancel()
+            raise
+        return progress_msg, await query_task
 
-            parts = []
-            current = ""
+    def _send_typing(self, update: Update) -> None:
+        """Show the typing indicator without waiting on the API round-trip."""
+        send_in_background(update.message.chat.send_action(ChatAction.TYPING))
 
-            for paragraph in text.split("\n\n"):
-                if len(current) + len(paragraph) + 2 < MAX_LENGTH:
-                    current += paragraph + "\n\n"
-                else:
-                    if current:
-                        parts.append(current.strip())
-                    current = paragraph + "\n\n"
-
-            if current:
-                parts.append(current.strip())
-
-            for i, part in enumerate(parts):
-                is_last = (i == len(parts) - 1)
-                await update.message.reply_text(
-                    part, parse_mode="Markdown",
-                    reply_markup=reply_markup if is_last else None
-                )
-                await asyncio.sleep(0.5)
+    async def send_split_message(self, update: Update, text: str, reply_markup=None):
+        """Split long messages to respect Telegram's 4096 char limit"""
+        parts = split_message(text)
 
-        except Exception:
-            if len(text) <= MAX_LENGTH:
-                await update.message.reply_text(text, reply_markup=reply_markup)
-            else:
-                parts = []
-                current = ""
-                for paragraph in text.split("\n\n"):
-                    if len(current) + len(paragraph) + 2 < MAX_LENGTH:
-                        current += paragraph + "\n\n"
-                    else:
-                        if current:
-                            parts.append(current.strip())
-                        current = paragraph + "\n\n"
-                if current:
-                    parts.append(current.strip())
-
-                for i, part in enumerate(parts):
-                    is_last = (i == len(parts) - 1)
-                    await update.message.reply_text(
-                        part, reply_markup=reply_markup if is_last else None
-                    )
-                    await asyncio.sleep(0.5)
+        for i, part in enumerate(parts):
+            markup = reply_markup if i == len(parts) - 1 else None
+            if not markdown_balanced(part):
+                await update.message.reply_text(part, reply_markup=markup)
+                continue
+            try:
+                await update.message.reply_text(part, parse_mode="Markdown", reply_markup=markup)
+            except Exception:
+                # Markdown Telegram can't parse (e.g. a stray [): send as plain text
+                await update.message.reply_text(part, reply_markup=markup)
 
     # =====================================================
     # RUN
     # =====================================================
 
+    async def initialize(self):
+        """
+        Initialise the Application and run its post_init hook. run_polling()
+        would call the hook itself; the run modes here drive the Application
+        directly, so they go through this instead.
+        """
+        await self.application.initialize()
+        await self.application.post_init(self.application)
+
+    async def shutdown(self):
+        """Run the Application's post_shutdown hook, then shut it down."""
+        await self.application.post_shutdown(self.application)
+        await self.application.shutdown()
+
     async def run(self):
         """Run the bot + FastAPI admin dashboard"""
         import uvicorn
         from main import app
         from database import init_db
+        from cache import init_cache
 
         # Initialise database pool
         await init_db()
+        # Quota fallback needs Redis; run.py may have connected it already
+        if not is_cache_available():
+            await init_cache()
+
+        await self.initialize()
+        try:
+            await self.application.start()
+            # Long-poll so each getUpdates round-trip returns a full batch (up to 100)
+            await self.application.updater.start_polling(
+                timeout=POLLING_TIMEOUT_SECONDS,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+
+            print("✅ Telegram bot running...")
+            print("📱 Bot ready to receive messages")
+
+            # Start FastAPI (admin dashboard) alongside the bot
+            port = int(os.getenv("PORT", "8000"))
+            config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info")
+            server = uvicorn.Server(config)
+            print(f"🌐 Admin dashboard at http://localhost:{port}/admin/")
+            await server.serve()
+        finally:
+            await self._stop_metrics_flusher(self.application)
+
+    async def run_update_poller(self):
+        """
+        BOT_MODE=poller: long-poll Telegram and append each batch of updates
+        to the Redis streams. The offset only advances once a batch is in
+        Redis, so updates aren't lost while Redis is unreachable.
+        """
+        if not is_cache_available():
+            raise RuntimeError("BOT_MODE=poller needs Redis (REDIS_URL)")
 
         await self.application.initialize()
-        await self.application.start()
-        await self.application.updater.start_polling()
+        bot = self.application.bot
+        offset = None
+        print(f"✅ Telegram update poller running ({BOT_STREAM_PARTITIONS} partitions)")
 
-        print("✅ Telegram bot running...")
-        print("📱 Bot ready to receive messages")
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, limit=100, timeout=POLLING_TIMEOUT_SECONDS,
+                    allowed_updates=ALLOWED_UPDATES,
+                )
+            except TelegramError as exc:
+                bot_logger.warning("getUpdates failed: %s", exc)
+                await asyncio.sleep(1)
+                continue
+            if not updates:
+                continue
+
+            batch = [(update_partition(u), json.dumps(u.to_dict())) for u in updates]
+            if not await publish_updates(batch):
+                await asyncio.sleep(1)
+                continue
+            offset = updates[-1].update_id + 1
+
+    async def run_update_worker(self, partition: int):
+        """
+        BOT_MODE=worker: handle the updates on one stream partition through
+        the usual handlers. Entries are acked once handled; after a crash the
+        worker first replays what it had read but not acked.
+        """
+        if not is_cache_available():
+            raise RuntimeError("BOT_MODE=worker needs Redis (REDIS_URL)")
+        if not 0 <= partition < BOT_STREAM_PARTITIONS:
+            raise ValueError(f"Partition {partition} outside 0..{BOT_STREAM_PARTITIONS - 1}")
+        if not await ensure_update_group(partition):
+            raise RuntimeError("Could not create the update stream consumer group")
+
+        await self.initialize()
+        consumer = f"worker-{partition}"
+        slots = asyncio.Semaphore(BOT_MAX_PENDING_UPDATES)
+        tasks = set()
+        after = "0"  # replay unacked entries first, then switch to new ones
+        print(f"✅ Telegram update worker running (partition {partition})")
 
-        # Start FastAPI (admin dashboard) alongside the bot
-        port = int(os.getenv("PORT", "8000"))
-        config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info")
-        server = uvicorn.Server(config)
-        print(f"🌐 Admin dashboard at http://localhost:{port}/admin/")
-        await server.serve()
+        try:
+            while True:
+                entries = await read_updates(partition, consumer, STREAM_READ_COUNT, after)
+                if entries is None:
+                    await asyncio.sleep(1)
+                    continue
+                if after != ">":
+                    if not entries:
+                        after = ">"
+                        continue
+                    after = entries[-1][0]
+
+                for entry_id, payload in entries:
+                    if payload is None:
+                        await ack_update(partition, entry_id)
+                        continue
+                    await slots.acquire()
+                    update = Update.de_json(json.loads(payload), self.application.bot)
+                    task = asyncio.create_task(self._handle_stream_update(partition, entry_id, update))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: slots.release())
+        finally:
+            await self._stop_metrics_flusher(self.application)
+
+    async def _handle_stream_update(self, partition: int, entry_id: str, update: Update):
+        app = self.application
+        try:
+            # Same path as polling: per-chat ordering and the concurrency caps
+            await app.update_processor.process_update(update, app.process_update(update))
+        except Exception:
+            bot_logger.exception("Update %s failed", update.update_id)
+        await ack_update(partition, entry_id)
 
 
 if __name__ == "__main__":
+    from run import run_event_loop
+
     bot = TelegramBotServer()
-    asyncio.run(bot.run())
+    run_event_loop(bot.run())
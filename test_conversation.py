@@ -97,7 +97,7 @@ def test_followup_detection():
 # =====================================================
 
 def test_session_management():
-    print("\n📋 B. Session Management (7 tests)")
+    print("\n📋 B. Session Management (8 tests)")
 
     store = ConversationStore()
 
@@ -119,6 +119,9 @@ def test_session_management():
     check("After one turn → summary contains key facts",
           ctx is not None and "Marina" in ctx and "62/100" in ctx)
 
+    check("get_if_session() matches get_context()",
+          store.get_if_session("user1") == ctx and store.get_if_session("nobody") is None)
+
     # After 3 turns
     store.update("user1", "What about JBR?",
                  "JBR Walk area. AED 1,800,000. Score: 58/100. CAUTIOUS BUY. Higher supply risk.")
@@ -149,7 +152,7 @@ def test_session_management():
 # =====================================================
 
 def test_summary_extraction():
-    print("\n📋 C. Summary Extraction (8 tests)")
+    print("\n📋 C. Summary Extraction (10 tests)")
 
     check('Score extraction: "Score: 72/100"',
           "72/100" in _extract_key_facts("Investment Score: 72/100 — moderate"))
@@ -181,6 +184,14 @@ def test_summary_extraction():
     check("Summary stays under 500 chars after 5 turns",
           ctx is not None and len(ctx) <= 500)
 
+    # Compacting keeps only the most recent turns
+    store.compact("user_compact", keep_turns=2)
+    ctx = store.get_context("user_compact")
+    check("Compact keeps the last 2 turns",
+          store.turn_count("user_compact") == 2 and ctx.count(" | ") == 1)
+    check("Compacted summary starts with Prior:",
+          ctx.startswith("Prior: Query about area 3"))
+
     store.shutdown()
 
 
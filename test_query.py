@@ -155,8 +155,8 @@ async def interactive_repl():
             ])
             continue
         if query == "!metrics":
-            from observability import metrics_tracker
-            summary = metrics_tracker.get_summary()
+            from observability import metrics_tracker, format_summary
+            summary = format_summary(metrics_tracker.get_summary())
             print(f"\n{BOLD}Session Metrics:{RESET}")
             for k, v in summary.items():
                 print(f"  {k}: {v}")
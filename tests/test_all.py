@@ -829,6 +829,135 @@ class TestCacheConfig:
         assert key1 == key2  # Order-independent
         assert key1.startswith("tv:test_tool:")
 
+    @pytest.mark.asyncio
+    async def test_unit_daily_quota_no_redis(self):
+        from cache import get_daily_quota, incr_daily_quota, reset_daily_quota, _quota_key
+        assert await get_daily_quota(12345) is None
+        assert await incr_daily_quota(12345) is None
+        assert await reset_daily_quota(12345) is False
+        # Outside tv:* so flush_all() leaves quotas alone
+        assert _quota_key(12345).startswith("tvu:quota:12345:")
+
+    def test_unit_quota_key_rolls_over(self, monkeypatch):
+        from datetime import date
+        import cache
+        monkeypatch.setattr(cache, "_quota_day", "2000-01-01")
+        monkeypatch.setattr(cache, "_quota_day_ends", 0.0)
+        assert cache._quota_key(7) == f"tvu:quota:7:{date.today().isoformat()}"
+        assert cache._quota_day_ends > 0
+
+    def test_unit_cache_value_roundtrip(self):
+        from decimal import Decimal
+        from cache import _dumps, _loads
+        value = {"zone": "Marina", "prices": [1.5, 2], 2024: "year", "price": Decimal("1.5")}
+        assert _loads(_dumps(value)) == {"zone": "Marina", "prices": [1.5, 2], "2024": "year", "price": "1.5"}
+
+    def test_unit_query_cache_key_normalized(self):
+        from cache import _query_key
+        assert _query_key("Analyze  Marina Gate Tower 1 ") == _query_key("analyze marina gate tower 1")
+        assert _query_key("Analyze Marina Gate Tower 1") != _query_key("Analyze Marina Gate Tower 2")
+        assert _query_key("x").startswith("tv:q:")
+        assert _query_key("x", "ctx A") != _query_key("x")
+        assert _query_key("x", "ctx A") != _query_key("x", "ctx B")
+
+    @pytest.mark.asyncio
+    async def test_unit_query_cache_memory_tier(self):
+        """Answers are served from process memory, even without Redis."""
+        from cache import get_cached_response, set_cached_response, _query_memo
+        _query_memo.clear()
+        await set_cached_response("Trends  in JVC", {"response": "up"}, "ctx")
+        assert await get_cached_response("trends in jvc", "ctx") == {"response": "up"}
+        assert await get_cached_response("trends in jvc") is None
+        _query_memo.clear()
+
+    @pytest.mark.asyncio
+    async def test_unit_semantic_cache_checks_context_and_numbers(self, monkeypatch):
+        """Paraphrases hit; other contexts or numbers don't."""
+        import numpy as np
+        import semantic_cache
+
+        async def fake_embed(query):
+            # Every query about Marina embeds to the same vector
+            vector = np.zeros(semantic_cache.EMBEDDING_DIM, dtype=np.float32)
+            vector[0 if "marina" in query.lower() else 1] = 1.0
+            return vector
+
+        monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ENABLED", True)
+        monkeypatch.setattr(semantic_cache, "OPENAI_API_KEY", "test")
+        monkeypatch.setattr(semantic_cache, "_embed", fake_embed)
+        monkeypatch.setattr(semantic_cache, "_entries", [])
+        monkeypatch.setattr(semantic_cache, "_vectors", None)
+        monkeypatch.setattr(semantic_cache, "_next_slot", 0)
+
+        await semantic_cache.store("Find 2BR apartments in Marina under 2M", {"response": "a"})
+        assert await semantic_cache.lookup("2-bedroom apts Dubai Marina <2M") == {"response": "a"}
+        assert await semantic_cache.lookup("3BR in Marina under 2M") is None
+        assert await semantic_cache.lookup("2BR Marina 2M", "earlier turn") is None
+        assert await semantic_cache.lookup("2BR in JVC under 2M") is None
+
+    @pytest.mark.asyncio
+    async def test_unit_semantic_cache_checks_names(self, monkeypatch):
+        """Queries naming another area or building miss; area aliases still hit."""
+        import numpy as np
+        import semantic_cache
+
+        async def fake_embed(query):
+            # Everything embeds alike, so only the name check tells them apart
+            vector = np.zeros(semantic_cache.EMBEDDING_DIM, dtype=np.float32)
+            vector[0] = 1.0
+            return vector
+
+        monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ENABLED", True)
+        monkeypatch.setattr(semantic_cache, "OPENAI_API_KEY", "test")
+        monkeypatch.setattr(semantic_cache, "_embed", fake_embed)
+        monkeypatch.setattr(semantic_cache, "_entries", [])
+        monkeypatch.setattr(semantic_cache, "_vectors", None)
+        monkeypatch.setattr(semantic_cache, "_next_slot", 0)
+
+        await semantic_cache.store("Analyze JLT", {"response": "jlt"})
+        await semantic_cache.store("Analyze Marina Gate", {"response": "gate"})
+        assert await semantic_cache.lookup("Analyze Jumeirah Lake Towers") == {"response": "jlt"}
+        assert await semantic_cache.lookup("Analyze JBR") is None
+        assert await semantic_cache.lookup("analysis of Marina Gate") == {"response": "gate"}
+        assert await semantic_cache.lookup("Analyze Marina Heights") is None
+
+    @pytest.mark.asyncio
+    async def test_unit_query_cache_hit_is_counted(self, monkeypatch):
+        """Cached answers reach the query metrics and carry a fresh timestamp."""
+        import cache
+        import main
+        hits, completed = [], []
+
+        async def fake_get_cached(query, conversation_context=None):
+            return {"response": "cached", "tools_used": ["search_properties"], "timestamp": "2020-01-01T00:00:00"}
+
+        monkeypatch.setattr(cache, "get_cached_response", fake_get_cached)
+        monkeypatch.setattr(main, "record_cache_hit", hits.append)
+        monkeypatch.setattr(main, "log_query_complete", lambda **kwargs: completed.append(kwargs))
+
+        result = await main.handle_query("Analyze JBR", "u1")
+
+        assert result.response == "cached"
+        assert result.timestamp != "2020-01-01T00:00:00"
+        assert hits == ["query"]
+        assert completed[0]["tools_used"] == [] and completed[0]["success"] is True
+
+    @pytest.mark.asyncio
+    async def test_unit_fallback_users_without_redis(self):
+        """Without Redis the caller can tell \"unknown\" from \"not new\"."""
+        from cache import _user_key, create_fallback_user, get_fallback_user
+        assert _user_key(7) == "tvu:user:7"
+        assert await create_fallback_user(7, {"tier": "free"}) is None
+        assert await get_fallback_user(7) is None
+
+    @pytest.mark.asyncio
+    async def test_unit_update_streams_without_redis(self):
+        """Stream helpers degrade like the rest of the cache, outside tv:*."""
+        from cache import _update_stream_key, publish_updates, read_updates
+        assert _update_stream_key(3) == "tvs:updates:3"
+        assert await publish_updates([(0, "{}")]) is False
+        assert await read_updates(0, "worker-0", 32) is None
+
 
 # =====================================================
 # 16. DATABASE SCHEMA (unit)
@@ -846,6 +975,7 @@ class TestDatabaseSchema:
         assert "CREATE TABLE IF NOT EXISTS saved_properties" in SCHEMA_DDL
         assert "CREATE TABLE IF NOT EXISTS referrals" in SCHEMA_DDL
         assert "CREATE TABLE IF NOT EXISTS digest_preferences" in SCHEMA_DDL
+        assert "CREATE TABLE IF NOT EXISTS processed_stripe_events" in SCHEMA_DDL
 
     def test_unit_schema_indexes(self):
         from database import SCHEMA_DDL
@@ -913,6 +1043,13 @@ class TestDatabaseNoPool:
         result = await count_saved_properties(12345)
         assert result == 0
 
+    @pytest.mark.asyncio
+    async def test_unit_upsert_user_no_db(self):
+        from database import get_or_create_user_returning_isnew
+        user, is_new = await get_or_create_user_returning_isnew(12345, "alice", "Alice")
+        assert user is None
+        assert is_new is False
+
     @pytest.mark.asyncio
     async def test_unit_referral_code_no_db(self):
         from database import get_or_create_referral_code
@@ -955,6 +1092,12 @@ class TestDatabaseNoPool:
         result = await get_remaining_queries(12345, {"free": {"queries_per_day": 50}})
         assert result == 50  # fallback default
 
+    @pytest.mark.asyncio
+    async def test_unit_apply_subscription_event_no_db(self):
+        from database import apply_subscription_event
+        result = await apply_subscription_event(12345, "pro", "checkout_completed", "evt_1", 299)
+        assert result is None
+
 
 # =====================================================
 # 18. DIGEST GENERATOR (Feature 7 — unit)
@@ -1111,6 +1254,325 @@ class TestBotStructure:
         )
         assert True
 
+    @pytest.mark.asyncio
+    async def test_unit_update_processor_orders_per_chat(self):
+        """Updates run concurrently across chats but in order within a chat."""
+        from types import SimpleNamespace
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import PerChatUpdateProcessor
+
+        processor = PerChatUpdateProcessor(max_running=4, max_pending=16)
+        events = []
+        release_a = asyncio.Event()
+
+        async def work(name, gate=None):
+            events.append(f"start {name}")
+            if gate:
+                await gate.wait()
+            events.append(f"end {name}")
+
+        def update(chat_id):
+            return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+        a1 = asyncio.create_task(processor.process_update(update(1), work("a1", release_a)))
+        a2 = asyncio.create_task(processor.process_update(update(1), work("a2")))
+        b1 = asyncio.create_task(processor.process_update(update(2), work("b1")))
+        await b1
+        # Chat 2 finished while chat 1's first update is still blocked
+        assert events == ["start a1", "start b1", "end b1"]
+        release_a.set()
+        await asyncio.gather(a1, a2)
+        assert events[-3:] == ["end a1", "start a2", "end a2"]
+        assert processor._chat_locks == {}
+
+    def test_unit_split_message(self):
+        """Long replies split between paragraphs, never over the limit."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import split_message
+
+        assert split_message("short") == ["short"]
+
+        paragraphs = [f"p{i} " + "x" * 30 for i in range(10)]
+        parts = split_message("\n\n".join(paragraphs), max_length=80)
+        assert all(len(part) <= 80 for part in parts)
+        assert "\n\n".join(parts) == "\n\n".join(paragraphs)
+        assert parts[0] == "\n\n".join(paragraphs[:2])
+
+        # An oversize paragraph is cut rather than sent whole
+        parts = split_message("a" * 25 + "\n\n" + "b" * 10, max_length=10)
+        assert parts == ["a" * 10, "a" * 10, "a" * 5, "b" * 10]
+
+    def test_unit_markdown_balanced(self):
+        """Parts with an unpaired Markdown marker are detected before sending."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import markdown_balanced
+
+        assert markdown_balanced("*Score:* 72/100 _GOOD BUY_ `AED 1.2M`")
+        assert not markdown_balanced("*Score: 72/100")
+        assert not markdown_balanced("service_charge")
+
+    @pytest.mark.asyncio
+    async def test_unit_send_rate_limiter_retries_429(self):
+        """A RetryAfter from Telegram is retried instead of surfacing."""
+        from telegram.error import RetryAfter
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import SendRateLimiter
+
+        attempts = []
+
+        async def send(text):
+            attempts.append(text)
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return True
+
+        limiter = SendRateLimiter()
+        result = await limiter.process_request(send, ("hi",), {}, "sendMessage", {"chat_id": 1}, None)
+        assert result is True
+        assert attempts == ["hi", "hi"]
+        # The 429 paused sends to every chat, not just the one that hit it
+        assert limiter._paused_until > 0
+
+    def test_unit_send_rate_limiter_group_buckets(self):
+        """Group chats get Telegram's slower 20-per-minute bucket."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import SendRateLimiter, TELEGRAM_CHAT_MESSAGES_PER_SECOND
+
+        limiter = SendRateLimiter()
+        assert limiter._chat_bucket(42).rate == TELEGRAM_CHAT_MESSAGES_PER_SECOND
+        assert limiter._chat_bucket(-100123).rate == 20 / 60
+
+    def test_unit_error_classification(self):
+        """Errors map to user-facing messages by priority, not position."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import TelegramBotServer
+
+        fmt = TelegramBotServer.format_error_message
+        assert "Request Timeout" in fmt(None, Exception("Connection timeout"))
+        assert "API Credits" in fmt(None, Exception("Rate limit: Your credit balance is too low"))
+        assert "Connection Issue" in fmt(None, Exception("NETWORK unreachable"))
+        assert "boom" in fmt(None, Exception("boom"))
+
+    def test_unit_error_details_escaped(self):
+        """Error text can't break the Markdown of the generic error message."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import TelegramBotServer, escape_markdown
+
+        assert escape_markdown("bad *key* in [x]_y") == r"bad \*key\* in \[x]\_y"
+        msg = TelegramBotServer.format_error_message(None, Exception("KeyError: 'service_charge'"))
+        assert r"service\_charge" in msg
+
+    def test_unit_compare_args(self):
+        """/compare needs two operands around a standalone "vs"."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import COMPARE_ARGS_RE
+
+        match = COMPARE_ARGS_RE.match("Marina Gate VS. Princess Tower")
+        assert (match[1], match[2]) == ("Marina Gate", "Princess Tower")
+        assert COMPARE_ARGS_RE.match("A vs B vs C")[2] == "B vs C"
+        assert COMPARE_ARGS_RE.match("Canvas Tower") is None
+        assert COMPARE_ARGS_RE.match("vs Princess Tower") is None
+
+    def test_unit_command_args(self):
+        """Command arguments come from the message text, spacing intact."""
+        from types import SimpleNamespace
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import command_args
+
+        def update(text):
+            return SimpleNamespace(message=SimpleNamespace(text=text))
+
+        assert command_args(update("/search Marina  2BR under 2M ")) == "Marina  2BR under 2M"
+        assert command_args(update("/compare@TrueValueBot\nA vs B")) == "A vs B"
+        assert command_args(update("/trends")) == ""
+
+    def test_unit_intent_prompt(self):
+        """Command-like messages become the command's prompt; others pass through."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        from bot import intent_prompt, ANALYZE_PROMPT, COMPARE_PROMPT, TRENDS_PROMPT
+
+        assert intent_prompt("analyse Marina Gate?") == ANALYZE_PROMPT.format("Marina Gate")
+        assert intent_prompt("Compare A VS. B") == COMPARE_PROMPT.format("A", "B")
+        assert intent_prompt("market trends in JVC") == TRENDS_PROMPT.format("JVC")
+        assert intent_prompt("Best 1BR in JBR under 1M?") == "Best 1BR in JBR under 1M?"
+
+    @pytest.mark.asyncio
+    async def test_unit_result_buttons_carry_short_refs(self):
+        """Result buttons fit in 64 bytes however long the query, and resolve back."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        server = object.__new__(bot.TelegramBotServer)
+        query_text = "تحليل برج مارينا جيت " * 10
+        markup = await server._query_keyboard(query_text, with_pdf=True)
+
+        buttons = [button for row in markup.inline_keyboard for button in row]
+        assert len(buttons) == 5
+        assert all(len(b.callback_data.encode()) <= 64 for b in buttons)
+        ref = buttons[0].callback_data.split(":", 1)[1]
+        assert await server._callback_payload(ref) == query_text
+
+    @pytest.mark.asyncio
+    async def test_unit_callback_dispatch(self, monkeypatch, mock_query_response):
+        """Button presses route through the handler table, old and new formats."""
+        from types import SimpleNamespace
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        server = object.__new__(bot.TelegramBotServer)
+        prompts, replies = [], []
+
+        async def fake_run_query(prompt, uid, conversation_context=None):
+            prompts.append(prompt)
+            return mock_query_response
+
+        async def record(*args, **kwargs):
+            replies.append(args[0] if args else kwargs)
+
+        server.run_query = fake_run_query
+        server._callback_handlers = {
+            action: bot.functools.partial(server._run_result_action, action) for action in bot.RESULT_ACTIONS
+        }
+        markup = await server._query_keyboard("Marina Gate")
+
+        for data in (markup.inline_keyboard[1][1].callback_data, "mortgage_JBR"):
+            query = SimpleNamespace(
+                data=data, from_user=SimpleNamespace(id=5), answer=record,
+                edit_message_text=record, message=SimpleNamespace(reply_text=record),
+            )
+            await server.handle_callback(SimpleNamespace(callback_query=query), None)
+
+        assert prompts == [
+            bot.RESULT_ACTIONS["websearch"][1].format("Marina Gate"),
+            bot.RESULT_ACTIONS["mortgage"][1].format("JBR"),
+        ]
+        assert mock_query_response.response in replies
+
+    @pytest.mark.asyncio
+    async def test_unit_limit_reached_short_circuits(self, monkeypatch):
+        """A user at their cap is rejected again without another lookup."""
+        from datetime import date
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        lookups = []
+
+        async def fake_get_user_data(self, user_id):
+            lookups.append(user_id)
+            return {"tier": "basic", "queries_today": 20, "last_reset": date.today()}
+
+        monkeypatch.setattr(bot.TelegramBotServer, "_get_user_data", fake_get_user_data)
+        monkeypatch.setattr(bot, "_limit_reached", type(bot._limit_reached)())
+        server = object.__new__(bot.TelegramBotServer)
+        server._limit_hits = []
+
+        assert await server.check_query_limit(99) is False
+        assert await server.check_query_limit(99) is False
+        assert lookups == [99]
+        assert server._limit_hits == [(99, "basic", 20), (99, "basic", 20)]
+
+    @pytest.mark.asyncio
+    async def test_unit_run_query_coalesces_duplicates(self, monkeypatch, mock_query_response):
+        """Identical standalone queries in flight share one handle_query call."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        calls = []
+        release = asyncio.Event()
+
+        async def fake_handle_query(query, user_id="anonymous", conversation_context=None):
+            calls.append((query, conversation_context))
+            await release.wait()
+            return mock_query_response
+
+        monkeypatch.setattr(bot, "handle_query", fake_handle_query)
+        server = object.__new__(bot.TelegramBotServer)
+        server._query_slots = asyncio.Semaphore(4)
+
+        first = asyncio.create_task(server.run_query("Analyze Marina Gate", "1"))
+        second = asyncio.create_task(server.run_query("analyze  marina gate", "2"))
+        followup = asyncio.create_task(server.run_query("analyze marina gate", "3", "ctx"))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, second, followup)
+
+        assert all(r is mock_query_response for r in results)
+        # The follow-up runs inline, ahead of the shared call's task
+        assert len(calls) == 2
+        assert sorted(calls, key=str) == sorted(
+            [("Analyze Marina Gate", None), ("analyze marina gate", "ctx")], key=str
+        )
+        await asyncio.sleep(0)
+        from shared import bot_core
+        assert bot_core._inflight_queries == {}
+
+    def test_unit_admin_ids_skip_malformed_entries(self):
+        """Padded entries are accepted and malformed ones ignored."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        assert bot._parse_admin_ids(" 123, 456 ,,abc,7x8") == frozenset({123, 456})
+        assert bot._parse_admin_ids("") == frozenset()
+
+    @pytest.mark.asyncio
+    async def test_unit_progress_failure_cancels_query(self):
+        """A query whose progress note couldn't be sent doesn't keep running."""
+        from types import SimpleNamespace
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        cancelled = []
+
+        async def slow_query():
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def failing_reply(text):
+            await asyncio.sleep(0)
+            raise RuntimeError("network down")
+
+        update = SimpleNamespace(message=SimpleNamespace(reply_text=failing_reply))
+        server = object.__new__(bot.TelegramBotServer)
+
+        with pytest.raises(RuntimeError):
+            await server._run_with_progress(update, slow_query())
+        await asyncio.sleep(0)
+        assert cancelled == [True]
+
+    @pytest.mark.asyncio
+    async def test_unit_metrics_flushed_in_batches(self, monkeypatch):
+        """Command counts and the conversation gauge are pushed once per flush."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot"))
+        import bot
+
+        recorded, gauge = [], []
+        monkeypatch.setattr(bot, "record_command_metrics", lambda c, n=1: recorded.append((c, n)))
+        monkeypatch.setattr(bot, "update_active_conversations", gauge.append)
+        server = object.__new__(bot.TelegramBotServer)
+        server._command_counts = {}
+        server._limit_hits = []
+        server._sessions_changed = False
+        server._metrics_task = None
+        server.conversation_store = bot.ConversationStore()
+
+        await server._start_metrics_flusher(None)
+        for _ in range(3):
+            server._record_command("help")
+        server._mark_sessions_changed()
+        server._flush_metrics()
+        server._flush_metrics()
+        server._record_command("new")
+        # Stopping cancels the loop and pushes what was still buffered
+        await server._stop_metrics_flusher(None)
+        server.conversation_store.shutdown()
+
+        assert server._metrics_task is None
+        assert recorded == [("help", 3), ("new", 1)]
+        assert gauge == [0]
+
     def test_unit_subscription_tiers(self):
         """Verify tier structure is correct."""
         # Import bot tiers via exec to avoid TOKEN requirement
@@ -1335,3 +1797,605 @@ class TestHandleQueryE2E:
         )
         assert hasattr(result, "response")
         assert "get_rental_comps" in result.tools_used
+
+
+# =====================================================
+# 25. OBSERVABILITY METRICS (unit)
+# =====================================================
+
+class TestMetricsTracker:
+    """Validate in-memory metrics aggregation."""
+
+    def test_unit_user_stats_indexed(self):
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        tracker.record_query("u1", "q", True, 100.0, 0.01, ["a"])
+        tracker.record_query("u2", "q", False, 300.0, 0.02, [])
+        tracker.record_query("u1", "q", False, 200.0, 0.03, ["b"])
+        stats = tracker.get_user_stats("u1")
+        assert stats["queries"] == 2
+        assert stats["success_rate"] == "50.0%"
+        assert stats["avg_duration_ms"] == "150"
+        assert tracker.get_user_stats("nobody")["queries"] == 0
+
+    def test_unit_user_stats_window_eviction(self):
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        tracker.max_recent = 2
+        for duration in (100.0, 200.0, 400.0):
+            tracker.record_query("u1", "q", True, duration, 0.01, [])
+        stats = tracker.get_user_stats("u1")
+        assert stats["queries"] == 2
+        assert stats["avg_duration_ms"] == "300"
+
+    def test_unit_user_stats_follow_global_window(self):
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        tracker.max_recent = 3
+        tracker.record_query("u1", "q", True, 100.0, 0.01, [])
+        for user_id in ("u2", "u3", "u4"):
+            tracker.record_query(user_id, "q", True, 100.0, 0.01, [])
+        # u1's only query left the global last-3 window, and its entry with it
+        assert tracker.get_user_stats("u1")["queries"] == 0
+        assert set(tracker._user_window) == {"u2", "u3", "u4"}
+
+    def test_unit_empty_message_errors_counted(self):
+        import asyncio
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        tracker.record_query("u1", "q", False, 100.0, 0.0, [], error=asyncio.TimeoutError())
+        assert tracker.errors_by_type["TimeoutError"] == 1
+        assert tracker.recent_queries[-1].error == "TimeoutError"
+
+    def test_unit_cost_calculator_rates(self):
+        from observability import CostCalculator
+        assert CostCalculator.calculate_cost("claude-opus-4-6", 1_000_000, 0) == 15.0
+        unknown = CostCalculator.calculate_cost("unknown-model", 1000, 500)
+        sonnet = CostCalculator.calculate_cost("claude-sonnet-4-20250514", 1000, 500)
+        assert unknown == sonnet
+
+    def test_unit_record_query_metrics_reuses_children(self):
+        from observability import record_query_metrics, _bound_children, tool_usage
+        record_query_metrics(True, 1.0, 0.01, "m", 10, 5, ["t1", "t1"])
+        assert (tool_usage, ("t1", "success")) in _bound_children
+
+    def test_unit_record_prompt_cache_tokens(self):
+        from observability import record_prompt_cache_tokens, _bound_children, tokens_used
+        record_prompt_cache_tokens("m-cache", 1200, 0)
+        assert (tokens_used, ("cache_read", "m-cache")) in _bound_children
+        assert (tokens_used, ("cache_write", "m-cache")) not in _bound_children
+
+    def test_unit_query_metrics_timestamp(self):
+        from observability import QueryMetrics
+        q = QueryMetrics("u1", "q", True, 1.0, 0.0, [], timestamp_epoch=86400.25)
+        assert q.timestamp == "1970-01-02T00:00:00.250Z"
+
+    def test_unit_response_time_summary(self):
+        import random
+        from observability import _response_time_summary
+        times = [float(random.randint(1, 5000)) for _ in range(1000)]
+        ordered = sorted(times)
+        avg, p50, p95, p99 = _response_time_summary(times)
+        assert abs(avg - sum(times) / len(times)) < 1e-6
+        assert (p50, p95, p99) == (ordered[500], ordered[950], ordered[990])
+        assert _response_time_summary([]) == (0, 0, 0, 0)
+
+    def test_unit_prometheus_metrics_cached_between_scrapes(self):
+        from observability import get_prometheus_metrics, record_query_metrics
+        record_query_metrics(True, 1.0, 0.01, "m", 10, 5, ["t1"])
+        first = get_prometheus_metrics()
+        assert "dubai_estate" in first
+        assert get_prometheus_metrics() is first
+
+    def test_unit_summary_top_tools(self):
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        for i in range(8):
+            tracker.record_query(f"u{i}", "q", True, 10.0, 0.0, [f"t{j}" for j in range(i + 1)])
+        top = tracker.get_summary()["most_used_tools"]
+        assert list(top) == ["t0", "t1", "t2", "t3", "t4"]
+        assert top["t0"] == 8
+
+    def test_unit_record_query_error_types(self):
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        tracker.record_query("u1", "q", False, 1.0, 0.0, [], error=ValueError("bad"))
+        tracker.record_query("u1", "q", False, 1.0, 0.0, [], error="timeout", error_type="TimeoutError")
+        tracker.record_query("u1", "q", False, 1.0, 0.0, [], error="boom")
+        assert tracker.errors_by_type == {"ValueError": 1, "TimeoutError": 1, "Unknown": 1}
+        assert tracker.recent_queries[0].error == "bad"
+        assert tracker.recent_queries[1].error_type == "TimeoutError"
+
+    def test_unit_query_logs_skip_disabled_level(self, caplog):
+        import logging
+        import time
+        from observability import log_query_complete
+        logger = logging.getLogger("test_observability_quiet")
+        logger.setLevel(logging.WARNING)
+        with caplog.at_level(logging.WARNING, logger="test_observability_quiet"):
+            log_query_complete(logger, "u1", "q", time.time(), [])
+            log_query_complete(logger, "u1", "q", time.time(), [], success=False, error=ValueError("x"))
+        assert [r.message for r in caplog.records] == ["Query failed"]
+        assert caplog.records[0].error_type == "ValueError"
+
+    def test_unit_json_formatter_payload(self):
+        import logging
+        from observability import JSONFormatter
+        record = logging.LogRecord("x", logging.INFO, "p", 1, "hello %s", ("w",), None)
+        record.user_id = "u1"
+        record.opaque = object()
+        data = json.loads(JSONFormatter().format(record))
+        assert data["message"] == "hello w"
+        assert data["user_id"] == "u1"
+        assert data["timestamp"].endswith("Z")
+        assert isinstance(data["opaque"], str)
+
+    def test_unit_cache_metrics_use_bound_children(self):
+        from observability import (
+            record_cache_hit, record_cache_miss, _bound_children,
+            cache_hits_total, cache_misses_total,
+        )
+        record_cache_hit("get_market_trends")
+        record_cache_miss("get_market_trends")
+        assert (cache_hits_total, ("get_market_trends",)) in _bound_children
+        assert (cache_misses_total, ("get_market_trends",)) in _bound_children
+
+    def test_unit_summary_raw_numbers(self):
+        from observability import MetricsTracker, format_summary
+        tracker = MetricsTracker()
+        tracker.record_query("u1", "q", True, 100.0, 0.5, [])
+        tracker.record_query("u1", "q", False, 300.0, 0.5, [])
+        summary = tracker.get_summary()
+        assert summary["success_rate"] == 0.5
+        assert summary["total_cost_usd"] == 1.0
+        assert summary["response_times"]["avg_ms"] == 200.0
+        display = format_summary(summary)
+        assert display["success_rate"] == "50.0%"
+        assert display["total_cost_usd"] == "$1.0000"
+        assert display["response_times"]["p50_ms"] == "300"
+
+    def test_unit_response_time_column_grows(self):
+        from observability import MetricsTracker
+        tracker = MetricsTracker()
+        for i in range(2500):
+            tracker.record_query("u1", "q", True, float(i), 0.0, [])
+        assert len(tracker.response_times) == 2500
+        assert tracker.response_times[-1] == 2499.0
+        assert tracker.get_summary()["response_times"]["p50_ms"] == 1250.0
+        tracker.response_times = []
+        assert tracker.get_summary()["response_times"]["avg_ms"] == 0
+
+
+# =====================================================
+# 26. PDF REPORT GENERATOR (unit)
+# =====================================================
+
+SAMPLE_ANALYSIS = (
+    "### Verdict\n\n"
+    "Investment Score: 72/100 — **GOOD BUY** 🏙️\n\n"
+    "Price score: 22/30, Yield score: 19/25, Liquidity: 15/20\n\n"
+    "Expect 7.2% gross yield and 5.1% net yield at AED 1,450/sqft.\n\n"
+    "*Chiller* costs are moderate ━━━ watch the service fee."
+)
+
+
+class TestPDFGenerator:
+    """Validate analysis parsing and PDF rendering."""
+
+    def test_unit_parse_score_from_text(self):
+        from pdf_generator.generator import _parse_score_from_text
+        data = _parse_score_from_text(SAMPLE_ANALYSIS)
+        assert data["score"] == 72
+        assert data["recommendation"] == "GOOD BUY"
+        assert data["gross_yield"] == 7.2
+        assert data["net_yield"] == 5.1
+        assert data["price_per_sqft"] == 1450
+
+    def test_unit_markdown_to_markup(self):
+        from pdf_generator.generator import _markdown_to_markup
+        assert _markdown_to_markup("a **b *c* d** e") == "a <b>b <i>c</i> d</b> e"
+        assert _markdown_to_markup("yield < 5% & rising 🏙 ━━") == "yield &lt; 5% &amp; rising  --"
+        # Overlapping emphasis still yields balanced tags
+        assert _markdown_to_markup("*a **b* c**") == "<i>a </i><i>b</i> c**"
+
+    def test_unit_markdown_to_markup_allowed_html(self):
+        from reportlab.platypus import Paragraph
+        from pdf_generator.generator import _STYLES, _markdown_to_markup
+        assert _markdown_to_markup("<b>x *y*</b><br>z") == "<b>x <i>y</i></b><br/>z"
+        # Unpaired or unknown tags stay escaped text
+        assert _markdown_to_markup("a <b>b <script>") == "a &lt;b&gt;b &lt;script&gt;"
+        for text in ("<b>x *y</b> z*", "<i>a **b</i> c**", "a </b> <b>"):
+            Paragraph(_markdown_to_markup(text), _STYLES["BodyText2"])
+
+    @pytest.mark.asyncio
+    async def test_unit_generate_report_bytes(self):
+        from pdf_generator import generate_report
+        pdf = await generate_report(SAMPLE_ANALYSIS, "Analyze a 1BR in JVC", "Tester", ["analyze_investment"])
+        assert pdf.startswith(b"%PDF")
+        assert len(pdf) > 1000
+
+    @pytest.mark.asyncio
+    async def test_unit_generate_report_memoized(self, monkeypatch):
+        from pdf_generator import generator
+        calls = []
+
+        def fake_build(*args):
+            calls.append(args)
+            return b"%PDF-fake"
+
+        monkeypatch.setattr(generator, "_build_pdf_sync", fake_build)
+        monkeypatch.setattr(generator, "_pdf_cache", generator.OrderedDict())
+        first = await generator.generate_report("text", "query", "Tester", ["a"])
+        second = await generator.generate_report("text", "query", "Tester", ["a"])
+        await generator.generate_report("text", "query", "Tester", ["b"])
+        assert first == second == b"%PDF-fake"
+        assert len(calls) == 2
+
+    def test_unit_pooled_charts_render_consistently(self):
+        from pdf_generator.charts import create_pillar_radar, create_score_gauge
+        scores = {"Price": 20, "Yield": 18, "Liquidity": 14, "Quality": 10, "Chiller": 6}
+        first = create_pillar_radar(scores).getvalue()
+        create_score_gauge(40)
+        assert create_pillar_radar(scores).getvalue() == first
+
+    def test_unit_vector_chart_flowable(self):
+        pytest.importorskip("svglib")
+        from reportlab.graphics.shapes import Drawing
+        from pdf_generator.charts import create_score_gauge
+        from pdf_generator.generator import _chart_flowable
+        svg = create_score_gauge(72, fmt="svg")
+        assert svg.getvalue().lstrip().startswith(b"<?xml")
+        drawing = _chart_flowable(svg, 200, 120)
+        assert isinstance(drawing, Drawing)
+        assert (drawing.width, drawing.height) == (200, 120)
+
+
+# =====================================================
+# 27. STRIPE WEBHOOKS (unit)
+# =====================================================
+
+class TestPayments:
+    """Validate Stripe webhook handling without a live Stripe account."""
+
+    @staticmethod
+    def _signed(monkeypatch, event: dict):
+        import hashlib
+        import hmac
+        import time
+        import payments
+        secret = b"whsec_test"
+        monkeypatch.setattr(payments, "WEBHOOK_SECRET", secret.decode())
+        monkeypatch.setattr(payments, "_WEBHOOK_HMAC", hmac.new(secret, digestmod=hashlib.sha256))
+        payload = json.dumps(event).encode()
+        timestamp = str(int(time.time()))
+        sig = hmac.new(secret, timestamp.encode() + b"." + payload, hashlib.sha256).hexdigest()
+        return payload, f"t={timestamp},v1={sig}"
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_rejects_bad_signature(self, monkeypatch):
+        import payments
+        payload, header = self._signed(monkeypatch, {"id": "evt_bad_sig", "type": "x", "data": {"object": {}}})
+        result = await payments.handle_webhook_event(payload + b" ", header)
+        assert result == {"error": "Invalid signature"}
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_duplicate_event_short_circuits(self, monkeypatch):
+        import payments
+        event = {
+            "id": "evt_test_duplicate",
+            "type": "invoice.upcoming",
+            "data": {"object": {}},
+        }
+        payload, header = self._signed(monkeypatch, event)
+        monkeypatch.setattr(payments, "_seen_events", payments.OrderedDict())
+
+        first = await payments.handle_webhook_event(payload, header)
+        second = await payments.handle_webhook_event(payload, header)
+        await payments.wait_for_webhook_tasks()
+        assert first["status"] == "accepted"
+        assert second == {"status": "duplicate", "event_id": "evt_test_duplicate"}
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_processes_in_background(self, monkeypatch):
+        import payments
+        handled = []
+
+        async def fake_handler(data, event_id):
+            handled.append(event_id)
+            return {"status": "payment_failed"}
+
+        async def fake_push(queue, item):
+            return True
+
+        async def fake_remove(queue, item):
+            removed.append(item)
+
+        removed = []
+        event = {"id": "evt_test_background", "type": "invoice.payment_failed", "data": {"object": {}}}
+        payload, header = self._signed(monkeypatch, event)
+        monkeypatch.setattr(payments, "_handle_payment_failed", fake_handler)
+        monkeypatch.setattr(payments, "push_pending", fake_push)
+        monkeypatch.setattr(payments, "remove_pending", fake_remove)
+
+        result = await payments.handle_webhook_event(payload, header)
+        assert result == {
+            "status": "accepted",
+            "event_id": "evt_test_background",
+            "event_type": "invoice.payment_failed",
+        }
+        await payments.wait_for_webhook_tasks()
+        assert handled == ["evt_test_background"]
+        assert removed == [payload.decode()]
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_background_failure_retried(self, monkeypatch):
+        import payments
+        attempts, removed = [], []
+
+        async def flaky_handler(data, event_id):
+            attempts.append(event_id)
+            if len(attempts) < 3:
+                raise RuntimeError("db down")
+            return {"status": "payment_failed"}
+
+        async def fake_push(queue, item):
+            return True
+
+        async def fake_remove(queue, item):
+            removed.append(item)
+
+        event = {"id": "evt_test_retry", "type": "invoice.payment_failed", "data": {"object": {}}}
+        payload, header = self._signed(monkeypatch, event)
+        monkeypatch.setattr(payments, "_seen_events", payments.OrderedDict())
+        monkeypatch.setattr(payments, "_handle_payment_failed", flaky_handler)
+        monkeypatch.setattr(payments, "push_pending", fake_push)
+        monkeypatch.setattr(payments, "remove_pending", fake_remove)
+        monkeypatch.setattr(payments, "WEBHOOK_RETRY_BASE_SECONDS", 0.001)
+
+        await payments.handle_webhook_event(payload, header)
+        for _ in range(100):
+            if removed:
+                break
+            await asyncio.sleep(0.005)
+        await payments.wait_for_webhook_tasks()
+
+        assert attempts == ["evt_test_retry"] * 3
+        assert removed == [payload.decode()]
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_without_redis_processes_inline(self, monkeypatch):
+        import payments
+
+        async def failing_handler(data, event_id):
+            raise RuntimeError("db down")
+
+        async def no_redis(queue, item):
+            return False
+
+        async def fake_unmark(event_id):
+            pass
+
+        event = {"id": "evt_test_inline", "type": "invoice.payment_failed", "data": {"object": {}}}
+        payload, header = self._signed(monkeypatch, event)
+        monkeypatch.setattr(payments, "_seen_events", payments.OrderedDict())
+        monkeypatch.setattr(payments, "_handle_payment_failed", failing_handler)
+        monkeypatch.setattr(payments, "push_pending", no_redis)
+        monkeypatch.setattr(payments, "unmark_stripe_event_processed", fake_unmark)
+
+        # Not acknowledged, so Stripe retries it
+        assert await payments.handle_webhook_event(payload, header) == {"error": "Event processing failed"}
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_failure_allows_redelivery(self, monkeypatch):
+        import payments
+        attempts, unmarked = [], []
+
+        async def failing_handler(data, event_id):
+            attempts.append(event_id)
+            raise RuntimeError("db down")
+
+        async def fake_unmark(event_id):
+            unmarked.append(event_id)
+
+        event = {"id": "evt_test_failure", "type": "invoice.payment_failed", "data": {"object": {}}}
+        payload, header = self._signed(monkeypatch, event)
+        monkeypatch.setattr(payments, "_seen_events", payments.OrderedDict())
+        monkeypatch.setattr(payments, "_handle_payment_failed", failing_handler)
+        monkeypatch.setattr(payments, "unmark_stripe_event_processed", fake_unmark)
+
+        await payments.handle_webhook_event(payload, header)
+        await payments.wait_for_webhook_tasks()
+        retry = await payments.handle_webhook_event(payload, header)
+        await payments.wait_for_webhook_tasks()
+
+        assert retry.get("status") != "duplicate"
+        assert attempts == ["evt_test_failure", "evt_test_failure"]
+        assert unmarked == ["evt_test_failure", "evt_test_failure"]
+
+    @pytest.mark.asyncio
+    async def test_unit_webhook_mark_failure_allows_redelivery(self, monkeypatch):
+        import payments
+        marks = []
+
+        async def flaky_mark(event_id):
+            marks.append(event_id)
+            if len(marks) == 1:
+                raise RuntimeError("pool timeout")
+            return True
+
+        async def fake_handler(data, event_id):
+            return {"status": "ok"}
+
+        event = {"id": "evt_test_mark_failure", "type": "invoice.payment_failed", "data": {"object": {}}}
+        payload, header = self._signed(monkeypatch, event)
+        monkeypatch.setattr(payments, "_seen_events", payments.OrderedDict())
+        monkeypatch.setattr(payments, "mark_stripe_event_processed", flaky_mark)
+        monkeypatch.setattr(payments, "_handle_payment_failed", fake_handler)
+
+        with pytest.raises(RuntimeError):
+            await payments.handle_webhook_event(payload, header)
+        retry = await payments.handle_webhook_event(payload, header)
+        await payments.wait_for_webhook_tasks()
+
+        assert retry["status"] == "accepted"
+        assert marks == ["evt_test_mark_failure", "evt_test_mark_failure"]
+
+    @pytest.mark.asyncio
+    async def test_unit_subscription_events_flush_in_batches(self, monkeypatch):
+        import payments
+        batches = []
+
+        async def fake_bulk(events):
+            batches.append(list(events))
+
+        monkeypatch.setattr(payments, "bulk_apply_subscription_events", fake_bulk)
+        payments.start_subscription_event_flusher()
+        await asyncio.gather(*(
+            payments._submit_subscription_event(user_id, "pro", "subscription_updated", f"evt_{user_id}")
+            for user_id in (1, 2, 3)
+        ))
+        # Each submission returned only after its batch was written
+        assert [args[0] for batch in batches for args in batch] == [1, 2, 3]
+        await payments.stop_subscription_event_flusher()
+
+        assert len(batches) == 1
+
+    @pytest.mark.asyncio
+    async def test_unit_subscription_event_flush_failure_raises(self, monkeypatch):
+        import payments
+
+        async def failing_bulk(events):
+            raise RuntimeError("bulk failed")
+
+        async def failing_apply(*args):
+            raise RuntimeError("apply failed")
+
+        monkeypatch.setattr(payments, "bulk_apply_subscription_events", failing_bulk)
+        monkeypatch.setattr(payments, "apply_subscription_event", failing_apply)
+        payments.start_subscription_event_flusher()
+        try:
+            with pytest.raises(RuntimeError, match="apply failed"):
+                await payments._submit_subscription_event(4, "pro", "subscription_updated", "evt_4")
+        finally:
+            await payments.stop_subscription_event_flusher()
+
+    @pytest.mark.asyncio
+    async def test_unit_checkout_reuses_cached_customer(self, monkeypatch):
+        import payments
+        lookups = []
+        sessions = []
+
+        async def fake_get_user(user_id):
+            lookups.append(user_id)
+            return {"stripe_customer_id": "cus_123"}
+
+        class FakeSession:
+            url = "https://checkout.test/session"
+
+        def fake_create(**params):
+            sessions.append(params)
+            return FakeSession()
+
+        monkeypatch.setattr(payments, "_STRIPE_CONFIGURED", True)
+        monkeypatch.setitem(payments.PRICE_IDS, "pro", "price_pro")
+        monkeypatch.setattr(payments, "_customer_ids", {})
+        monkeypatch.setattr(payments, "get_user", fake_get_user)
+        monkeypatch.setattr(payments.stripe.checkout.Session, "create", fake_create)
+
+        for _ in range(2):
+            assert await payments.create_checkout_session(42, "pro") == FakeSession.url
+        assert lookups == [42]
+        assert [s["customer"] for s in sessions] == ["cus_123", "cus_123"]
+
+
+# =====================================================
+# 28. SHARED BOT CORE (unit)
+# =====================================================
+
+class TestBotCore:
+    """Rate limiting in shared/bot_core.py."""
+
+    @pytest.mark.asyncio
+    async def test_unit_rate_limit_uses_cache(self, monkeypatch):
+        from datetime import date
+        from shared import bot_core
+        lookups = []
+
+        async def fake_get_user(user_id):
+            lookups.append(user_id)
+            return {"tier": "basic", "queries_today": 5, "last_reset": date.today()}
+
+        monkeypatch.setattr(bot_core, "is_db_available", lambda: True)
+        monkeypatch.setattr(bot_core, "get_user", fake_get_user)
+        monkeypatch.setattr(bot_core, "_rate_limit_cache", type(bot_core._rate_limit_cache)())
+
+        assert await bot_core.check_rate_limit(7) == (True, 15)
+        assert await bot_core.check_rate_limit(7) == (True, 15)
+        assert lookups == [7]
+
+        # A counter bump from process_query refreshes the cached entry
+        bot_core._cache_rate_limit(7, {"tier": "basic", "queries_today": 20, "last_reset": date.today()})
+        assert await bot_core.check_rate_limit(7) == (False, 0)
+        assert lookups == [7]
+
+    @pytest.mark.asyncio
+    async def test_unit_process_query_defers_writes(self, monkeypatch):
+        from datetime import date
+        from types import SimpleNamespace
+        from shared import bot_core
+        writes = []
+
+        async def fake_handle_query(query, user_id=None, conversation_context=None):
+            return SimpleNamespace(response="ok", tools_used=[])
+
+        async def fake_increment(user_id):
+            writes.append("increment")
+            return {"tier": "basic", "queries_today": 6, "last_reset": date.today()}
+
+        async def fake_log(**kwargs):
+            writes.append("log")
+
+        monkeypatch.setattr(bot_core, "is_db_available", lambda: True)
+        monkeypatch.setattr(bot_core, "handle_query", fake_handle_query)
+        monkeypatch.setattr(bot_core, "increment_query_count", fake_increment)
+        monkeypatch.setattr(bot_core, "log_conversation", fake_log)
+        monkeypatch.setattr(bot_core, "_rate_limit_cache", type(bot_core._rate_limit_cache)())
+
+        assert await bot_core.process_query(8, "hello") == ("ok", [])
+        assert writes == []
+        await bot_core.wait_for_background_writes()
+        assert sorted(writes) == ["increment", "log"]
+        assert bot_core._rate_limit_cache[8][2] == 6
+
+    @pytest.mark.asyncio
+    async def test_unit_run_query_coalesces_duplicates(self, monkeypatch):
+        from types import SimpleNamespace
+        from shared import bot_core
+        calls = []
+        release = asyncio.Event()
+
+        async def fake_handle_query(query, user_id=None, conversation_context=None):
+            calls.append((query, conversation_context))
+            await release.wait()
+            return SimpleNamespace(response="ok", tools_used=[])
+
+        monkeypatch.setattr(bot_core, "handle_query", fake_handle_query)
+        tasks = [
+            asyncio.create_task(bot_core.run_query_coalesced("Trends Business Bay", "1")),
+            asyncio.create_task(bot_core.run_query_coalesced("trends  business bay", "2")),
+            asyncio.create_task(bot_core.run_query_coalesced("trends business bay", "3", "ctx")),
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        first, second, followup = await asyncio.gather(*tasks)
+
+        # The two standalone callers share one call, so one result object
+        assert first is second
+        assert followup is not first
+        # The follow-up runs inline, ahead of the shared call's task
+        assert len(calls) == 2
+        assert sorted(calls, key=str) == sorted(
+            [("Trends Business Bay", None), ("trends business bay", "ctx")], key=str
+        )
+        await asyncio.sleep(0)
+        assert bot_core._inflight_queries == {}
@@ -11,7 +11,7 @@ import os
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from observability import metrics_tracker, user_analytics
+from observability import metrics_tracker, user_analytics, format_summary
 import json
 from datetime import datetime
 
@@ -27,7 +27,7 @@ def print_metrics():
     """Display application metrics"""
     print_header("📊 APPLICATION METRICS")
 
-    summary = metrics_tracker.get_summary()
+    summary = format_summary(metrics_tracker.get_summary())
 
     print(f"\n🔢 Query Statistics:")
     print(f"   Total Queries:      {summary['total_queries']}")